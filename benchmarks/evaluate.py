@@ -0,0 +1,230 @@
+"""
+Evaluates matcher configurations side by side. Each configuration is a set of
+CLI arguments, run against the same corpus of labeled synthetic ledgers
+through the full pipeline (served by the stub APIs). Reports the precision
+and recall of the groups created along with the prompt tokens, wall time and
+API calls each configuration spent.
+
+By default the stub model is an oracle answering from the labels, ignoring
+the prompt and the model name, so only the deterministic stages (local
+matching, clustering, retrieval and prompt batching) are compared. To compare
+prompt or model changes, `--fixtures` replays real responses recorded for each
+exact prompt and model instead. Prompts without a recorded response are
+answered with no groups and reported as fixture misses. Missing responses are
+recorded from a real OpenAI compatible API with `--record-base-url`, using
+OPENAI_API_KEY.
+
+Fails when a configuration is less accurate than the first (baseline)
+configuration, so a change made for speed or cost can show it didn't cost
+accuracy.
+
+    python -m benchmarks.evaluate --sizes 100,1000 --seeds 0,1,2 \\
+        --config retrieval="--retrieval-top-k 8"
+
+    python -m benchmarks.evaluate --fixtures benchmarks/fixtures \\
+        --record-base-url https://api.openai.com/v1 \\
+        --config default= --config gpt-4o="--model gpt-4o"
+"""
+
+import argparse
+import logging
+import os
+import shlex
+import sys
+from dataclasses import dataclass, field
+
+from benchmarks.run import Result, run_pipeline
+from benchmarks.stubs import ModelFixtures
+from benchmarks.synthetic import generate
+
+CONFIGS = {
+    "default": [],
+    "retrieval": ["--retrieval-top-k", "8"],
+    "small-prompts": ["--max-prompt-tokens", "3000"],
+    "fast-model": ["--fast-model", "gpt-4o-mini"],
+}
+"""
+Configurations evaluated when none are given. The first is the baseline.
+"""
+
+
+@dataclass
+class Evaluation:
+    name: str
+    args: list[str]
+    results: list[Result] = field(default_factory=list)
+
+    @property
+    def correct(self) -> int:
+        return sum(r.correct for r in self.results)
+
+    @property
+    def grouped(self) -> int:
+        return sum(r.grouped for r in self.results)
+
+    @property
+    def expected(self) -> int:
+        return sum(r.expected for r in self.results)
+
+    @property
+    def precision(self) -> float:
+        """
+        How many of the groups created were exactly the expected group
+        """
+        return self.correct / self.grouped if self.grouped else 1.0
+
+    @property
+    def recall(self) -> float:
+        """
+        How many of the expected groups were created
+        """
+        return self.correct / self.expected if self.expected else 1.0
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(r.prompt_tokens for r in self.results)
+
+    @property
+    def wall_time(self) -> float:
+        return sum(r.wall_time for r in self.results)
+
+    @property
+    def fixture_misses(self) -> int:
+        return sum(r.fixture_misses for r in self.results)
+
+    def api_calls(self, service: str) -> int:
+        return sum(
+            count
+            for r in self.results
+            for endpoint, count in r.api_calls.items()
+            if endpoint.startswith(f"{service}.")
+        )
+
+
+def parse_config(value: str) -> tuple[str, list[str]]:
+    """
+    Parses a `NAME=ARGS` configuration, where ARGS are CLI arguments
+    """
+    name, _, args = value.partition("=")
+
+    return name, shlex.split(args)
+
+
+def print_report(evaluations: list[Evaluation], fixtures: bool = False):
+    header = [
+        "config",
+        "precision",
+        "recall",
+        "correct/grouped/expected",
+        "prompt tokens",
+        "wall (s)",
+        "lunchmoney",
+        "openai",
+        *(["fixture misses"] if fixtures else []),
+    ]
+    rows = [
+        [
+            e.name,
+            f"{e.precision:.3f}",
+            f"{e.recall:.3f}",
+            f"{e.correct}/{e.grouped}/{e.expected}",
+            str(e.prompt_tokens),
+            f"{e.wall_time:.2f}",
+            str(e.api_calls("lunchmoney")),
+            str(e.api_calls("openai")),
+            *([str(e.fixture_misses)] if fixtures else []),
+        ]
+        for e in evaluations
+    ]
+
+    widths = [max(len(row[i]) for row in [header, *rows]) for i in range(len(header))]
+
+    for row in [header, *rows]:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes",
+        default="100,1000",
+        help="Comma separated candidate transaction counts of each ledger",
+    )
+    parser.add_argument(
+        "--seeds",
+        default="0,1,2",
+        help="Comma separated seeds, a ledger is generated for each seed and size",
+    )
+    parser.add_argument(
+        "--config",
+        action="append",
+        type=parse_config,
+        help="A NAME=ARGS configuration to evaluate, may be repeated. The first is the baseline",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.0,
+        help="How far precision and recall may drop below the baseline before failing",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds each stub API request takes",
+    )
+    parser.add_argument(
+        "--fixtures",
+        help="Directory of recorded model responses to replay instead of answering from the "
+        "labels, an --llm-cache-dir may be used",
+    )
+    parser.add_argument(
+        "--record-base-url",
+        help="OpenAI compatible API to record the responses missing from --fixtures from, "
+        "authenticated with OPENAI_API_KEY",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.record_base_url and not args.fixtures:
+        parser.error("--record-base-url requires --fixtures")
+
+    fixtures = None
+    if args.fixtures:
+        fixtures = ModelFixtures(
+            args.fixtures, args.record_base_url, os.environ.get("OPENAI_API_KEY")
+        )
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    configs = args.config or list(CONFIGS.items())
+    evaluations = [Evaluation(name, config_args) for name, config_args in configs]
+
+    # Every configuration sees exactly the same ledgers
+    for size in (int(s) for s in args.sizes.split(",")):
+        for seed in (int(s) for s in args.seeds.split(",")):
+            for evaluation in evaluations:
+                dataset = generate(size, seed=seed)
+                evaluation.results.append(
+                    run_pipeline(dataset, args.latency, evaluation.args, fixtures)
+                )
+
+    print_report(evaluations, fixtures is not None)
+
+    baseline, *others = evaluations
+    regressed = [
+        e
+        for e in others
+        if e.precision < baseline.precision - args.tolerance
+        or e.recall < baseline.recall - args.tolerance
+    ]
+
+    for evaluation in regressed:
+        print(f"{evaluation.name} is less accurate than {baseline.name}")
+
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmarks the cold start cost of the CLI entry point using `python -X
+importtime`. Most runs find nothing has changed, so the time spent importing
+before the first request matters more than anything else on them.
+
+Fails when the import takes longer than the budget, or when a library which
+should only be imported once it is needed is imported up front.
+
+    python -m benchmarks.importtime --budget-ms 1000
+"""
+
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+
+MODULE = "venmo_lunchmoney_ai.cli"
+"""
+The module imported by the entry point before a run starts
+"""
+
+LAZY_MODULES = ["openai", "telegram", "sentry_sdk"]
+"""
+Libraries which must not be imported until a run prompts the model or sends a
+notification
+"""
+
+IMPORTTIME_LINE = r"import time:\s+(?P<self>\d+) \|\s+(?P<cumulative>\d+) \| (?P<name>.*)$"
+
+
+def measure(module: str) -> dict[str, int]:
+    """
+    Imports the module in a fresh interpreter. Returns the cumulative import
+    time in microseconds of every module that was imported, keyed by the
+    module name. Nested imports are indented in the output, the names are
+    stripped of that indentation.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    timings: dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        match = re.match(IMPORTTIME_LINE, line)
+        if match:
+            timings[match.group("name").strip()] = int(match.group("cumulative"))
+
+    return timings
+
+
+def top_level(timings: dict[str, int], module: str) -> list[tuple[str, int]]:
+    """
+    The heaviest top level packages imported, excluding the module itself
+    """
+    packages: dict[str, int] = {}
+
+    for name, cumulative in timings.items():
+        package = name.split(".")[0]
+        if name == package and package != module.split(".")[0]:
+            packages[package] = cumulative
+
+    return sorted(packages.items(), key=lambda p: p[1], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--module", default=MODULE)
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=5,
+        help="How many times the import is measured, the median is reported",
+    )
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        help="Fail when the median import time is longer than this",
+    )
+    parser.add_argument("--top", type=int, default=10, help="How many packages to list")
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    total = statistics.median(run[args.module] for run in runs) / 1000
+
+    print(f"{args.module}: {total:.1f} ms (median of {args.runs} runs)")
+    for package, cumulative in top_level(runs[-1], args.module)[: args.top]:
+        print(f"  {package:<24} {cumulative / 1000:8.1f} ms")
+
+    failed = False
+
+    eager = [m for m in LAZY_MODULES if m in runs[-1]]
+    if eager:
+        print(f"Imported before they are needed: {', '.join(eager)}")
+        failed = True
+
+    if args.budget_ms is not None and total > args.budget_ms:
+        print(f"Import time is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Benchmarks the full matching pipeline offline. Each run generates a synthetic
+ledger, serves it from local stub Lunch Money, OpenAI and Telegram servers and
+runs the CLI against them, reporting wall time, API calls, prompt tokens and
+peak memory.
+
+    python -m benchmarks.run --sizes 10,100,1000 --latency 0.05
+"""
+
+import argparse
+import functools
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from unittest import mock
+from urllib.parse import urlparse
+
+from lunchable._config import APIConfig
+
+from benchmarks.stubs import ModelFixtures, StubServer
+from benchmarks.synthetic import (
+    REIMBURSED_CATEGORY,
+    REIMBURSEMENT_TAG,
+    VENMO_CATEGORY,
+    Dataset,
+    generate,
+)
+from venmo_lunchmoney_ai import cli
+from venmo_lunchmoney_ai.notify import create_bot
+
+
+@dataclass
+class Result:
+    candidates: int
+    wall_time: float
+    peak_memory: int
+    api_calls: dict[str, int]
+    prompt_tokens: int
+    grouped: int
+    correct: int
+    expected: int
+    fixture_misses: int
+
+
+def run_pipeline(
+    dataset: Dataset,
+    latency: float,
+    extra_args: list[str],
+    fixtures: ModelFixtures | None = None,
+) -> Result:
+    """
+    Runs the CLI once against stub servers for the dataset. The model is
+    answered from the `fixtures` when given, otherwise from the labels.
+    """
+    with StubServer(dataset, latency, fixtures) as stub, tempfile.TemporaryDirectory() as tmp:
+        url = urlparse(stub.url)
+
+        argv = [
+            "venmo-lunchmoney-ai",
+            "--lunchmoney-token=stub",
+            "--openai-token=stub",
+            f"--venmo-category={VENMO_CATEGORY}",
+            f"--reimbursed-category={REIMBURSED_CATEGORY}",
+            f"--reimbursement-tag={REIMBURSEMENT_TAG}",
+            "--telegram-token=stub",
+            "--telegram-channel=1",
+            f"--state-file={os.path.join(tmp, 'state.db')}",
+            *extra_args,
+        ]
+
+        patches = [
+            mock.patch.object(sys, "argv", argv),
+            mock.patch.object(APIConfig, "LUNCHMONEY_SCHEME", url.scheme),
+            mock.patch.object(APIConfig, "LUNCHMONEY_NETLOC", url.netloc),
+            mock.patch.dict(os.environ, {"OPENAI_BASE_URL": f"{stub.url}/v1"}),
+            mock.patch.object(
+                cli, "create_bot", functools.partial(create_bot, base_url=f"{stub.url}/bot")
+            ),
+        ]
+
+        for patch in patches:
+            patch.start()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+
+        try:
+            cli.run_cli()
+        finally:
+            wall_time = time.perf_counter() - start
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            for patch in reversed(patches):
+                patch.stop()
+
+        return Result(
+            candidates=len(dataset.candidates),
+            wall_time=wall_time,
+            peak_memory=peak_memory,
+            api_calls=dict(stub.calls),
+            prompt_tokens=stub.prompt_tokens,
+            grouped=len(stub.groups),
+            correct=stub.correct_groups,
+            expected=len(dataset.expected),
+            fixture_misses=stub.fixture_misses,
+        )
+
+
+def print_report(results: list[Result]):
+    endpoints = sorted(set(endpoint for r in results for endpoint in r.api_calls))
+
+    header = [
+        "candidates",
+        "wall (s)",
+        "peak MiB",
+        "prompt tokens",
+        "correct/grouped/expected",
+        *endpoints,
+    ]
+    rows = [
+        [
+            str(r.candidates),
+            f"{r.wall_time:.2f}",
+            f"{r.peak_memory / 1024 / 1024:.1f}",
+            str(r.prompt_tokens),
+            f"{r.correct}/{r.grouped}/{r.expected}",
+            *(str(r.api_calls.get(endpoint, 0)) for endpoint in endpoints),
+        ]
+        for r in results
+    ]
+
+    widths = [max(len(row[i]) for row in [header, *rows]) for i in range(len(header))]
+
+    for row in [header, *rows]:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes",
+        default="10,100,1000,10000",
+        help="Comma separated candidate transaction counts to benchmark",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds each stub API request takes",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args, extra_args = parser.parse_known_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        dataset = generate(size, seed=args.seed)
+        results.append(run_pipeline(dataset, args.latency, extra_args))
+
+    print_report(results)
+
+
+if __name__ == "__main__":
+    main()
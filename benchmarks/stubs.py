@@ -0,0 +1,497 @@
+import csv
+import io
+import json
+import math
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+from lunchable.models import TransactionObject
+from lunchable.models.transactions import TransactionChildObject
+
+from benchmarks.synthetic import VENMO_CATEGORY, Dataset
+from venmo_lunchmoney_ai.cache import ResponseCache, prompt_key
+from venmo_lunchmoney_ai.prompt import count_prompt_tokens
+
+RECORD_TIMEOUT = 300
+"""
+Seconds to wait for the real model while recording a fixture
+"""
+
+
+class ModelFixtures:
+    """
+    Real model responses replayed by the OpenAI stub, keyed by the
+    `prompt_key` of the model and messages. They are stored in the
+    `ResponseCache` format, so the `--llm-cache-dir` of a real run can be used
+    as fixtures, and never expire.
+
+    When an `upstream` OpenAI compatible API is given, prompts without a
+    fixture are sent to it and the response is recorded.
+    """
+
+    def __init__(self, directory: str, upstream: str | None = None, token: str | None = None):
+        self.cache = ResponseCache(directory, max_age=math.inf, max_size=sys.maxsize)
+        self.upstream = upstream
+        self.token = token
+
+    def response(self, request: dict) -> str | None:
+        """
+        The recorded response to a chat completion request, or None when
+        there is no fixture for it
+        """
+        key = prompt_key(request["model"], request["messages"])
+
+        content = self.cache.get(key)
+        if content is not None or self.upstream is None:
+            return content
+
+        response = httpx.post(
+            f"{self.upstream.rstrip('/')}/chat/completions",
+            json={k: v for k, v in request.items() if k not in ("stream", "stream_options")},
+            headers={"Authorization": f"Bearer {self.token}"},
+            timeout=RECORD_TIMEOUT,
+        )
+        response.raise_for_status()
+
+        message = response.json()["choices"][0]["message"]
+        if message.get("tool_calls"):
+            content = message["tool_calls"][0]["function"]["arguments"]
+        else:
+            content = message.get("content") or ""
+
+        self.cache.set(key, content)
+
+        return content
+
+
+class StubServer:
+    """
+    Serves the Lunch Money, OpenAI and Telegram APIs from a synthetic dataset
+    on a local port, waiting `latency` seconds before answering each request.
+
+    Every request is counted per endpoint, and the prompt tokens sent to the
+    OpenAI stub are tallied.
+
+    The OpenAI stub answers from the groups the dataset expects, unless
+    `fixtures` are given, in which case recorded responses are replayed and a
+    prompt without a fixture is answered with no groups.
+    """
+
+    def __init__(
+        self,
+        dataset: Dataset,
+        latency: float = 0.0,
+        fixtures: ModelFixtures | None = None,
+    ):
+        self.dataset = dataset
+        self.latency = latency
+        self.fixtures = fixtures
+
+        self.transactions = {t.id: t for t in dataset.transactions}
+        self.next_id = max(self.transactions, default=0) + 1_000_000
+        self.lock = threading.Lock()
+
+        self.calls: Counter[str] = Counter()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.fixture_misses = 0
+        self.groups: list[list[int]] = []
+        self.group_payees: dict[int, str | None] = {}
+
+        # Used to resolve the rows of a prompt back to transactions
+        self.by_content: dict[tuple, list[int]] = {}
+        for t in dataset.transactions:
+            key = (t.payee or "", t.amount, t.notes or "")
+            self.by_content.setdefault(key, []).append(t.id)
+
+        stub = self
+
+        class Handler(_Handler):
+            server_stub = stub
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, endpoint: str):
+        with self.lock:
+            self.calls[endpoint] += 1
+
+    def query_transactions(self, params: dict[str, str]) -> list[TransactionObject]:
+        start = date.fromisoformat(params["start_date"]) if "start_date" in params else None
+        end = date.fromisoformat(params["end_date"]) if "end_date" in params else None
+
+        def matches(t: TransactionObject):
+            if start and t.date < start or end and t.date > end:
+                return False
+            if "category_id" in params and t.category_id != int(params["category_id"]):
+                return False
+            if "tag_id" in params and not any(
+                tag.id == int(params["tag_id"]) for tag in t.tags or []
+            ):
+                return False
+            if "status" in params and t.status != params["status"]:
+                return False
+            return True
+
+        return sorted((t for t in self.transactions.values() if matches(t)), key=lambda t: t.id)
+
+    def split_transaction(self, transaction_id: int, splits: list[dict]) -> list[int]:
+        parent = self.transactions[transaction_id]
+        split_ids = []
+        now = datetime.now(timezone.utc)
+
+        with self.lock:
+            for split in splits:
+                self.next_id += 1
+                self.transactions[self.next_id] = parent.model_copy(
+                    update={
+                        "id": self.next_id,
+                        "amount": split["amount"],
+                        "category_id": split["category_id"],
+                        "notes": split.get("notes"),
+                        "parent_id": parent.id,
+                        "tags": None,
+                        "created_at": now,
+                        "updated_at": now,
+                    }
+                )
+                split_ids.append(self.next_id)
+
+            parent.has_children = True
+            parent.status = "cleared"
+            parent.updated_at = now
+
+        return split_ids
+
+    def group_transactions(self, transaction_ids: list[int], payee: str | None = None) -> int:
+        with self.lock:
+            self.next_id += 1
+            for transaction_id in transaction_ids:
+                self.transactions[transaction_id].group_id = self.next_id
+                self.transactions[transaction_id].updated_at = datetime.now(timezone.utc)
+            self.groups.append(transaction_ids)
+            self.group_payees[self.next_id] = payee
+
+            return self.next_id
+
+    def transaction_group(self, transaction_id: int) -> dict:
+        group_id = self.transactions[transaction_id].group_id or transaction_id
+        children = [t for t in self.transactions.values() if t.group_id == group_id]
+
+        return (
+            children[0]
+            .model_copy(
+                update={
+                    "id": group_id,
+                    "payee": self.group_payees.get(group_id),
+                    "amount": sum(t.amount for t in children),
+                    "group_id": None,
+                    "children": [
+                        TransactionChildObject(
+                            id=t.id, amount=t.amount, payee=t.payee, date=t.date, notes=t.notes
+                        )
+                        for t in children
+                    ],
+                }
+            )
+            .model_dump(mode="json")
+        )
+
+    @property
+    def correct_groups(self) -> int:
+        """
+        How many of the groups created are exactly a group the dataset expects
+        """
+        correct = 0
+
+        for target_id, *venmo_ids in self.groups:
+            target = self.transactions[target_id]
+            main_id = target.parent_id or target.id
+
+            if self.dataset.expected.get(main_id) == set(venmo_ids):
+                correct += 1
+
+        return correct
+
+    def oracle_response(self, messages: list[dict[str, str]]) -> str:
+        """
+        Answers a prompt as a perfect model would, using the groups the
+        dataset expects. Rows in the prompt are resolved back to transactions
+        by their contents, since the prompt only contains aliases.
+        """
+        rows = list(csv.DictReader(io.StringIO(messages[-1]["content"])))
+        by_content = self.by_content
+
+        alias_of: dict[int, int] = {}
+        for row in rows:
+            ids = by_content.get((row["payee"], float(row["amount"]), row["notes"]), [])
+            for id in ids:
+                if id not in alias_of:
+                    alias_of[id] = int(float(row["transaction_id"]))
+                    break
+
+        groups = []
+        for main_id, venmo_ids in self.dataset.expected.items():
+            if main_id not in alias_of or not all(id in alias_of for id in venmo_ids):
+                continue
+
+            groups.append(
+                {
+                    "transaction_id": alias_of[main_id],
+                    "matches": [alias_of[id] for id in sorted(venmo_ids)],
+                    "missing_reimbursements": False,
+                    "confidence": 0.9,
+                    "confidence_reason": f"The {VENMO_CATEGORY} notes match the payee",
+                }
+            )
+
+        return json.dumps({"groups": groups})
+
+    def complete(self, request: dict) -> dict:
+        """
+        Answers a chat completion request, from the fixtures when given or
+        otherwise the oracle
+        """
+        messages = request["messages"]
+
+        if self.fixtures is None:
+            arguments = self.oracle_response(messages)
+        else:
+            arguments = self.fixtures.response(request)
+
+            if arguments is None:
+                with self.lock:
+                    self.fixture_misses += 1
+                arguments = json.dumps({"groups": []})
+
+        prompt_tokens = count_prompt_tokens(messages)
+        completion_tokens = len(arguments) // 4
+
+        with self.lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-4"),
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {
+                        "role": "assistant",
+                        "content": None,
+                        "tool_calls": [
+                            {
+                                "id": "call_stub",
+                                "type": "function",
+                                "function": {"name": "submit_groups", "arguments": arguments},
+                            }
+                        ],
+                    },
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+
+class _EventStream(list):
+    """
+    Chunks of a streamed response, sent as server-sent events
+    """
+
+
+def _stream_chunks(completion: dict) -> _EventStream:
+    """
+    Splits a chat completion into the chunks of a streamed response, with the
+    tool call arguments spread across several chunks and the usage last.
+    """
+    call = completion["choices"][0]["message"]["tool_calls"][0]
+    arguments = call["function"]["arguments"]
+    base = {k: completion[k] for k in ("id", "created", "model")}
+    base["object"] = "chat.completion.chunk"
+
+    def chunk(delta: dict, finish_reason: str | None = None) -> dict:
+        return {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+    chunks = _EventStream(
+        [
+            chunk(
+                {
+                    "role": "assistant",
+                    "tool_calls": [
+                        {
+                            "index": 0,
+                            "id": call["id"],
+                            "type": "function",
+                            "function": {"name": call["function"]["name"], "arguments": ""},
+                        }
+                    ],
+                }
+            )
+        ]
+    )
+    for start in range(0, len(arguments), 256):
+        part = arguments[start : start + 256]
+        chunks.append(chunk({"tool_calls": [{"index": 0, "function": {"arguments": part}}]}))
+
+    chunks.append(chunk({}, "stop"))
+    chunks.append({**base, "choices": [], "usage": completion["usage"]})
+
+    return chunks
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_stub: StubServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, data):
+        body = json.dumps(data).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _respond_stream(self, chunks: _EventStream):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        for chunk in chunks:
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+
+        raw = self.rfile.read(length)
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(raw)
+
+        return {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+
+    def _route(self, method: str):
+        stub = self.server_stub
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = self._body() if method != "GET" else {}
+
+        if stub.latency:
+            time.sleep(stub.latency)
+
+        path = url.path
+
+        if path == "/v1/categories":
+            stub.count("lunchmoney.get_categories")
+            return {"categories": [c.model_dump(mode="json") for c in stub.dataset.categories]}
+
+        if path == "/v1/tags":
+            stub.count("lunchmoney.get_tags")
+            return [t.model_dump(mode="json") for t in stub.dataset.tags]
+
+        if path == "/v1/transactions/group" and method == "POST":
+            stub.count("lunchmoney.insert_transaction_group")
+            return stub.group_transactions(body["transactions"], body.get("payee"))
+
+        if path == "/v1/transactions/group":
+            stub.count("lunchmoney.get_transaction_group")
+            return stub.transaction_group(int(params["transaction_id"]))
+
+        if path == "/v1/transactions":
+            stub.count("lunchmoney.get_transactions")
+            transactions = stub.query_transactions(params)
+            offset = int(params.get("offset", 0))
+            limit = int(params.get("limit", 1000))
+            page = transactions[offset : offset + limit]
+
+            return {
+                "transactions": [t.model_dump(mode="json") for t in page],
+                "has_more": offset + limit < len(transactions),
+            }
+
+        if match := re.fullmatch(r"/v1/transactions/(\d+)", path):
+            transaction_id = int(match.group(1))
+
+            if method == "PUT":
+                stub.count("lunchmoney.update_transaction")
+                return {"split": stub.split_transaction(transaction_id, body["split"])}
+
+            stub.count("lunchmoney.get_transaction")
+            return stub.transactions[transaction_id].model_dump(mode="json")
+
+        if path.endswith("/chat/completions"):
+            stub.count("openai.chat.completions")
+            completion = stub.complete(body)
+
+            return _stream_chunks(completion) if body.get("stream") else completion
+
+        if path.endswith("/getMe"):
+            stub.count("telegram.get_me")
+            return {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Stub"}}
+
+        if path.endswith("/sendMessage"):
+            stub.count("telegram.send_message")
+            return {
+                "ok": True,
+                "result": {
+                    "message_id": stub.calls["telegram.send_message"],
+                    "date": int(datetime.now().timestamp()),
+                    "chat": {"id": int(body.get("chat_id", 0)), "type": "channel"},
+                    "text": body.get("text", ""),
+                },
+            }
+
+        return None
+
+    def _handle(self, method: str):
+        data = self._route(method)
+
+        if data is None:
+            self.send_error(404)
+            return
+
+        if isinstance(data, _EventStream):
+            self._respond_stream(data)
+        else:
+            self._respond(data)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
@@ -0,0 +1,247 @@
+import random
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
+from decimal import ROUND_DOWN, Decimal
+
+from lunchable.models import CategoriesObject, TagsObject, TransactionObject
+
+VENMO_CATEGORY = "Venmo"
+REIMBURSED_CATEGORY = "Reimbursed"
+REIMBURSEMENT_TAG = "Pending Venmo"
+
+FRIENDS = [
+    ("Randolf", "Ran"),
+    ("Eric", "Eric"),
+    ("Erika", "Erika"),
+    ("Joseph", "Joe"),
+    ("Josh", "Josh"),
+    ("Katherine", "Kat"),
+    ("Ryan", "Ryan"),
+    ("Samantha", "Sam"),
+    ("Alexander", "Alex"),
+    ("Nicole", "Nic"),
+]
+"""
+Friends who reimburse us, along with the nickname we use in our notes
+"""
+
+MERCHANTS = [
+    ("Ramen Nagi", ["Ramen Nagi", "ramen", "nagi!!"]),
+    ("Mos Grill Inc", ["Mos Burger", "mos", "burgers"]),
+    ("Boba Guys", ["Thanks for Boba Guys", "boba", "🧋"]),
+    ("El Lopo", ["El Lopo wine bar", "wine", "lopo"]),
+    ("Tartine Bakery", ["tartine", "bread + coffee", "Tartine"]),
+    ("Zuni Cafe", ["zuni", "Zuni dinner", "chicken 🍗"]),
+    ("BP Gas", ["gas", "road trip gas", "⛽"]),
+    ("Safeway", ["groceries", "safeway run", "BBQ supplies"]),
+    ("Uber", ["uber", "ride home", "🚗"]),
+    ("Airbnb", ["tahoe house", "airbnb", "Tahoe 🏔"]),
+]
+"""
+Merchants we pay at, along with the ways a friend might describe them in a
+venmo note
+"""
+
+
+@dataclass
+class Dataset:
+    """
+    A synthetic Lunch Money ledger along with the groups we expect to be made
+    """
+
+    categories: list[CategoriesObject]
+    tags: list[TagsObject]
+    transactions: list[TransactionObject]
+    expected: dict[int, set[int]] = field(default_factory=dict)
+    """
+    Maps the ID of each main transaction that should be grouped to the IDs of
+    the venmos reimbursing it
+    """
+
+    @property
+    def candidates(self) -> list[TransactionObject]:
+        venmo_id = self.category(VENMO_CATEGORY).id
+        tag_id = self.tag(REIMBURSEMENT_TAG).id
+
+        return [
+            t
+            for t in self.transactions
+            if (t.category_id == venmo_id and t.amount <= 0)
+            or any(tag.id == tag_id for tag in t.tags or [])
+        ]
+
+    def category(self, name: str) -> CategoriesObject:
+        return next(c for c in self.categories if c.name == name)
+
+    def tag(self, name: str) -> TagsObject:
+        return next(t for t in self.tags if t.name == name)
+
+
+def _category(id: int, name: str, is_income: bool = False) -> CategoriesObject:
+    return CategoriesObject(
+        id=id,
+        name=name,
+        is_income=is_income,
+        exclude_from_budget=False,
+        exclude_from_totals=False,
+        is_group=False,
+    )
+
+
+class _Generator:
+    def __init__(self, seed: int, today: date):
+        self.random = random.Random(seed)
+        self.today = today
+        self.next_id = 100_000_000
+
+        self.categories = [
+            _category(1, VENMO_CATEGORY, is_income=True),
+            _category(2, REIMBURSED_CATEGORY),
+            _category(3, "Restaurants"),
+            _category(4, "Groceries"),
+            _category(5, "Travel"),
+        ]
+        self.tags = [TagsObject(id=1, name=REIMBURSEMENT_TAG), TagsObject(id=2, name="Other")]
+
+        self.transactions: list[TransactionObject] = []
+        self.expected: dict[int, set[int]] = {}
+
+    def add(self, **kwargs) -> TransactionObject:
+        self.next_id += 1
+        now = datetime.now(timezone.utc)
+
+        transaction = TransactionObject(
+            id=self.next_id,
+            status="uncleared",
+            created_at=now,
+            updated_at=now,
+            **kwargs,
+        )
+        self.transactions.append(transaction)
+
+        return transaction
+
+    def random_date(self, days: int = 50) -> date:
+        return self.today - timedelta(days=self.random.randint(0, days))
+
+    def venmo_note(self, merchant: str, phrasings: list[str], name: str) -> str:
+        phrasing = self.random.choice([merchant, *phrasings])
+
+        if self.random.random() < 0.1:
+            # A typo
+            index = self.random.randrange(len(phrasing))
+            phrasing = phrasing[:index] + phrasing[index + 1 :]
+
+        return self.random.choice(
+            [phrasing, f"{name}: {phrasing}", f"thanks! {phrasing}", phrasing.lower()]
+        )
+
+    def add_group(self):
+        """
+        A tagged main transaction and the venmos reimbursing it. Some groups
+        are still missing a reimbursement and should not be grouped.
+        """
+        merchant, phrasings = self.random.choice(MERCHANTS)
+        friends = self.random.sample(FRIENDS, self.random.randint(1, 3))
+
+        people = len(friends) + 1
+        fully_covered = self.random.random() < 0.1
+        if fully_covered:
+            people = len(friends)
+
+        share = Decimal(self.random.randint(500, 8000)) / 100
+        amount = share * people + Decimal(self.random.choice([0, 0, 0, 1])) / 100
+
+        names = [nickname for _, nickname in friends]
+        if self.random.random() < 0.2:
+            waiting = f"Waiting on {len(friends)} people"
+        else:
+            waiting = "Waiting on " + " and ".join(names)
+
+        main_date = self.random_date()
+        main = self.add(
+            date=main_date,
+            payee=merchant,
+            amount=float(amount),
+            notes=waiting + self.random.choice(["", " [dinner]", " [trip]"]),
+            original_name=merchant.upper(),
+            category_id=self.random.choice([3, 4, 5]),
+            tags=[self.tags[0]],
+        )
+
+        # A group of one friend can't be missing anyone while still having a
+        # venmo to match
+        missing = len(friends) > 1 and self.random.random() < 0.15
+        paying = friends[:-1] if missing else friends
+
+        venmo_ids = set()
+        each = (amount / people).quantize(Decimal("0.01"), rounding=ROUND_DOWN)
+
+        for name, _ in paying:
+            generic_payee = self.random.random() < 0.2
+            venmo = self.add(
+                date=min(self.today, main_date + timedelta(days=self.random.randint(0, 10))),
+                payee="Venmo Received" if generic_payee else name,
+                amount=-float(each),
+                notes=self.venmo_note(merchant, phrasings, name),
+                original_name="Venmo",
+                category_id=1,
+            )
+            venmo_ids.add(venmo.id)
+
+        if not missing:
+            self.expected[main.id] = venmo_ids
+
+    def add_unrelated_venmo(self):
+        """
+        A venmo for something which was not a reimbursement
+        """
+        name, _ = self.random.choice(FRIENDS)
+        self.add(
+            date=self.random_date(),
+            payee=name,
+            amount=-float(Decimal(self.random.randint(100, 20000)) / 100),
+            notes=self.random.choice(["rent", "concert tickets", "🍕", "for the couch"]),
+            original_name="Venmo",
+            category_id=1,
+        )
+
+    def add_noise(self):
+        """
+        An ordinary transaction which is not a candidate
+        """
+        merchant, _ = self.random.choice(MERCHANTS)
+        self.add(
+            date=self.random_date(),
+            payee=merchant,
+            amount=float(Decimal(self.random.randint(100, 20000)) / 100),
+            notes="",
+            original_name=merchant.upper(),
+            category_id=self.random.choice([3, 4, 5]),
+            tags=self.random.choice([None, [self.tags[1]]]),
+        )
+
+
+def generate(candidates: int, seed: int = 0, noise_ratio: float = 1.0) -> Dataset:
+    """
+    Generates a ledger with roughly `candidates` candidate transactions
+    (tagged main transactions and incoming venmos), plus `noise_ratio` times
+    as many ordinary transactions which are not candidates.
+    """
+    generator = _Generator(seed, date.today())
+
+    while len(generator.transactions) < candidates:
+        if generator.random.random() < 0.9:
+            generator.add_group()
+        else:
+            generator.add_unrelated_venmo()
+
+    for _ in range(int(candidates * noise_ratio)):
+        generator.add_noise()
+
+    return Dataset(
+        categories=generator.categories,
+        tags=generator.tags,
+        transactions=generator.transactions,
+        expected=generator.expected,
+    )
@@ -0,0 +1,53 @@
+from datetime import date, datetime
+
+from lunchable.models import CategoriesObject, TransactionObject
+
+VENMO = CategoriesObject(
+    id=1,
+    name="Venmo",
+    is_income=True,
+    exclude_from_budget=False,
+    exclude_from_totals=False,
+    is_group=False,
+)
+DINING = CategoriesObject(
+    id=2,
+    name="Dining",
+    is_income=False,
+    exclude_from_budget=False,
+    exclude_from_totals=False,
+    is_group=False,
+)
+
+
+def transaction(
+    id: int,
+    payee: str,
+    amount: float,
+    notes: str | None = None,
+    category: CategoriesObject = DINING,
+    on: date = date(2024, 1, 2),
+) -> TransactionObject:
+    """
+    Builds a candidate transaction. Venmos are income, so have negative
+    amounts.
+    """
+    now = datetime(2024, 1, 3)
+
+    return TransactionObject(
+        id=id,
+        date=on,
+        payee=payee,
+        amount=amount,
+        currency="usd",
+        to_base=amount,
+        notes=notes,
+        category_id=category.id,
+        status="uncleared",
+        is_income=amount < 0,
+        exclude_from_budget=False,
+        exclude_from_totals=False,
+        created_at=now,
+        updated_at=now,
+        is_group=False,
+    )
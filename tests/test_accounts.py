@@ -0,0 +1,49 @@
+import configargparse
+import pytest
+
+from venmo_lunchmoney_ai.accounts import load_accounts
+
+ACCOUNT = """
+[[accounts]]
+name = "evan"
+lunchmoney-token = "token"
+venmo-category = "Venmo"
+reimbursed-category = "Venmo Reimbursed"
+reimbursement-tag = "Pending Venmo"
+telegram-channel = "-100123"
+state-file = "evan.db"
+"""
+
+
+def args(**values) -> configargparse.Namespace:
+    options = [
+        "lunchmoney_token",
+        "venmo_category",
+        "reimbursed_category",
+        "reimbursement_tag",
+        "telegram_token",
+        "telegram_channel",
+        "state_file",
+    ]
+    return configargparse.Namespace(**{**{option: None for option in options}, **values})
+
+
+def test_account_options_fall_back_to_the_command_line(tmp_path):
+    path = tmp_path / "accounts.toml"
+    path.write_text(ACCOUNT)
+
+    accounts = load_accounts(str(path), args(telegram_token="bot"))
+
+    assert accounts["evan"].telegram_token == "bot"
+    assert accounts["evan"].venmo_category == "Venmo"
+
+
+def test_accounts_require_a_telegram_token(tmp_path):
+    path = tmp_path / "accounts.toml"
+    path.write_text(ACCOUNT)
+
+    with pytest.raises(ValueError, match="--telegram-token"):
+        load_accounts(str(path), args())
+
+    path.write_text(ACCOUNT + 'telegram-token = "bot"\n')
+    assert load_accounts(str(path), args())["evan"].telegram_token == "bot"
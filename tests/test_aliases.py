@@ -0,0 +1,85 @@
+from venmo_lunchmoney_ai.aliases import (
+    FRIEND,
+    MERCHANT,
+    AliasIndex,
+    learn_aliases,
+    note_words,
+)
+
+
+def index(*groups: list[tuple[str, str, str]]) -> AliasIndex:
+    """
+    Builds the index as the state database would, counting how many groups
+    confirmed each alias
+    """
+    counts: dict[tuple[str, str, str], int] = {}
+    for aliases in groups:
+        for alias in set(aliases):
+            counts[alias] = counts.get(alias, 0) + 1
+
+    return AliasIndex((*alias, count) for alias, count in counts.items())
+
+
+def test_note_words():
+    assert note_words("Thanks for the boba!! 2x", "Eric Smith") == {"boba"}
+    assert note_words("eric's tacos", "Eric Smith") == {"tacos"}
+    assert note_words(None) == set()
+
+
+def test_learn_aliases_skips_stopwords():
+    aliases = learn_aliases("Boba Guys", "Waiting on Eric", [("Eric Smith", "Thanks for the boba")])
+
+    assert set(aliases) == {(MERCHANT, "boba guys", "boba"), (FRIEND, "eric smith", "eric")}
+
+
+def test_learn_aliases_pairs_the_remaining_name():
+    aliases = learn_aliases(
+        "Ramen Nagi",
+        "Waiting on Bobby and Eric",
+        [("Eric Smith", "ramen"), ("Robert Jones", "ramen")],
+    )
+
+    assert (FRIEND, "eric smith", "eric") in aliases
+    assert (FRIEND, "robert jones", "bobby") in aliases
+
+
+def test_learn_aliases_without_every_venmo():
+    aliases = learn_aliases("Ramen Nagi", "Waiting on Bobby and Eric", [("Robert Jones", None)])
+
+    assert [a for a in aliases if a[0] == FRIEND] == []
+
+
+def test_merchant_words_need_two_groups():
+    group = learn_aliases("Boba Guys", "Waiting on Eric", [("Eric Smith", "Thanks for the boba")])
+
+    assert not index(group).mentions_merchant("Boba Guys", "boba time")
+
+    aliases = index(group, group)
+    assert aliases.mentions_merchant("Boba Guys", "boba time")
+    assert not aliases.mentions_merchant("Boba Guys", "thanks for the tacos")
+
+
+def test_merchant_words_used_for_several_payees_are_ignored():
+    boba = learn_aliases("Boba Guys", None, [("Eric Smith", "mission")])
+    tacos = learn_aliases("La Taqueria", None, [("Eric Smith", "mission")])
+
+    aliases = index(boba, boba, tacos)
+
+    assert not aliases.mentions_merchant("Boba Guys", "mission")
+
+
+def test_nicknames():
+    group = learn_aliases("Ramen Nagi", "Waiting on Bobby", [("Robert Jones", "ramen")])
+    aliases = index(group)
+
+    assert aliases.is_nickname("Bobby", "Robert Jones")
+    assert not aliases.is_nickname("Eric", "Robert Jones")
+
+
+def test_generic_senders_have_no_nicknames():
+    groups = [
+        learn_aliases("Ramen Nagi", f"Waiting on {name}", [("Venmo Received", "ramen")])
+        for name in ("Alex", "Bobby", "Carl", "Dana")
+    ]
+
+    assert not index(*groups).is_nickname("Alex", "Venmo Received")
@@ -0,0 +1,76 @@
+import pytest
+
+from tests.helpers import VENMO, transaction
+from venmo_lunchmoney_ai.amounts import (
+    MAX_PEOPLE,
+    feasible_combinations,
+    is_even_share,
+    is_even_split,
+    subsets_summing_to,
+)
+
+
+def test_subsets_summing_to_finds_every_combination():
+    solutions = subsets_summing_to([500, 300, 200, 700], 1000, 0)
+
+    assert sorted(sorted(s) for s in solutions) == [[0, 1, 2], [1, 3]]
+
+
+def test_subsets_summing_to_allows_tolerance():
+    assert subsets_summing_to([333, 333, 335], 1000, 0) == []
+    assert sorted(subsets_summing_to([333, 333, 335], 1000, 1)[0]) == [0, 1, 2]
+
+
+def test_subsets_summing_to_exact_size():
+    solutions = subsets_summing_to([600, 400, 300, 100], 1000, 0, size=3)
+
+    assert [sorted(s) for s in solutions] == [[0, 2, 3]]
+
+
+def test_subsets_summing_to_nothing():
+    assert subsets_summing_to([], 1000, 0) == []
+    assert subsets_summing_to([2000, 1500], 1000, 0) == []
+
+
+@pytest.mark.parametrize(
+    "total, amounts, expected",
+    [
+        # Split with me
+        (6000, [3000], True),
+        (6076, [2026, 2025], True),
+        # Entirely covered by the venmos
+        (6000, [3000, 3000], True),
+        (6000, [2000, 3000], False),
+        (6000, [2500], False),
+    ],
+)
+def test_is_even_split(total, amounts, expected):
+    assert is_even_split(total, amounts) == expected
+
+
+@pytest.mark.parametrize(
+    "total, amount, expected",
+    [
+        (6000, 6000, True),
+        (6076, 2025, True),
+        (6000, 2500, False),
+        (6000, 0, False),
+        (MAX_PEOPLE * 100, 100, True),
+        ((MAX_PEOPLE + 1) * 100, 100, False),
+    ],
+)
+def test_is_even_share(total, amount, expected):
+    assert is_even_share(total, amount) == expected
+
+
+def test_feasible_combinations():
+    main = transaction(10, "Ramen Nagi", 60.76, "Waiting on 2 people")
+    venmos = [
+        transaction(1, "Randolf", -20.26, category=VENMO),
+        transaction(2, "Eric", -20.25, category=VENMO),
+        transaction(3, "Josh", -27.88, category=VENMO),
+    ]
+
+    combinations = feasible_combinations(main, venmos, people=2)
+
+    assert [[v.id for v in c] for c in combinations] == [[1, 2]]
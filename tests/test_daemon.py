@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+from venmo_lunchmoney_ai.daemon import Trigger
+
+DEBOUNCE = 0.05
+
+
+def test_trigger_times_out_without_requests():
+    async def run():
+        return await Trigger(DEBOUNCE).wait(DEBOUNCE)
+
+    assert asyncio.run(run()) is False
+
+
+def test_trigger_debounces_a_burst():
+    async def run():
+        trigger = Trigger(DEBOUNCE)
+
+        async def burst():
+            for _ in range(4):
+                trigger.request()
+                await asyncio.sleep(DEBOUNCE / 2)
+
+        started = time.monotonic()
+        task = asyncio.create_task(burst())
+        assert await trigger.wait(1)
+        elapsed = time.monotonic() - started
+        await task
+
+        # The burst was a single run, started once requests stopped arriving
+        assert elapsed >= DEBOUNCE * 2
+        assert not await trigger.wait(DEBOUNCE)
+
+    asyncio.run(run())
+
+
+def test_trigger_max_delay():
+    async def run():
+        trigger = Trigger(DEBOUNCE, max_delay=DEBOUNCE * 2)
+
+        async def requests():
+            while True:
+                trigger.request()
+                await asyncio.sleep(DEBOUNCE / 4)
+
+        task = asyncio.create_task(requests())
+        started = time.monotonic()
+        assert await trigger.wait(1)
+        elapsed = time.monotonic() - started
+        task.cancel()
+
+        # Constant requests don't postpone the run forever
+        assert elapsed < DEBOUNCE * 4
+
+    asyncio.run(run())
+
+
+def test_trigger_coalesces_requests_during_a_run():
+    async def run():
+        trigger = Trigger(DEBOUNCE)
+
+        trigger.request()
+        assert await trigger.wait(1)
+
+        # Requests made while the run was in progress
+        trigger.request()
+        trigger.request()
+
+        assert await trigger.wait(1)
+        assert not await trigger.wait(DEBOUNCE)
+
+    asyncio.run(run())
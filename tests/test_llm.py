@@ -0,0 +1,113 @@
+import asyncio
+import json
+
+import pytest
+
+from tests.helpers import DINING, VENMO, transaction
+from venmo_lunchmoney_ai.backends import Completion
+from venmo_lunchmoney_ai.cache import ResponseCache
+from venmo_lunchmoney_ai.llm import request_groups
+from venmo_lunchmoney_ai.response import ResponseError
+
+MAIN = transaction(10, "Boba Guys", 12, "Waiting on Eric")
+VENMO_TX = transaction(11, "Eric", -6, "Thanks for Boba Guys", category=VENMO)
+
+GROUP = {
+    "transaction_id": 1,
+    "matches": [2],
+    "missing_reimbursements": False,
+    "confidence": 0.9,
+    "confidence_reason": "Even split",
+}
+
+
+class FakeBackend:
+    def __init__(self, tier: str, content: str | Exception, calls: list[str]):
+        self.tier = tier
+        self.model = tier
+        self.content = content
+        self.calls = calls
+
+    async def complete(self, messages, tool) -> Completion:
+        self.calls.append(self.tier)
+        if isinstance(self.content, Exception):
+            raise self.content
+        return Completion(content=self.content)
+
+    def cost(self, completion: Completion) -> float:
+        return 0.0
+
+    async def close(self):
+        pass
+
+
+def request(fast: str | Exception, strong: str | Exception) -> tuple[list, list[str]]:
+    calls: list[str] = []
+    backends = [FakeBackend("fast", fast, calls), FakeBackend("strong", strong, calls)]
+    groups = asyncio.run(request_groups(backends, "Venmo", [VENMO, DINING], [MAIN, VENMO_TX]))
+
+    return groups, calls
+
+
+def test_confident_fast_tier_is_used():
+    groups, calls = request(json.dumps({"groups": [GROUP]}), "")
+
+    assert calls == ["fast"]
+    assert [g.transaction.id for g in groups] == [MAIN.id]
+
+
+def test_escalates_when_not_confident():
+    unsure = {**GROUP, "confidence": 0.5}
+    groups, calls = request(json.dumps({"groups": [unsure]}), json.dumps({"groups": [GROUP]}))
+
+    assert calls == ["fast", "strong"]
+    assert groups[0].confidence == 0.9
+
+
+@pytest.mark.parametrize(
+    "fast",
+    [
+        "I could not find any groups",
+        '{"groups": [{"transaction_id": 1, "matches": [',
+        json.dumps({"groups": [{**GROUP, "matches": [1]}]}),
+        RuntimeError("timed out"),
+    ],
+)
+def test_escalates_when_fast_tier_has_no_valid_groups(fast):
+    groups, calls = request(fast, json.dumps({"groups": [GROUP]}))
+
+    assert calls == ["fast", "strong"]
+    assert [g.transaction.id for g in groups] == [MAIN.id]
+
+
+def test_explicitly_empty_response_is_trusted():
+    groups, calls = request(json.dumps({"groups": []}), json.dumps({"groups": [GROUP]}))
+
+    assert calls == ["fast"]
+    assert groups == []
+
+
+def test_invalid_last_tier_raises():
+    with pytest.raises(ResponseError):
+        request("not json", "still not json")
+
+
+def test_only_valid_responses_are_cached(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_age=60, max_size=1024 * 1024)
+    calls: list[str] = []
+
+    def run(content: str):
+        backends = [FakeBackend("strong", content, calls)]
+        return asyncio.run(
+            request_groups(backends, "Venmo", [VENMO, DINING], [MAIN, VENMO_TX], cache=cache)
+        )
+
+    with pytest.raises(ResponseError):
+        run("truncated {")
+    assert list(tmp_path.glob("*.json")) == []
+
+    run(json.dumps({"groups": [GROUP]}))
+    groups = run("never requested")
+
+    assert calls == ["strong", "strong"]
+    assert [g.transaction.id for g in groups] == [MAIN.id]
@@ -0,0 +1,117 @@
+from datetime import date
+
+from tests.helpers import VENMO, transaction
+from venmo_lunchmoney_ai.matcher import MIN_CONFIDENCE, match_locally
+
+
+def ids(transactions) -> list[int]:
+    return [t.id for t in transactions]
+
+
+def test_matches_named_even_split():
+    main = transaction(10, "Ramen Nagi", 60.76, "Waiting on Ran and Eric [Ramen]")
+    venmos = [
+        transaction(1, "Randolf Smith", -20.26, "Ramen Nagi", category=VENMO),
+        transaction(2, "Eric Jones", -20.25, "Ramen Nagi", category=VENMO),
+        transaction(3, "Josh Lee", -14.00, "Tacos", category=VENMO),
+    ]
+
+    [group], mains, remaining = match_locally([main], venmos)
+
+    assert group.transaction.id == 10
+    assert sorted(ids(group.matches)) == [1, 2]
+    assert group.confidence >= MIN_CONFIDENCE
+    assert mains == []
+    assert ids(remaining) == [3]
+
+
+def test_leaves_uneven_amounts_to_the_model():
+    main = transaction(10, "Ramen Nagi", 60, "Waiting on Eric")
+    venmo = transaction(1, "Eric Jones", -25, "Ramen Nagi", category=VENMO)
+
+    groups, mains, remaining = match_locally([main], [venmo])
+
+    assert groups == []
+    assert ids(mains) == [10]
+    assert ids(remaining) == [1]
+
+
+def test_leaves_missing_people_to_the_model():
+    main = transaction(10, "Ramen Nagi", 60, "Waiting on Ran and Eric")
+    venmo = transaction(1, "Eric Jones", -20, "Ramen Nagi", category=VENMO)
+
+    groups, _, _ = match_locally([main], [venmo])
+
+    assert groups == []
+
+
+def test_leaves_venmos_fitting_another_transaction_to_the_model():
+    mos = transaction(10, "Mos Burger", 12, "Waiting on Eric", on=date(2024, 1, 2))
+    boba = transaction(11, "Boba Guys", 12, "Waiting on Eric", on=date(2024, 1, 10))
+    venmo = transaction(
+        1, "Eric Jones", -6, "Thanks for Boba Guys", category=VENMO, on=date(2024, 1, 10)
+    )
+
+    groups, mains, remaining = match_locally([mos, boba], [venmo])
+
+    assert groups == []
+    assert ids(mains) == [10, 11]
+    assert ids(remaining) == [1]
+
+
+def test_leaves_venmos_sharing_a_counted_transaction_to_the_model():
+    main = transaction(10, "Mos Burger", 30, "Waiting on Eric", on=date(2024, 1, 2))
+    other = transaction(11, "Tartine", 45, "Waiting on 2 people", on=date(2024, 1, 3))
+    venmo = transaction(1, "Eric Jones", -15, "Food", category=VENMO, on=date(2024, 1, 4))
+
+    groups, _, _ = match_locally([main, other], [venmo])
+
+    assert groups == []
+
+
+def test_leaves_venmos_covering_another_transaction_to_the_model():
+    main = transaction(10, "Mos Burger", 24, "Waiting on Eric", on=date(2024, 1, 2))
+    other = transaction(11, "Boba Guys", 30, "Waiting on Eric and Ran", on=date(2024, 1, 3))
+    venmos = [
+        transaction(1, "Eric Jones", -12, "Food", category=VENMO, on=date(2024, 1, 4)),
+        transaction(2, "Randolf Smith", -18, "Boba", category=VENMO, on=date(2024, 1, 4)),
+    ]
+
+    groups, _, _ = match_locally([main, other], venmos)
+
+    assert groups == []
+
+
+def test_matched_transactions_no_longer_contest_venmos():
+    main = transaction(10, "Mos Burger", 12, "Waiting on Eric", on=date(2024, 1, 2))
+    other = transaction(11, "Boba Guys", 30, "Waiting on Ran", on=date(2024, 1, 3))
+    venmos = [
+        transaction(1, "Eric Jones", -6, "Mos Burger", category=VENMO, on=date(2024, 1, 3)),
+        transaction(2, "Randolf Smith", -15, "Boba", category=VENMO, on=date(2024, 1, 4)),
+    ]
+
+    groups, _, _ = match_locally([main, other], venmos)
+
+    assert [(g.transaction.id, ids(g.matches)) for g in groups] == [(10, [1]), (11, [2])]
+
+
+def test_matches_counted_people():
+    main = transaction(10, "Tartine Bakery", 45, "Waiting on 2 people")
+    venmos = [
+        transaction(1, "Venmo Received", -15, "Tartine", category=VENMO),
+        transaction(2, "Venmo Received", -15, "Tartine bakery", category=VENMO),
+        transaction(3, "Venmo Received", -7, "Tacos", category=VENMO),
+    ]
+
+    [group], _, remaining = match_locally([main], venmos)
+
+    assert sorted(ids(group.matches)) == [1, 2]
+    assert ids(remaining) == [3]
+
+
+def test_only_matches_shortlisted_venmos():
+    main = transaction(10, "Ramen Nagi", 60, "Waiting on Eric")
+    venmo = transaction(1, "Eric Jones", -30, "Ramen Nagi", category=VENMO)
+
+    assert match_locally([main], [venmo], shortlists={1: []})[0] == []
+    assert len(match_locally([main], [venmo], shortlists={1: [10]})[0]) == 1
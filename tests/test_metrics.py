@@ -0,0 +1,57 @@
+import asyncio
+from contextlib import contextmanager
+
+from venmo_lunchmoney_ai import metrics as metrics_module
+from venmo_lunchmoney_ai.metrics import Metrics
+
+
+class Transaction:
+    def __init__(self):
+        self.data = {}
+
+    def set_data(self, key, value):
+        self.data[key] = value
+
+
+def test_concurrent_runs_are_labeled_by_account(monkeypatch):
+    metrics = Metrics()
+    transactions: dict[str, Transaction] = {}
+
+    @contextmanager
+    def start_transaction(op: str, name: str):
+        transactions[name] = Transaction()
+        yield transactions[name]
+
+    monkeypatch.setattr(metrics_module, "start_transaction", start_transaction)
+
+    async def run(account: str, calls: int):
+        with metrics.run(f"run {account}", account=account):
+            for _ in range(calls):
+                # Like a client shared between accounts recording each call
+                await asyncio.to_thread(metrics.incr, "api_calls_total", service="openai")
+                await asyncio.sleep(0)
+
+    async def main():
+        await asyncio.gather(run("evan", 2), run("partner", 3))
+
+    asyncio.run(main())
+
+    assert metrics.counters == {
+        ("api_calls_total", (("account", "evan"), ("service", "openai"))): 2,
+        ("api_calls_total", (("account", "partner"), ("service", "openai"))): 3,
+    }
+    assert metrics.gauges[("last_run_success", (("account", "evan"),))] == 1
+
+    # Each run's transaction only has its own account's counters
+    assert transactions["run evan"].data == {"api_calls_total.openai": 2}
+    assert transactions["run partner"].data == {"api_calls_total.openai": 3}
+
+
+def test_labels_outside_a_run():
+    metrics = Metrics()
+
+    with metrics.run("run", account="evan"):
+        pass
+    metrics.incr("candidates_total")
+
+    assert metrics.counters == {("candidates_total", ()): 1}
@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+from tests.helpers import VENMO, transaction
+from venmo_lunchmoney_ai.response import ResponseError, iter_json_items, parse_groups
+
+GROUP = {
+    "transaction_id": 1,
+    "matches": [2],
+    "missing_reimbursements": False,
+    "confidence": 0.9,
+    "confidence_reason": "Amount evenly divides",
+}
+
+TRANSACTIONS = {
+    1: transaction(10, "El Lopo", 60, "Waiting on Erika"),
+    2: transaction(20, "Erika", -30, category=VENMO),
+    3: transaction(30, "Josh", -80, category=VENMO),
+}
+VENMO_IDS = {2, 3}
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        json.dumps({"groups": [GROUP]}),
+        json.dumps([GROUP]),
+        json.dumps(GROUP),
+        f"```json\n{json.dumps({'groups': [GROUP]})}\n```",
+        f"Here are the groups:\n{json.dumps([GROUP])}\nLet me know!",
+    ],
+)
+def test_iter_json_items(text):
+    assert list(iter_json_items(text)) == [GROUP]
+
+
+def test_iter_json_items_truncated():
+    text = json.dumps({"groups": [GROUP, GROUP]})
+
+    # Cut off part way through the second group
+    assert list(iter_json_items(text[:-20])) == [GROUP]
+    assert list(iter_json_items("```json\n" + text[:-20])) == [GROUP]
+
+
+def test_iter_json_items_without_json():
+    assert list(iter_json_items("I could not find any groups")) == []
+
+
+def test_parse_groups():
+    [group] = parse_groups(json.dumps({"groups": [GROUP]}), TRANSACTIONS, VENMO_IDS)
+
+    assert group.transaction.id == 10
+    assert [m.id for m in group.matches] == [20]
+    assert group.confidence == 0.9
+
+
+def test_parse_groups_drops_invalid_groups():
+    invalid = [
+        {**GROUP, "confidence": "high"},
+        {**GROUP, "transaction_id": 2},
+        {**GROUP, "matches": [3]},
+        {**GROUP, "matches": [2, 2]},
+    ]
+    content = json.dumps({"groups": [*invalid, GROUP, GROUP]})
+
+    # Only the first valid group is kept, the second reuses its transactions
+    [group] = parse_groups(content, TRANSACTIONS, VENMO_IDS)
+
+    assert group.transaction.id == 10
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "",
+        "Sorry, I can't help with that",
+        json.dumps({"groups": [{**GROUP, "matches": [3]}]}),
+    ],
+)
+def test_parse_groups_without_valid_groups(content):
+    with pytest.raises(ResponseError):
+        parse_groups(content, TRANSACTIONS, VENMO_IDS)
+
+
+@pytest.mark.parametrize("content", ['{"groups": []}', "[]", '```json\n{"groups": []}\n```'])
+def test_parse_groups_explicitly_empty(content):
+    assert parse_groups(content, TRANSACTIONS, VENMO_IDS) == []
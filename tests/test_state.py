@@ -0,0 +1,148 @@
+import json
+
+from tests.helpers import VENMO, transaction
+from venmo_lunchmoney_ai.state import MAX_PROMPT_ATTEMPTS, MAX_WRITE_ATTEMPTS, StateStore
+from venmo_lunchmoney_ai.types import ReimbursementGroup
+
+MAIN = transaction(10, "Boba Guys", 12, "Waiting on Eric")
+
+
+def record(state: StateStore, prompted: set[int] = set(), failed: set[int] = set()):
+    state.record_run(
+        [MAIN],
+        prompted_ids=prompted,
+        grouped_ids=set(),
+        failed_ids=failed,
+        window_start=None,
+        full_sweep=False,
+    )
+
+
+def test_prompted_transactions_are_unchanged(tmp_path):
+    state = StateStore(str(tmp_path / "state.db"))
+    assert state.changed_transactions([MAIN]) == [MAIN]
+
+    record(state, prompted={MAIN.id})
+
+    assert state.changed_transactions([MAIN]) == []
+
+
+def test_failed_prompts_are_retried_until_attempts_run_out(tmp_path):
+    state = StateStore(str(tmp_path / "state.db"))
+
+    for _ in range(MAX_PROMPT_ATTEMPTS - 1):
+        record(state, failed={MAIN.id})
+        assert state.changed_transactions([MAIN]) == [MAIN]
+        assert state.retry_count() == 1
+
+    record(state, failed={MAIN.id})
+
+    assert state.changed_transactions([MAIN]) == []
+    assert state.retry_count() == 0
+
+
+def test_successful_prompt_resets_attempts(tmp_path):
+    state = StateStore(str(tmp_path / "state.db"))
+
+    record(state, failed={MAIN.id})
+    record(state, prompted={MAIN.id})
+    for _ in range(MAX_PROMPT_ATTEMPTS - 1):
+        record(state, failed={MAIN.id})
+
+    assert state.changed_transactions([MAIN]) == [MAIN]
+
+
+def test_dry_run_leaves_the_state_file_untouched(tmp_path):
+    file = tmp_path / "state.db"
+
+    StateStore(str(file), dry_run=True)
+    assert not file.exists()
+
+    record(StateStore(str(file)), prompted={MAIN.id})
+    before = file.read_bytes()
+
+    state = StateStore(str(file), dry_run=True)
+    assert state.changed_transactions([MAIN]) == []
+
+    record(state, failed={MAIN.id})
+    assert state.changed_transactions([MAIN]) == [MAIN]
+    assert file.read_bytes() == before
+
+
+def test_dry_run_does_not_migrate_legacy_state(tmp_path):
+    file = tmp_path / "state.db"
+    file.write_text(json.dumps([MAIN.id]))
+
+    state = StateStore(str(file), dry_run=True)
+
+    assert state.changed_transactions([MAIN]) == []
+    assert json.loads(file.read_text()) == [MAIN.id]
+    assert not (tmp_path / "state.db.legacy").exists()
+
+
+def journal_group(main=MAIN) -> ReimbursementGroup:
+    return ReimbursementGroup(
+        transaction=main,
+        matches=[transaction(20, "Eric", -6, category=VENMO)],
+        missing_reimbursements=False,
+        confidence=0.9,
+        confidence_reason="Amount evenly divides",
+    )
+
+
+def test_journal_resumes_split_groups(tmp_path):
+    state = StateStore(str(tmp_path / "state.db"))
+
+    state.plan_groups([journal_group()])
+    [entry] = state.pending_groups()
+    assert entry.group.transaction.id == MAIN.id
+    assert [m.id for m in entry.group.matches] == [20]
+    assert entry.split_id is None
+
+    state.record_split(MAIN.id, 99)
+    state.fail_group(MAIN.id)
+    [entry] = state.pending_groups()
+    assert entry.split_id == 99
+    assert entry.attempts == 1
+
+    # Planning the group again doesn't forget it was split
+    state.plan_groups([journal_group()])
+    [entry] = state.pending_groups()
+    assert entry.split_id == 99
+
+    state.complete_group(MAIN.id)
+    assert state.pending_groups() == []
+
+
+def test_journal_abandons_failing_groups(tmp_path):
+    state = StateStore(str(tmp_path / "state.db"))
+    other = transaction(11, "Tartine", 20, "Waiting on Eric")
+
+    state.plan_groups([journal_group(), journal_group(other)])
+
+    for _ in range(MAX_WRITE_ATTEMPTS - 1):
+        state.fail_group(MAIN.id)
+    assert len(state.pending_groups()) == 2
+
+    state.fail_group(MAIN.id)
+    assert [e.group.transaction.id for e in state.pending_groups()] == [other.id]
+
+
+def test_journal_replaces_abandoned_groups(tmp_path):
+    state = StateStore(str(tmp_path / "state.db"))
+
+    state.plan_groups([journal_group()])
+    for _ in range(MAX_WRITE_ATTEMPTS):
+        state.fail_group(MAIN.id)
+    assert state.pending_groups() == []
+
+    # The transaction was matched again, with a different venmo
+    regrouped = journal_group()
+    regrouped.matches = [transaction(21, "Eric", -6, category=VENMO)]
+    state.plan_groups([regrouped])
+    state.record_split(MAIN.id, 99)
+
+    [entry] = state.pending_groups()
+    assert [m.id for m in entry.group.matches] == [21]
+    assert entry.split_id == 99
+    assert entry.attempts == 0
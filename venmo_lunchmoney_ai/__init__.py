@@ -1,15 +1,16 @@
 from os import getenv
 
-import sentry_sdk
 
-from venmo_lunchmoney_ai.cli import run_cli
+def main():
+    sentry_dsn = getenv("SENTRY_DSN")
+    if sentry_dsn is not None:
+        from venmo_lunchmoney_ai.sentry import init_sentry
 
-sentry_dsn = getenv("SENTRY_DSN")
-if sentry_dsn is not None:
-    sentry_sdk.init(sentry_dsn, traces_sample_rate=1.0)
+        init_sentry(sentry_dsn)
 
+    # Imported here so importing the package stays cheap
+    from venmo_lunchmoney_ai.cli import run_cli
 
-def main():
     run_cli()
 
 
@@ -1,3 +1,3 @@
-from venmo_auto_cashout.cli import run_cli
+from venmo_lunchmoney_ai import main
 
-run_cli()
+main()
@@ -0,0 +1,97 @@
+import copy
+import tomllib
+
+import configargparse
+
+REQUIRED_OPTIONS = [
+    "lunchmoney-token",
+    "venmo-category",
+    "reimbursed-category",
+    "reimbursement-tag",
+    "telegram-token",
+    "telegram-channel",
+    "state-file",
+]
+"""
+Options every account must have, either from the accounts file or the command
+line
+"""
+
+ACCOUNT_OPTIONS = [
+    *REQUIRED_OPTIONS,
+    "dry-run",
+    "cutoff-days",
+    "full-sweep-interval",
+    "full-resync",
+    "max-prompt-tokens",
+    "retrieval-top-k",
+    "group-concurrency",
+]
+"""
+Options which may be set per account. Anything not set for an account falls
+back to the command line option.
+"""
+
+
+def _dest(option: str) -> str:
+    return option.replace("-", "_")
+
+
+def missing_options(args: configargparse.Namespace) -> list[str]:
+    """
+    The required account options which have not been set
+    """
+    return [f"--{option}" for option in REQUIRED_OPTIONS if getattr(args, _dest(option)) is None]
+
+
+def load_accounts(path: str, args: configargparse.Namespace) -> dict[str, configargparse.Namespace]:
+    """
+    Loads the account profiles from a TOML file. Each account is a table in
+    the `accounts` array using the same names as the command line options:
+
+        [[accounts]]
+        name = "evan"
+        lunchmoney-token = "..."
+        venmo-category = "Venmo"
+        reimbursed-category = "Venmo Reimbursed"
+        reimbursement-tag = "Pending Venmo"
+        telegram-channel = "-100123"
+        state-file = "/data/evan.db"
+
+    Returns the arguments for each account keyed by the account name, with
+    anything the account does not set taken from `args`.
+    """
+    with open(path, "rb") as f:
+        config = tomllib.load(f)
+
+    accounts: dict[str, configargparse.Namespace] = {}
+
+    for index, account in enumerate(config.get("accounts", [])):
+        name = str(account.pop("name", index))
+
+        if name in accounts:
+            raise ValueError(f"Account {name} is defined more than once in {path}")
+
+        unknown = set(account) - set(ACCOUNT_OPTIONS)
+        if unknown:
+            raise ValueError(f"Account {name} has unknown options: {', '.join(sorted(unknown))}")
+
+        account_args = copy.copy(args)
+        for option, value in account.items():
+            setattr(account_args, _dest(option), value)
+
+        missing = missing_options(account_args)
+        if missing:
+            raise ValueError(f"Account {name} is missing options: {', '.join(missing)}")
+
+        accounts[name] = account_args
+
+    if not accounts:
+        raise ValueError(f"No accounts are defined in {path}")
+
+    # Accounts sharing a state file would clobber each others state
+    state_files = [a.state_file for a in accounts.values()]
+    if len(set(state_files)) != len(state_files):
+        raise ValueError("Every account must use a different --state-file")
+
+    return accounts
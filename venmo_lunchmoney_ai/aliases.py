@@ -0,0 +1,186 @@
+import logging
+import re
+from collections import defaultdict
+from collections.abc import Iterable
+
+from venmo_lunchmoney_ai.lunchmoney import LunchMoneySession
+from venmo_lunchmoney_ai.matcher import NAME_THRESHOLD, expected_names, similarity
+
+Alias = tuple[str, str, str]
+"""
+A learned alias as (kind, key, alias). Friend aliases map a venmo sender to
+the nickname used for them in "Waiting on" notes, merchant aliases map a
+transaction payee to a word used for it in venmo notes.
+"""
+
+FRIEND = "friend"
+MERCHANT = "merchant"
+
+MIN_MERCHANT_CONFIRMATIONS = 2
+"""
+How many groups must have used a word in a venmo note for a payee before the
+word is trusted to mean that payee
+"""
+
+MAX_SENDER_NICKNAMES = 3
+"""
+Senders known by more nicknames than this are generic (such as "Venmo
+Received") rather than a person, and their aliases are ignored
+"""
+
+MAX_HISTORY_GROUPS = 25
+"""
+How many already grouped transactions are learned from per full sweep, which
+bounds the extra requests spent learning from history
+"""
+
+NOTE_STOPWORDS = frozenset(
+    """
+    the and for you your with from this that our was are its last night today
+    tonight yesterday thanks thank thx owe owed paid pay paying payment money
+    venmo split share half back covering dinner lunch breakfast brunch drinks
+    food snacks meal trip
+    """.split()
+)
+"""
+Common words, thanks, payments and meals are used in venmo notes for every
+merchant, so say nothing about the merchant and are never learned as aliases
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(value: str | None) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", (value or "").lower()))
+
+
+def note_words(note: str | None, sender: str | None = None) -> set[str]:
+    """
+    The words of a venmo note which may describe what it was for. Short words,
+    numbers, stopwords and the senders own name are not.
+    """
+    sender_words = set(_normalize(sender).split())
+
+    return set(
+        word
+        for word in _normalize(note).split()
+        if len(word) >= 3
+        and not word.isdigit()
+        and word not in NOTE_STOPWORDS
+        and word not in sender_words
+    )
+
+
+def learn_aliases(
+    payee: str | None,
+    notes: str | None,
+    venmos: list[tuple[str | None, str | None]],
+) -> list[Alias]:
+    """
+    Learns the aliases confirmed by a group, from the payee and notes of the
+    main transaction and the (payee, notes) of each venmo in the group.
+
+    Senders are paired with the names the main transaction was waiting on.
+    Names which are similar to a sender are paired first, and when exactly one
+    name and one sender are left over those must be the same person.
+    """
+    aliases: list[Alias] = []
+
+    for sender, note in venmos:
+        for word in note_words(note, sender):
+            aliases.append((MERCHANT, _normalize(payee), word))
+
+    names = expected_names(notes)
+    senders = [sender for sender, _ in venmos if sender]
+
+    if len(names) != len(venmos) or len(senders) != len(venmos):
+        return aliases
+
+    remaining_names = list(names)
+    remaining_senders = list(senders)
+
+    for name in names:
+        scores = [(similarity(name, sender), sender) for sender in remaining_senders]
+        score, sender = max(scores, default=(0.0, ""))
+
+        if score >= NAME_THRESHOLD:
+            aliases.append((FRIEND, _normalize(sender), _normalize(name)))
+            remaining_names.remove(name)
+            remaining_senders.remove(sender)
+
+    if len(remaining_names) == 1 and len(remaining_senders) == 1:
+        aliases.append((FRIEND, _normalize(remaining_senders[0]), _normalize(remaining_names[0])))
+
+    return aliases
+
+
+class AliasIndex:
+    """
+    In memory index of the aliases learned from earlier groups. Each lookup is
+    a constant time set lookup.
+    """
+
+    def __init__(self, rows: Iterable[tuple[str, str, str, int]] = ()):
+        self.nicknames: dict[str, set[str]] = defaultdict(set)
+        self.merchant_words: dict[str, set[str]] = defaultdict(set)
+
+        # How many payees each word has been used for, words used for more
+        # than one payee ("thanks", "dinner") say nothing about the payee
+        self.word_payees: dict[str, int] = defaultdict(int)
+
+        for kind, key, alias, count in rows:
+            if kind == FRIEND:
+                self.nicknames[key].add(alias)
+            elif kind == MERCHANT:
+                self.word_payees[alias] += 1
+                if count >= MIN_MERCHANT_CONFIRMATIONS:
+                    self.merchant_words[key].add(alias)
+
+    def __len__(self):
+        return sum(len(v) for v in self.nicknames.values()) + sum(
+            len(v) for v in self.merchant_words.values()
+        )
+
+    def is_nickname(self, name: str, sender: str | None) -> bool:
+        """
+        Checks if `name` is a confirmed nickname of the venmo sender
+        """
+        nicknames = self.nicknames.get(_normalize(sender))
+        if not nicknames or len(nicknames) > MAX_SENDER_NICKNAMES:
+            return False
+
+        return _normalize(name) in nicknames
+
+    def mentions_merchant(self, payee: str | None, note: str | None) -> bool:
+        """
+        Checks if the venmo note uses a word confirmed to mean the payee
+        """
+        words = self.merchant_words.get(_normalize(payee))
+        if not words:
+            return False
+
+        return any(w in words and self.word_payees[w] == 1 for w in note_words(note))
+
+
+def history_aliases(lunch: LunchMoneySession, group_id: int) -> list[Alias]:
+    """
+    Learns the aliases from a transaction group created before aliases were
+    learned. Groups created by this tool hold the reimbursed transaction (or
+    the reimbursed portion of it) along with the venmos, the "Waiting on"
+    note is found on the transaction that was split.
+    """
+    group = lunch.get_transaction_group(group_id)
+    children = group.children or []
+
+    targets = [c for c in children if c.amount > 0]
+    venmos = [c for c in children if c.amount < 0]
+
+    # Not a group this tool would have created
+    if len(targets) != 1 or not venmos:
+        return []
+
+    main = lunch.get_transaction(targets[0].id)
+    if main.parent_id:
+        main = lunch.get_transaction(main.parent_id)
+
+    return learn_aliases(group.payee, main.notes, [(v.payee, v.notes) for v in venmos])
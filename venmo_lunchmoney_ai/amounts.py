@@ -0,0 +1,189 @@
+import bisect
+import itertools
+from collections.abc import Iterator
+from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache
+
+from lunchable.models import TransactionObject
+
+MAX_PEOPLE = 10
+"""
+The most people we expect a transaction to be split between
+"""
+
+MAX_SUBSET_ITEMS = 24
+"""
+The most venmos the subset-sum search considers for a single transaction. The
+search enumerates 2^(n/2) subsets of each half, so this bounds it to a few
+thousand subsets per half.
+"""
+
+MAX_SOLUTIONS = 16
+"""
+Searches stop after finding this many combinations. More than one combination
+is already ambiguous, so there is no need to find every one.
+"""
+
+
+@lru_cache(maxsize=4096)
+def to_cents(amount: float) -> int:
+    # The same venmo amounts are converted for every transaction they could
+    # reimburse, and decimal conversion is slow
+    return int((Decimal(str(amount)) * 100).to_integral_value(ROUND_HALF_UP))
+
+
+def is_even_split(total: int, amounts: list[int]) -> bool:
+    """
+    Checks that each amount (in cents) is an even share of the total, where
+    the share is either split with me, or the total is entirely covered by
+    the amounts. Allows for a cent of rounding per person.
+    """
+    for people in (len(amounts) + 1, len(amounts)):
+        if all(abs(amount * people - total) <= people for amount in amounts):
+            return True
+
+    return False
+
+
+def is_even_share(total: int, amount: int) -> bool:
+    """
+    Checks that the amount (in cents) could be an even share of the total,
+    split between any number of people up to MAX_PEOPLE. Allows for a cent of
+    rounding per person, like is_even_split.
+    """
+    if amount <= 0:
+        return False
+
+    people = round(total / amount)
+
+    return 1 <= people <= MAX_PEOPLE and abs(amount * people - total) <= people
+
+
+def is_exact_cover(total: int, amounts: list[int]) -> bool:
+    """
+    Checks that the amounts (in cents) add up to exactly the total, meaning
+    the transaction was entirely covered by uneven shares. Uneven shares are
+    worked out by hand, so unlike an even split no rounding is allowed.
+    """
+    return sum(amounts) == total
+
+
+def _subset_sums(
+    items: list[tuple[int, int]],
+    max_size: int,
+) -> list[tuple[int, int, tuple[int, ...]]]:
+    """
+    Every subset of the (index, amount) items of up to `max_size` items, as
+    (sum, size, indexes)
+    """
+    subsets = []
+
+    for size in range(min(len(items), max_size) + 1):
+        for combination in itertools.combinations(items, size):
+            subsets.append((sum(a for _, a in combination), size, tuple(i for i, _ in combination)))
+
+    return subsets
+
+
+def subsets_summing_to(
+    amounts: list[int],
+    target: int,
+    tolerance: int,
+    size: int | None = None,
+) -> list[tuple[int, ...]]:
+    """
+    Finds combinations of the amounts (in cents) which sum to within
+    `tolerance` of the target, using a meet-in-the-middle search: the sums of
+    every subset of each half are enumerated, and each subset of one half is
+    paired with the subsets of the other half that complete it by binary
+    searching the sorted sums.
+
+    When `size` is given only combinations of exactly that many amounts are
+    returned. Returns the indexes of each combination, up to MAX_SOLUTIONS.
+    """
+    # Amounts above the target can never be part of a combination
+    items = [(i, a) for i, a in enumerate(amounts) if 0 < a <= target + tolerance]
+    items = items[:MAX_SUBSET_ITEMS]
+
+    max_size = size if size is not None else len(items)
+
+    middle = len(items) // 2
+    left = _subset_sums(items[:middle], max_size)
+    right = sorted(_subset_sums(items[middle:], max_size))
+    right_sums = [s for s, _, _ in right]
+
+    solutions: list[tuple[int, ...]] = []
+
+    for left_sum, left_size, left_indexes in left:
+        low = bisect.bisect_left(right_sums, target - tolerance - left_sum)
+        high = bisect.bisect_right(right_sums, target + tolerance - left_sum)
+
+        for _, right_size, right_indexes in right[low:high]:
+            combination = left_indexes + right_indexes
+
+            if not combination or (size is not None and left_size + right_size != size):
+                continue
+
+            solutions.append(combination)
+            if len(solutions) >= MAX_SOLUTIONS:
+                return solutions
+
+    return solutions
+
+
+def _even_split_combinations(
+    total: int,
+    amounts: list[int],
+    people: int | None,
+) -> Iterator[tuple[int, ...]]:
+    sizes = [people] if people else range(1, MAX_PEOPLE + 1)
+
+    for size in sizes:
+        for shares in (size + 1, size):
+            matching = [i for i, a in enumerate(amounts) if abs(a * shares - total) <= shares]
+            yield from itertools.islice(itertools.combinations(matching, size), MAX_SOLUTIONS)
+
+
+def feasible_combinations(
+    main: TransactionObject,
+    venmos: list[TransactionObject],
+    people: int | None = None,
+) -> list[list[TransactionObject]]:
+    """
+    Enumerates the combinations of venmos whose amounts are consistent with
+    reimbursing the main transaction. Either every venmo is an even share of
+    the transaction, or the venmos exactly cover it. When the number of
+    `people` we're waiting on is known only combinations of that many venmos
+    are considered.
+    """
+    total = to_cents(main.amount)
+    amounts = [to_cents(abs(v.amount)) for v in venmos]
+
+    found: set[tuple[int, ...]] = set()
+
+    for combination in _even_split_combinations(total, amounts, people):
+        found.add(combination)
+        if len(found) >= MAX_SOLUTIONS:
+            break
+
+    for combination in subsets_summing_to(amounts, total, 0, size=people):
+        found.add(tuple(sorted(combination)))
+
+    return [[venmos[i] for i in combination] for combination in sorted(found)]
+
+
+def could_complete(
+    main: TransactionObject,
+    venmos: list[TransactionObject],
+    people: int,
+) -> bool:
+    """
+    Checks if the venmos could possibly complete a main transaction waiting on
+    `people` reimbursements. There must be at least that many venmos, and the
+    smallest of them must not add up to more than the transaction.
+    """
+    amounts = sorted(to_cents(abs(v.amount)) for v in venmos)
+    if len(amounts) < people:
+        return False
+
+    return sum(amounts[:people]) <= to_cents(main.amount)
@@ -0,0 +1,199 @@
+import asyncio
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Protocol
+
+from venmo_lunchmoney_ai.metrics import Metrics
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from openai.types.chat import ChatCompletion
+
+MODEL_COSTS = {
+    "gpt-4": (30.0, 60.0),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-3.5-turbo": (0.5, 1.5),
+}
+"""
+Dollars per million prompt and completion tokens of known models. Models not
+listed here (such as a local model) are treated as free unless a cost is
+configured.
+"""
+
+DEFAULT_TIMEOUT = 120.0
+"""
+Seconds a single model request may take before it is abandoned
+"""
+
+
+@dataclass
+class Completion:
+    content: str
+    """
+    The groups JSON the model responded with
+    """
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+class Backend(Protocol):
+    """
+    A model which groups transactions. Backends are tried in tiers, a cheaper
+    tier first and a stronger tier when the cheaper one isn't confident.
+    """
+
+    tier: str
+    """
+    Name of the tier, used when reporting metrics
+    """
+    model: str
+
+    async def complete(self, messages: list[dict[str, str]], tool: dict[str, Any]) -> Completion:
+        """
+        Prompts the model, which must respond by calling `tool`
+        """
+        ...
+
+    def cost(self, completion: Completion) -> float:
+        """
+        The cost of a completion in dollars
+        """
+        ...
+
+    async def close(self): ...
+
+
+def response_content(response: "ChatCompletion") -> str:
+    """
+    Extracts the groups JSON from the response, the model should always call
+    the submit function but may still respond with plain content.
+    """
+    message = response.choices[0].message
+
+    if message.tool_calls:
+        return message.tool_calls[0].function.arguments
+
+    return message.content or ""
+
+
+@dataclass
+class OpenAIBackend:
+    """
+    A model served by the OpenAI API, or any OpenAI compatible API such as a
+    local llama.cpp server.
+    """
+
+    tier: str
+    model: str
+    client: "AsyncOpenAI"
+    timeout: float = DEFAULT_TIMEOUT
+    stream: bool = False
+    """
+    Stream the response. Slow local models are less likely to hit proxy and
+    server idle timeouts when the response is streamed.
+    """
+    costs: tuple[float, float] | None = None
+    """
+    Dollars per million prompt and completion tokens, defaults to the known
+    cost of the model
+    """
+
+    async def complete(self, messages: list[dict[str, str]], tool: dict[str, Any]) -> Completion:
+        params: dict[str, Any] = {
+            "model": self.model,
+            "messages": messages,
+            "tools": [tool],
+            "tool_choice": {"type": "function", "function": {"name": tool["function"]["name"]}},
+            "timeout": self.timeout,
+        }
+
+        # The client timeout applies to each read, bound the whole request
+        async with asyncio.timeout(self.timeout):
+            if not self.stream:
+                response = await self.client.chat.completions.create(**params)
+                usage = response.usage
+
+                return Completion(
+                    content=response_content(response),
+                    prompt_tokens=usage.prompt_tokens if usage else 0,
+                    completion_tokens=usage.completion_tokens if usage else 0,
+                )
+
+            stream = await self.client.chat.completions.create(
+                **params,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+
+            arguments: list[str] = []
+            content: list[str] = []
+            completion = Completion(content="")
+
+            async for chunk in stream:
+                if chunk.usage:
+                    completion.prompt_tokens = chunk.usage.prompt_tokens
+                    completion.completion_tokens = chunk.usage.completion_tokens
+
+                if not chunk.choices:
+                    continue
+
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content.append(delta.content)
+
+                # Only the first tool call holds the groups
+                for call in delta.tool_calls or []:
+                    if call.index == 0 and call.function and call.function.arguments:
+                        arguments.append(call.function.arguments)
+
+            completion.content = "".join(arguments) if arguments else "".join(content)
+
+            return completion
+
+    def cost(self, completion: Completion) -> float:
+        prompt_cost, completion_cost = self.costs or MODEL_COSTS.get(self.model, (0.0, 0.0))
+
+        return (
+            completion.prompt_tokens * prompt_cost + completion.completion_tokens * completion_cost
+        ) / 1_000_000
+
+    async def close(self):
+        await self.client.close()
+
+
+def create_openai_backend(
+    tier: str,
+    model: str,
+    api_key: str,
+    metrics: Metrics,
+    base_url: str | None = None,
+    timeout: float = DEFAULT_TIMEOUT,
+    stream: bool = False,
+    costs: tuple[float, float] | None = None,
+) -> OpenAIBackend:
+    """
+    Creates a backend for an OpenAI compatible API, recording each API call
+    to the metrics.
+    """
+    # openai is slow to import, only import it once a backend is needed
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    client = AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        http_client=DefaultAsyncHttpxClient(
+            event_hooks={"response": [metrics.async_response_hook("openai")]}
+        ),
+    )
+
+    return OpenAIBackend(tier, model, client, timeout=timeout, stream=stream, costs=costs)
+
+
+def parse_costs(value: str) -> tuple[float, float]:
+    """
+    Parses a `PROMPT,COMPLETION` pair of dollars per million tokens
+    """
+    prompt_cost, completion_cost = value.split(",")
+
+    return float(prompt_cost), float(completion_cost)
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def prompt_key(model: str, messages: list[dict[str, str]]) -> str:
+    """
+    Produces the content address for a prompt. Any change to the model, the
+    system prompt or the CSV payload produces a different key.
+    """
+    payload = json.dumps({"model": model, "messages": messages}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of LLM responses, keyed by the hash of the prompt. Entries
+    older than `max_age` seconds are expired, and the least recently used
+    entries are evicted once the cache grows larger than `max_size` bytes.
+    """
+
+    def __init__(self, directory: str, max_age: float, max_size: int):
+        self.directory = Path(directory)
+        self.max_age = max_age
+        self.max_size = max_size
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> str | None:
+        path = self._path(key)
+
+        try:
+            if time.time() - path.stat().st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+                logger.info(f"LLM cache expired: {key}")
+                return None
+
+            with open(path, "r") as f:
+                content = json.load(f)["content"]
+        except (FileNotFoundError, ValueError, KeyError):
+            logger.info(f"LLM cache miss: {key}")
+            return None
+
+        # Touch the entry so eviction is least-recently-used
+        os.utime(path)
+        logger.info(f"LLM cache hit: {key}")
+
+        return content
+
+    def set(self, key: str, content: str):
+        # Write to a temporary file first so a crash can never leave a
+        # truncated entry behind
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"content": content}, f)
+        os.replace(temp_path, self._path(key))
+
+        self.evict()
+
+    def delete(self, key: str):
+        self._path(key).unlink(missing_ok=True)
+        logger.info(f"LLM cache deleted: {key}")
+
+    def evict(self):
+        """
+        Removes expired entries, then the least recently used entries until
+        the cache fits within `max_size`.
+        """
+        now = time.time()
+        entries = []
+
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+
+            if now - stat.st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            total_size -= size
@@ -0,0 +1,132 @@
+import logging
+from collections.abc import Callable, Iterable, Iterator
+from datetime import date, datetime
+
+from lunchable.models import CategoriesObject, TagsObject, TransactionObject
+
+from venmo_lunchmoney_ai.lunchmoney import PAGE_SIZE, LunchMoneySession
+
+logger = logging.getLogger(__name__)
+
+
+def is_candidate(
+    transaction: TransactionObject,
+    venmo_category_id: int,
+    reimbursement_tag_id: int,
+) -> bool:
+    """
+    Candidate transactions match the following criteria
+
+    - Venmo reimbursement transactions (amount is income)
+    - Transactions marked with the reimbursement-tag
+    """
+    # Ignore already grouped transactions
+    if transaction.group_id:
+        return False
+
+    if transaction.category_id == venmo_category_id:
+        # Ignore venmo expense transactions
+        return transaction.amount <= 0
+
+    # Ignore transactions not marked with the reimbursement-tag
+    return any(t.id == reimbursement_tag_id for t in transaction.tags or [])
+
+
+def iter_candidates(
+    lunch: LunchMoneySession,
+    venmo_category: CategoriesObject,
+    reimbursement_tag: TagsObject,
+    start_date: date,
+    end_date: date,
+    on_grouped: Callable[[TransactionObject], None] | None = None,
+) -> Iterator[TransactionObject]:
+    """
+    Streams the candidate transactions from Lunch Money. The category and tag
+    filters are applied by the API, so only the venmos and the tagged
+    transactions are downloaded, and the remaining checks are applied as each
+    page arrives.
+
+    Venmos which were already grouped are not candidates, but are passed to
+    `on_grouped` so the groups they belong to can be learned from.
+    """
+    queries = [
+        {"category_id": venmo_category.id},
+        {"tag_id": reimbursement_tag.id},
+    ]
+    seen_ids: set[int] = set()
+
+    for query in queries:
+        for transaction in lunch.iter_transactions(
+            status="uncleared",
+            start_date=start_date,
+            end_date=end_date,
+            **query,
+        ):
+            # A tagged venmo is returned by both queries
+            if transaction.id in seen_ids:
+                continue
+            if on_grouped and transaction.group_id and transaction.amount < 0:
+                on_grouped(transaction)
+            if not is_candidate(transaction, venmo_category.id, reimbursement_tag.id):
+                continue
+
+            seen_ids.add(transaction.id)
+            yield transaction
+
+
+def partition_candidates(
+    transactions: Iterable[TransactionObject],
+    venmo_category_id: int,
+    excluded_ids: set[int],
+) -> tuple[list[TransactionObject], list[TransactionObject]]:
+    """
+    Splits the candidates into the venmos and the main transactions they may
+    reimburse in a single pass. Transactions in `excluded_ids`, along with the
+    portions of a split transaction in `excluded_ids`, are dropped.
+    """
+    venmos: list[TransactionObject] = []
+    main_transactions: list[TransactionObject] = []
+
+    for transaction in transactions:
+        if transaction.id in excluded_ids or transaction.parent_id in excluded_ids:
+            continue
+        if transaction.category_id == venmo_category_id:
+            venmos.append(transaction)
+        else:
+            main_transactions.append(transaction)
+
+    return venmos, main_transactions
+
+
+def recently_updated_candidates(
+    lunch: LunchMoneySession,
+    venmo_category_id: int,
+    reimbursement_tag_id: int,
+    since: datetime,
+    start_date: date,
+    end_date: date,
+) -> list[TransactionObject] | None:
+    """
+    The candidate transactions dated between `start_date` and `end_date`
+    which were created or updated `since` the given time. The venmos and the
+    tagged transactions are fetched together in a single request without any
+    category or tag filter, and filtered here instead.
+
+    Returns None when there were too many transactions to tell from a single
+    page.
+    """
+    transactions = lunch.get_transactions(
+        status="uncleared",
+        start_date=start_date,
+        end_date=end_date,
+        limit=PAGE_SIZE,
+    )
+
+    if len(transactions) >= PAGE_SIZE:
+        return None
+
+    return [
+        t
+        for t in transactions
+        if t.updated_at >= since and is_candidate(t, venmo_category_id, reimbursement_tag_id)
+    ]
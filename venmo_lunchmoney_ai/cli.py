@@ -1,22 +1,46 @@
-import json
+import asyncio
 import logging
-from datetime import datetime, timedelta
+from dataclasses import dataclass, replace
+from datetime import date, datetime, timedelta, timezone
+from functools import cached_property
+from typing import TYPE_CHECKING
 
 import configargparse
-import openai
-import sentry_sdk
 from lunchable import LunchMoney
-from lunchable.models import TransactionObject
-
-from venmo_lunchmoney_ai.grouping import create_lunchmoney_group
-from venmo_lunchmoney_ai.notify import notify_telegram
-from venmo_lunchmoney_ai.prompt import build_prompt_messages
-from venmo_lunchmoney_ai.state import (
-    get_prev_unprocessed_transactions,
-    set_prev_unprocessed_transactions,
+from lunchable.models import CategoriesObject, TagsObject, TransactionObject
+
+from venmo_lunchmoney_ai.accounts import load_accounts, missing_options
+from venmo_lunchmoney_ai.aliases import MAX_HISTORY_GROUPS, history_aliases, learn_aliases
+from venmo_lunchmoney_ai.amounts import could_complete
+from venmo_lunchmoney_ai.backends import (
+    DEFAULT_TIMEOUT,
+    Backend,
+    create_openai_backend,
+    parse_costs,
 )
+from venmo_lunchmoney_ai.cache import ResponseCache
+from venmo_lunchmoney_ai.candidates import (
+    iter_candidates,
+    partition_candidates,
+    recently_updated_candidates,
+)
+from venmo_lunchmoney_ai.clusters import connected_components, feasible_venmos, split_to_budget
+from venmo_lunchmoney_ai.daemon import CachedLookup, Trigger, run_daemon, serve_triggers
+from venmo_lunchmoney_ai.grouping import create_lunchmoney_group
+from venmo_lunchmoney_ai.llm import ESCALATE_CONFIDENCE, request_cluster_groups
+from venmo_lunchmoney_ai.lunchmoney import LunchMoneySession
+from venmo_lunchmoney_ai.matcher import match_locally, waiting_count
+from venmo_lunchmoney_ai.metrics import Metrics
+from venmo_lunchmoney_ai.notify import create_bot, notify_telegram
+from venmo_lunchmoney_ai.prompt import prompt_token_costs
+from venmo_lunchmoney_ai.retrieval import TOP_K, shortlist
+from venmo_lunchmoney_ai.sentry import capture_exception
+from venmo_lunchmoney_ai.state import Precheck, StateStore
 from venmo_lunchmoney_ai.types import ReimbursementGroup
 
+if TYPE_CHECKING:
+    from telegram import Bot
+
 CUTOFF_DAYS = 60
 """
 How many days worth of transactions should we look back. We're only included
@@ -26,6 +50,23 @@ This only needs to be as high as how long we might expect for someone to
 "delay" sending in a venmo reimbursement for something.
 """
 
+WINDOW_MARGIN_DAYS = 7
+"""
+How many days before the oldest pending transaction we look back from when not
+doing a full sweep.
+"""
+
+PRECHECK_DAYS = 7
+"""
+How many days before the last run the precheck looks back for changes. Changes
+to transactions dated before this are picked up by the next full sweep.
+"""
+
+MODEL = "gpt-4"
+"""
+The model transactions are grouped by when no other model is configured
+"""
+
 logger = logging.getLogger(__name__)
 
 
@@ -47,10 +88,55 @@ def parse_args():
         help="Take no actions",
         action="store_true",
     )
+    parser.add_argument(
+        "--daemon",
+        help="Keep running, matching transactions every --interval seconds",
+        action="store_true",
+        env_var="DAEMON",
+    )
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=15 * 60,
+        env_var="INTERVAL",
+        help="Seconds between runs in daemon mode",
+    )
+    parser.add_argument(
+        "--interval-jitter",
+        type=int,
+        default=60,
+        env_var="INTERVAL_JITTER",
+        help="Up to this many random seconds are added to each interval in daemon mode",
+    )
+    parser.add_argument(
+        "--trigger-port",
+        type=int,
+        env_var="TRIGGER_PORT",
+        help="Run in daemon mode, also running when POST /trigger is requested on this port",
+    )
+    parser.add_argument(
+        "--trigger-host",
+        default="127.0.0.1",
+        env_var="TRIGGER_HOST",
+        help="Address the trigger endpoint listens on",
+    )
+    parser.add_argument(
+        "--trigger-debounce",
+        type=float,
+        default=30,
+        env_var="TRIGGER_DEBOUNCE",
+        help="Seconds without another trigger before a triggered run starts",
+    )
+    parser.add_argument(
+        "--lookup-ttl",
+        type=int,
+        default=60 * 60,
+        env_var="LOOKUP_TTL",
+        help="Seconds that Lunchmoney categories and tags are cached for in daemon mode",
+    )
     parser.add_argument(
         "--lunchmoney-token",
         type=str,
-        required=True,
         env_var="LUNCHMONEY_TOKEN",
     )
     parser.add_argument(
@@ -59,50 +145,311 @@ def parse_args():
         required=True,
         env_var="OPENAI_TOKEN",
     )
+    parser.add_argument(
+        "--openai-base-url",
+        type=str,
+        env_var="OPENAI_BASE_URL",
+        help="URL of an OpenAI compatible API to use instead of OpenAI, such as a "
+        "local llama.cpp server",
+    )
+    parser.add_argument(
+        "--model",
+        type=str,
+        default=MODEL,
+        env_var="MODEL",
+        help="The model transactions are grouped by",
+    )
+    parser.add_argument(
+        "--model-cost",
+        type=parse_costs,
+        env_var="MODEL_COST",
+        help="Dollars per million prompt and completion tokens of --model, as "
+        "PROMPT,COMPLETION. Known OpenAI models default to their list price",
+    )
+    parser.add_argument(
+        "--fast-model",
+        type=str,
+        env_var="FAST_MODEL",
+        help="A cheaper or faster model which is prompted first. Prompts it isn't "
+        "confident about are escalated to --model",
+    )
+    parser.add_argument(
+        "--fast-model-base-url",
+        type=str,
+        env_var="FAST_MODEL_BASE_URL",
+        help="URL of an OpenAI compatible API serving --fast-model, defaults to --openai-base-url",
+    )
+    parser.add_argument(
+        "--fast-model-token",
+        type=str,
+        env_var="FAST_MODEL_TOKEN",
+        help="API token for --fast-model, defaults to --openai-token",
+    )
+    parser.add_argument(
+        "--fast-model-cost",
+        type=parse_costs,
+        env_var="FAST_MODEL_COST",
+        help="Dollars per million prompt and completion tokens of --fast-model",
+    )
+    parser.add_argument(
+        "--escalate-confidence",
+        type=float,
+        default=ESCALATE_CONFIDENCE,
+        env_var="ESCALATE_CONFIDENCE",
+        help="Prompts where --fast-model returns a group less confident than this "
+        "are escalated to --model",
+    )
+    parser.add_argument(
+        "--llm-timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        env_var="LLM_TIMEOUT",
+        help="Seconds a single model request may take",
+    )
+    parser.add_argument(
+        "--llm-stream",
+        action="store_true",
+        env_var="LLM_STREAM",
+        help="Stream model responses",
+    )
     parser.add_argument(
         "--venmo-category",
         type=str,
-        required=True,
         env_var="VENMO_CATEGORY",
         help="The category which contains un-sorted venmo transactions",
     )
     parser.add_argument(
         "--reimbursed-category",
         type=str,
-        required=True,
         env_var="REIMBURSED_CATEGORY",
         help="The category that grouped reimbursments will become a part of",
     )
     parser.add_argument(
         "--reimbursement-tag",
         type=str,
-        required=True,
         env_var="REIMBURSEMENT_TAG",
         help="The name of the tag which marks transactions pending venmo reimbursements",
     )
     parser.add_argument(
         "--telegram-token",
         type=str,
-        required=True,
         env_var="TELEGRAM_TOKEN",
         help="Telegram bot token for notifications",
     )
     parser.add_argument(
         "--telegram-channel",
         type=str,
-        required=True,
         env_var="TELEGRAM_CHANNEL",
         help="The telegram channel ID to send notifications to",
     )
+    parser.add_argument(
+        "--cutoff-days",
+        type=int,
+        default=CUTOFF_DAYS,
+        env_var="CUTOFF_DAYS",
+        help="How many days of transactions a full sweep looks back over",
+    )
+    parser.add_argument(
+        "--full-sweep-interval",
+        type=int,
+        default=24,
+        env_var="FULL_SWEEP_INTERVAL",
+        help="Hours between full sweeps of the --cutoff-days window",
+    )
+    parser.add_argument(
+        "--full-resync",
+        help="Look back over the full --cutoff-days window this run",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--openai-concurrency",
+        type=int,
+        default=4,
+        env_var="OPENAI_CONCURRENCY",
+        help="How many GPT-4 prompts may be in flight at once, across all accounts",
+    )
+    parser.add_argument(
+        "--max-prompt-tokens",
+        type=int,
+        default=6000,
+        env_var="MAX_PROMPT_TOKENS",
+        help="Prompts larger than this many tokens are split into smaller prompts",
+    )
+    parser.add_argument(
+        "--retrieval-top-k",
+        type=int,
+        default=0,
+        env_var="RETRIEVAL_TOP_K",
+        help="How many of the most similar pending transactions each venmo is matched "
+        f"against, {TOP_K} works well for large backlogs. By default (0) every venmo is "
+        "matched against every pending transaction",
+    )
+    parser.add_argument(
+        "--group-concurrency",
+        type=int,
+        default=4,
+        env_var="GROUP_CONCURRENCY",
+        help="How many Lunchmoney groups may be created at once",
+    )
+    parser.add_argument(
+        "--llm-cache-dir",
+        type=str,
+        env_var="LLM_CACHE_DIR",
+        help="Directory used to cache GPT-4 responses. Caching is disabled when not set",
+    )
+    parser.add_argument(
+        "--llm-cache-max-age",
+        type=int,
+        default=7,
+        env_var="LLM_CACHE_MAX_AGE",
+        help="Days a cached GPT-4 response is kept for",
+    )
+    parser.add_argument(
+        "--llm-cache-max-size",
+        type=int,
+        default=50,
+        env_var="LLM_CACHE_MAX_SIZE",
+        help="Maximum size of the GPT-4 response cache in megabytes",
+    )
     parser.add_argument(
         "--state-file",
         type=str,
-        required=True,
         env_var="STATE_FILE",
         help="Used to track previous runs ",
     )
+    parser.add_argument(
+        "--accounts-file",
+        type=str,
+        env_var="ACCOUNTS_FILE",
+        help="TOML file of account profiles to process together in one process",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        env_var="METRICS_FILE",
+        help="Write run metrics to this file after each run, as JSON when it ends in .json, "
+        "otherwise in the Prometheus text format",
+    )
+
+    args = parser.parse_args()
+
+    # Account options may instead come from the accounts file
+    missing = missing_options(args)
+    if missing and not args.accounts_file:
+        parser.error(f"the following arguments are required: {', '.join(missing)}")
+
+    return args
+
+
+class Clients:
+    """
+    The model backends and Telegram bots shared by every account. Most runs
+    find nothing has changed and never prompt the model or send a
+    notification, so the clients (and their slow to import libraries) are only
+    created once a run needs them.
+    """
+
+    def __init__(self, args: configargparse.Namespace, metrics: Metrics):
+        self.args = args
+        self.metrics = metrics
+        self._bots: dict[str, "Bot"] = {}
+        self._bots_lock = asyncio.Lock()
+
+    @cached_property
+    def backends(self) -> list[Backend]:
+        args = self.args
+        backends: list[Backend] = []
+
+        if args.fast_model:
+            backends.append(
+                create_openai_backend(
+                    "fast",
+                    args.fast_model,
+                    api_key=args.fast_model_token or args.openai_token,
+                    metrics=self.metrics,
+                    base_url=args.fast_model_base_url or args.openai_base_url,
+                    timeout=args.llm_timeout,
+                    stream=args.llm_stream,
+                    costs=args.fast_model_cost,
+                )
+            )
+
+        backends.append(
+            create_openai_backend(
+                "strong",
+                args.model,
+                api_key=args.openai_token,
+                metrics=self.metrics,
+                base_url=args.openai_base_url,
+                timeout=args.llm_timeout,
+                stream=args.llm_stream,
+                costs=args.model_cost,
+            )
+        )
+
+        return backends
+
+    async def bot(self, token: str) -> "Bot":
+        # Groups notify concurrently, only one of them creates the bot
+        async with self._bots_lock:
+            if token not in self._bots:
+                self._bots[token] = await create_bot(token)
+
+        return self._bots[token]
+
+    async def close(self):
+        for bot in self._bots.values():
+            await bot.shutdown()
+
+        # Only close the backends if they were ever created
+        if "backends" in self.__dict__:
+            for backend in self.backends:
+                await backend.close()
+
+
+@dataclass
+class Context:
+    """
+    Clients and lookups for an account which are kept between runs in daemon
+    mode. The clients, LLM semaphore, cache and metrics are shared by every
+    account.
+    """
+
+    name: str
+    args: configargparse.Namespace
+    lunch: LunchMoney
+    clients: Clients
+    llm_semaphore: asyncio.Semaphore
+    llm_cache: ResponseCache | None
+    categories: CachedLookup[list[CategoriesObject]]
+    tags: CachedLookup[list[TagsObject]]
+    metrics: Metrics
+
+
+def get_start_date(args: configargparse.Namespace, state: StateStore) -> tuple[date, bool]:
+    """
+    Determines how far back to look for transactions. Most runs only need to
+    look back to just before the oldest transaction still pending
+    reimbursement, the full --cutoff-days window is only swept periodically.
+
+    Returns the start date and whether this is a full sweep.
+    """
+    full_start = date.today() - timedelta(days=args.cutoff_days)
+
+    window_start = state.get_window_start()
+    last_full_sweep = state.get_last_full_sweep()
 
-    return parser.parse_args()
+    if (
+        args.full_resync
+        or last_full_sweep is None
+        or datetime.now() - last_full_sweep > timedelta(hours=args.full_sweep_interval)
+    ):
+        return full_start, True
+
+    if window_start is None:
+        window_start = date.today()
+
+    return max(full_start, window_start - timedelta(days=WINDOW_MARGIN_DAYS)), False
 
 
 def run_cli():
@@ -111,21 +458,165 @@ def run_cli():
     if args.verbose:
         logging.basicConfig(level=logging.INFO)
 
-    dry_run = args.dry_run
-
-    if dry_run:
+    if args.dry_run:
         logger.info("Running in dry-run mode. Transactions will not be modified.")
 
-    lunch = LunchMoney(access_token=args.lunchmoney_token)
-    openai.api_key = args.openai_token
+    if args.accounts_file:
+        accounts = load_accounts(args.accounts_file, args)
+        logger.info(f"Loaded {len(accounts)} accounts from {args.accounts_file}")
+    else:
+        accounts = {"default": args}
+
+    metrics = Metrics()
+
+    llm_cache = None
+    if args.llm_cache_dir:
+        llm_cache = ResponseCache(
+            args.llm_cache_dir,
+            max_age=args.llm_cache_max_age * 24 * 60 * 60,
+            max_size=args.llm_cache_max_size * 1024 * 1024,
+        )
+
+    # One set of clients and concurrency limit for every account, so the model
+    # is throttled across accounts
+    clients = Clients(args, metrics)
+    llm_semaphore = asyncio.Semaphore(args.openai_concurrency)
+
+    contexts: list[Context] = []
+
+    for name, account_args in accounts.items():
+        lunch = LunchMoney(access_token=account_args.lunchmoney_token)
+        lunch.session.event_hooks["response"].append(metrics.response_hook("lunchmoney"))
+
+        contexts.append(
+            Context(
+                name=name,
+                args=account_args,
+                lunch=lunch,
+                clients=clients,
+                llm_semaphore=llm_semaphore,
+                llm_cache=llm_cache,
+                categories=CachedLookup(lunch.get_categories, ttl=args.lookup_ttl),
+                tags=CachedLookup(lunch.get_tags, ttl=args.lookup_ttl),
+                metrics=metrics,
+            )
+        )
+
+    asyncio.run(run_main(args, contexts))
+
+
+async def run_main(args: configargparse.Namespace, contexts: list[Context]):
+    server = None
+
+    try:
+        if args.trigger_port:
+            trigger = Trigger(args.trigger_debounce)
+            server = await serve_triggers(trigger, args.trigger_host, args.trigger_port)
+
+            await run_daemon(
+                lambda: run_all(args, contexts),
+                args.interval,
+                args.interval_jitter,
+                trigger=trigger,
+            )
+        elif args.daemon:
+            await run_daemon(lambda: run_all(args, contexts), args.interval, args.interval_jitter)
+        else:
+            await run_all(args, contexts)
+    finally:
+        if server:
+            server.close()
+        await contexts[0].clients.close()
+
+
+async def run_all(args: configargparse.Namespace, contexts: list[Context]):
+    """
+    Runs every account concurrently. A failing account does not stop the
+    others, the run only fails when every account failed.
+    """
+    try:
+        if len(contexts) == 1:
+            await run_measured(contexts[0])
+            return
+
+        results = await asyncio.gather(
+            *(run_measured(ctx) for ctx in contexts),
+            return_exceptions=True,
+        )
+
+        failures = 0
+        for ctx, result in zip(contexts, results):
+            if isinstance(result, Exception):
+                failures += 1
+                logger.error(f"Run failed for account {ctx.name}", exc_info=result)
+                capture_exception(result)
+
+        if failures == len(contexts):
+            raise RuntimeError(f"Run failed for all {failures} accounts")
+    finally:
+        if args.metrics_file:
+            contexts[0].metrics.write(args.metrics_file)
+
+
+async def run_measured(ctx: Context):
+    """
+    Runs once for the account, recording the run in Sentry
+    """
+    with ctx.metrics.run(f"venmo-lunchmoney-ai {ctx.name}", account=ctx.name):
+        await run_once(ctx)
+
+
+async def run_once(ctx: Context):
+    args = ctx.args
+    metrics = ctx.metrics
+    lunch = LunchMoneySession(ctx.lunch, metrics)
+    dry_run = args.dry_run
+    started_at = datetime.now(timezone.utc)
+
+    state = StateStore(args.state_file, dry_run=dry_run)
+    aliases = state.load_aliases()
+
+    start_date, full_sweep = get_start_date(args, state)
+
+    # Most runs find nothing has changed. That can usually be found with one
+    # small request for what was updated since the last run, before looking
+    # anything else up
+    precheck = state.get_precheck()
+
+    if (
+        precheck is not None
+        and not full_sweep
+        and precheck.venmo_category == args.venmo_category
+        and precheck.reimbursement_tag == args.reimbursement_tag
+        and not state.pending_groups()
+        and not state.retry_count()
+    ):
+        with metrics.stage("precheck"):
+            updated = await asyncio.to_thread(
+                recently_updated_candidates,
+                lunch,
+                precheck.venmo_category_id,
+                precheck.reimbursement_tag_id,
+                since=precheck.checked_at,
+                start_date=precheck.checked_at.date() - timedelta(days=PRECHECK_DAYS),
+                end_date=date.today(),
+            )
+
+        if updated is not None and not state.changed_transactions(updated):
+            logger.info("Nothing updated since last run. Nothing to do")
+            metrics.incr("precheck_skips_total")
+            if not dry_run:
+                state.record_precheck(replace(precheck, checked_at=started_at))
+            return
 
     # Validate some args
-    categories = lunch.get_categories()
+    categories = await asyncio.to_thread(ctx.categories.get)
     try:
         venmo_category = next(c for c in categories if c.name == args.venmo_category)
         logger.info(f"Found venmo category: {venmo_category.name}")
     except StopIteration:
         logger.error(f"Cannot find Lunchmoney category {args.venmo_category}")
+        ctx.categories.invalidate()
         return
 
     try:
@@ -133,133 +624,339 @@ def run_cli():
         logger.info(f"Found reimbursed category: {reimbursed_category.name}")
     except StopIteration:
         logger.error(f"Cannot find Lunchmoney category {args.reimbursed_category}")
+        ctx.categories.invalidate()
         return
 
-    tags = lunch.get_tags()
+    tags = await asyncio.to_thread(ctx.tags.get)
     try:
         reimbursement_tag = next(t for t in tags if t.name == args.reimbursement_tag)
         logger.info(f"Found reimbursed tag: {reimbursement_tag.name}")
     except StopIteration:
         logger.error(f"Cannot find Lunchmoney tag {args.reimbursement_tag}")
+        ctx.tags.invalidate()
         return
 
-    prev_unprocessed_txns = get_prev_unprocessed_transactions(args.state_file)
+    # Groups are created concurrently, limited to avoid being rate limited
+    semaphore = asyncio.Semaphore(args.group_concurrency)
 
-    logger.info(f"Previous unprocessed transactions: {prev_unprocessed_txns}")
+    async def process_group(
+        group: ReimbursementGroup,
+        split_id: int | None = None,
+        resume: bool = False,
+    ) -> bool:
+        names = [t.payee or "" for t in group.matches]
+        logger.info(f"Found group for {group.transaction.payee} {names}")
 
-    # Reduce the transaction to just candidate transactions. These transactions
-    # match the following criteria
-    #
-    # - Venmo reimbursement transactions (amount is income)
-    # - Transactions marked with the reimbursement-tag
-    #
-    transactions = [
-        transaction
-        for transaction in lunch.get_transactions(
-            status="uncleared",
-            start_date=datetime.now() - timedelta(days=CUTOFF_DAYS),
-            end_date=datetime.now(),
-        )
-        if
-        # Ignore already grouped transactions
-        not transaction.group_id
-        # Ignore venmo expense transactions
-        and not (transaction.category_id == venmo_category.id and transaction.amount > 0)
-        # Ignore transactions not marked with the reimbursement-tag
-        and not (
-            transaction.category_id != venmo_category.id
-            and not any(t for t in (transaction.tags or []) if t.id == reimbursement_tag.id)
+        def on_split(split_id: int):
+            state.record_split(group.transaction.id, split_id)
+
+        try:
+            if not dry_run:
+                async with semaphore:
+                    with metrics.stage("group_create"):
+                        group_id = await asyncio.to_thread(
+                            create_lunchmoney_group,
+                            lunch,
+                            reimbursed_category,
+                            group,
+                            split_id=split_id,
+                            on_split=on_split,
+                            resume=resume,
+                        )
+                state.complete_group(group.transaction.id)
+
+                # Remember how the people and merchant of the group were
+                # referred to, so the next group like it can be matched locally
+                if group_id is not None:
+                    learned = learn_aliases(
+                        group.transaction.payee,
+                        group.transaction.notes,
+                        [(m.payee, m.notes) for m in group.matches],
+                    )
+                    state.record_aliases(learned, group_id)
+                    metrics.incr("aliases_learned_total", len(learned))
+            else:
+                logger.info("Skipping lunchmoney split in dry-run")
+        except Exception as e:
+            logger.warn(
+                f"Failed to create group for: {group.transaction.payee}",
+                exc_info=True,
+            )
+            capture_exception(e)
+            metrics.incr("group_create_failures_total")
+            if not dry_run:
+                state.fail_group(group.transaction.id)
+            return False
+
+        try:
+            with metrics.stage("notify"):
+                metrics.incr("api_calls_total", service="telegram")
+                await notify_telegram(
+                    await ctx.clients.bot(args.telegram_token), group, args.telegram_channel
+                )
+        except Exception as e:
+            logger.warn(
+                f"Failed to send telegram notification for: {group.transaction.payee}",
+                exc_info=True,
+            )
+            capture_exception(e)
+
+        return True
+
+    # Finish writing the groups an earlier run failed part way through, these
+    # don't need to be matched again
+    journaled_ids: set[int] = set()
+
+    if not dry_run:
+        journal = state.pending_groups()
+
+        if journal:
+            logger.info(f"Resuming {len(journal)} journaled groups")
+            metrics.incr("group_resumes_total", len(journal))
+            await asyncio.gather(
+                *(process_group(e.group, e.split_id, resume=True) for e in journal)
+            )
+
+        # Groups which failed again are left in the journal for the next run
+        journaled_ids = set(t.id for e in state.pending_groups() for t in e.group.transactions)
+
+    logger.info(f"Looking back to {start_date:%Y-%m-%d} (full sweep: {full_sweep})")
+
+    # Groups created before aliases were learned (or by hand) are learned from
+    # during full sweeps
+    earlier_group_ids: set[int] = set()
+
+    def on_grouped(transaction: TransactionObject):
+        if full_sweep and not dry_run:
+            earlier_group_ids.add(transaction.group_id)
+
+    # Transactions in the journal (including the portions of a main
+    # transaction which was already split) are only written by the journal.
+    # The candidates are partitioned as they arrive.
+    with metrics.stage("fetch"):
+        venmos, main_transactions = await asyncio.to_thread(
+            lambda: partition_candidates(
+                iter_candidates(
+                    lunch,
+                    venmo_category,
+                    reimbursement_tag,
+                    start_date=start_date,
+                    end_date=date.today(),
+                    on_grouped=on_grouped,
+                ),
+                venmo_category.id,
+                excluded_ids=journaled_ids,
+            )
         )
-    ]
+    transactions = [*venmos, *main_transactions]
 
-    logger.info(f"Got {len(transactions)} candidate transactions from Lunchmoney")
+    history_ids = sorted(earlier_group_ids - state.learned_group_ids())[:MAX_HISTORY_GROUPS]
+
+    if history_ids:
+        with metrics.stage("learn_history"):
+            for group_id in history_ids:
+                try:
+                    learned = await asyncio.to_thread(history_aliases, lunch, group_id)
+                except Exception as e:
+                    logger.warn(f"Failed to learn from group {group_id}", exc_info=True)
+                    capture_exception(e)
+                    continue
+
+                state.record_aliases(learned, group_id)
+                metrics.incr("aliases_learned_total", len(learned))
 
-    venmos = [t for t in transactions if t.category_id == venmo_category.id]
-    main_transactions = [t for t in transactions if t.category_id != venmo_category.id]
+        aliases = state.load_aliases()
+        logger.info(f"Learned from {len(history_ids)} earlier groups, {len(aliases)} aliases")
+
+    logger.info(f"Got {len(transactions)} candidate transactions from Lunchmoney")
+    metrics.incr("candidates_total", len(transactions))
 
     transacton_ids = set(t.id for t in transactions)
     logger.info(f"Lunchmoney transaction IDs are: {transacton_ids}")
 
+    def save_state(
+        prompted_ids: set[int],
+        grouped_ids: set[int],
+        failed_ids: set[int] | None = None,
+    ):
+        """
+        Record the transactions we've seen. We'll use this during the next run
+        to know which transactions are new or have changed. Transactions whose
+        prompt failed are left to be prompted again.
+        """
+        if dry_run:
+            logger.info("Not saving transactions to state file in dry-run")
+            return
+
+        # The next run only needs to look back to the oldest transaction that
+        # is still waiting on reimbursements
+        pending_dates = [
+            t.date
+            for t in transactions
+            if t.category_id != venmo_category.id and t.id not in grouped_ids
+        ]
+
+        state.record_run(
+            transactions,
+            prompted_ids=prompted_ids,
+            grouped_ids=grouped_ids,
+            failed_ids=failed_ids or set(),
+            window_start=min(pending_dates, default=None),
+            full_sweep=full_sweep,
+        )
+        state.record_precheck(
+            Precheck(
+                checked_at=started_at,
+                venmo_category=venmo_category.name,
+                venmo_category_id=venmo_category.id,
+                reimbursement_tag=reimbursement_tag.name,
+                reimbursement_tag_id=reimbursement_tag.id,
+            )
+        )
+
     # Nothing to do if we have no venmo transactions
     if not venmos:
         logger.info("No transactions in the Venmo category, nothing to do.")
+        save_state(set(), set())
         return
 
     # Nothing to do if we have no transactions marked as pending venmos
     if not main_transactions:
         logger.info("No transactions pending venmo reimbursements, nothing to do.")
+        save_state(set(), set())
         return
 
-    # Nothing to do if we have the same set of transactions from our last run
-    if transacton_ids == prev_unprocessed_txns:
-        logger.info("Same set of transactions from last run. Nothing to do")
+    # Nothing to do if none of the transactions changed since our last run
+    with metrics.stage("filter"):
+        changed_ids = set(t.id for t in state.changed_transactions(transactions))
+
+    if not changed_ids:
+        logger.info("No new or changed transactions since last run. Nothing to do")
+        save_state(set(), set())
         return
 
-    # Ask chat GPT how to group venmo transactions
-    logger.info("Sending prompt to GPT-4...")
-    messages = build_prompt_messages(venmo_category.name, categories, transactions)
-    response = openai.ChatCompletion.create(model="gpt-4", messages=messages)
+    logger.info(f"New or changed transactions: {changed_ids}")
+
+    # Only the independent sets of transactions which the changed transactions
+    # could affect need to be matched again
+    with metrics.stage("filter"):
+        # Each venmo is only compared against the pending transactions it most
+        # plausibly reimburses
+        shortlists = None
+        if args.retrieval_top_k:
+            shortlists = shortlist(main_transactions, venmos, args.retrieval_top_k)
+
+        affected = [
+            component
+            for component in connected_components(main_transactions, venmos, shortlists, aliases)
+            if any(t.id in changed_ids for t in component)
+        ]
+    affected_ids = set(t.id for component in affected for t in component)
+
+    venmos = [t for t in venmos if t.id in affected_ids]
+    main_transactions = [t for t in main_transactions if t.id in affected_ids]
+
+    logger.info(f"Matching {len(affected_ids)} transactions affected by changes")
+
+    # Match the obvious groups locally, only the ambiguous remainder needs to
+    # be sent to GPT-4
+    with metrics.stage("local_match"):
+        groups, remaining_mains, remaining_venmos = match_locally(
+            main_transactions, venmos, shortlists, aliases
+        )
 
-    try:
-        assert isinstance(response, dict)
-        json_response = json.loads(response["choices"][0]["message"]["content"])
-    except:
-        logger.warn("Unexpected GPT-4 response", extra={"response": response})
-        return
+    logger.info(f"Matched {len(groups)} groups locally")
+    metrics.incr("groups_total", len(groups), source="local")
+
+    # A transaction waiting on more people than could possibly have paid would
+    # only ever produce a group missing reimbursements, which is never
+    # created. There's no need to ask GPT-4 about those yet. Every feasible
+    # venmo is considered here, since a shortlist may have missed one.
+    with metrics.stage("amounts"):
+        feasible = feasible_venmos(remaining_mains, remaining_venmos)
+        incomplete_ids = set(
+            main.id
+            for main in remaining_mains
+            if (people := waiting_count(main.notes))
+            and not could_complete(main, feasible[main.id], people)
+        )
+        remaining_mains = [t for t in remaining_mains if t.id not in incomplete_ids]
+
+    logger.info(f"Skipping {len(incomplete_ids)} transactions still waiting on reimbursements")
+    metrics.incr("incomplete_skipped_total", len(incomplete_ids))
+
+    # Transactions which are sent to GPT-4, and those whose prompt failed
+    prompted_transactions: list[TransactionObject] = []
+    failed_transactions: list[TransactionObject] = []
 
-    transactions_map = {t.id: t for t in transactions}
+    with metrics.stage("cluster"):
+        # Each independent cluster of the remaining transactions is prompted
+        # separately, keeping each prompt small
+        clusters = connected_components(remaining_mains, remaining_venmos, shortlists, aliases)
 
-    groups = [
-        ReimbursementGroup(
-            transaction=transactions_map[data["transaction_id"]],
-            matches=[transactions_map[id] for id in data["matches"]],
-            missing_reimbursements=data["missing_reimbursements"],
-            confidence=data["confidence"],
-            confidence_reason=data["confidence_reason"],
+        # Split any clusters too large to fit within the prompt token budget
+        base_tokens, token_costs = prompt_token_costs(
+            venmo_category.name,
+            categories,
+            [t for cluster in clusters for t in cluster],
         )
-        for data in json_response
-    ]
+        clusters = [
+            batch
+            for cluster in clusters
+            for batch in split_to_budget(
+                cluster,
+                set(t.id for t in remaining_venmos),
+                base_tokens,
+                token_costs,
+                args.max_prompt_tokens,
+            )
+        ]
+
+    if clusters:
+        prompted_transactions = [t for cluster in clusters for t in cluster]
+        logger.info(f"Sending {len(clusters)} prompts to GPT-4...")
+        llm_groups, failed_clusters = await request_cluster_groups(
+            ctx.clients.backends,
+            venmo_category.name,
+            categories,
+            clusters,
+            semaphore=ctx.llm_semaphore,
+            cache=ctx.llm_cache,
+            metrics=metrics,
+            escalate_confidence=args.escalate_confidence,
+        )
+        metrics.incr("groups_total", len(llm_groups), source="llm")
+        metrics.incr("prompt_failures_total", len(failed_clusters))
+        groups.extend(llm_groups)
+
+        failed_transactions = [t for cluster in failed_clusters for t in cluster]
+    else:
+        logger.info("No remaining transactions can be matched, skipping GPT-4")
 
     # Groups ready to be converted to lunchmoeny groups
     ready_groups = [group for group in groups if group.is_ready]
 
-    # Transactions that were succesffuly converted into lunch money transactions
-    successful_transactions: list[TransactionObject] = []
+    # Journal the groups before writing them so a failure part way through
+    # writing is resumed by the next run
+    if not dry_run:
+        state.plan_groups(ready_groups)
 
-    for group in ready_groups:
-        names = [t.payee or "" for t in group.matches]
-        logger.info(f"Found group for {group.transaction.payee} {names}")
+    results = await asyncio.gather(*(process_group(group) for group in ready_groups))
 
-        try:
-            if not dry_run:
-                create_lunchmoney_group(lunch, reimbursed_category, group)
-            else:
-                logger.info("Skipping lunchmoney split in dry-run")
-            successful_transactions.extend(group.transactions)
-        except Exception as e:
-            logger.warn(
-                f"Failed to create group for: {group.transaction.payee}",
-                exc_info=True,
-            )
-            sentry_sdk.capture_exception(e)
-            continue
+    # Transactions that were succesffuly converted into lunch money transactions
+    successful_transactions = [
+        transaction
+        for group, success in zip(ready_groups, results)
+        if success
+        for transaction in group.transactions
+    ]
 
-        try:
-            notify_telegram(group, args.telegram_token, args.telegram_channel)
-        except Exception as e:
-            logger.warn(
-                f"Failed to send telegram notification for: {group.transaction.payee}",
-                exc_info=True,
-            )
-            sentry_sdk.capture_exception(e)
-            continue
+    grouped_ids = set(t.id for t in successful_transactions)
+    logger.info(f"Skipped transactions: {transacton_ids - grouped_ids}")
 
-    # Record what transactions were skippsed. We'll use this during the next
-    # run to know if we have new transactions or not.
-    skipped_ids = list(transacton_ids - set(t.id for t in successful_transactions))
-    logger.info(f"Skipped transactions: {skipped_ids}")
+    # A transaction may be prompted in more than one batch, it's only been
+    # looked at once every batch it was in succeeded
+    failed_ids = set(t.id for t in failed_transactions) - grouped_ids
+    prompted_ids = set(t.id for t in prompted_transactions) - failed_ids
 
-    if not dry_run:
-        set_prev_unprocessed_transactions(args.state_file, skipped_ids)
-    else:
-        logger.info("Not saving skipped transactions to state file in dry-run")
+    save_state(prompted_ids, grouped_ids, failed_ids)
@@ -0,0 +1,177 @@
+from datetime import timedelta
+from typing import TYPE_CHECKING
+
+from lunchable.models import TransactionObject
+
+from venmo_lunchmoney_ai.matcher import NAME_THRESHOLD, expected_names, merchant_score, name_score
+
+if TYPE_CHECKING:
+    from venmo_lunchmoney_ai.aliases import AliasIndex
+
+EARLY_VENMO_DAYS = 1
+"""
+How many days before the main transaction a venmo may be dated. Friends
+sometimes pay before the main transaction has posted.
+"""
+
+
+def can_match(main: TransactionObject, venmo: TransactionObject) -> bool:
+    """
+    Determines if a venmo could possibly be a reimbursement for the main
+    transaction. The venmo must not predate the main transaction and can never
+    reimburse more than was spent.
+    """
+    if venmo.date < main.date - timedelta(days=EARLY_VENMO_DAYS):
+        return False
+
+    return abs(venmo.amount) <= main.amount
+
+
+def names_overlap(
+    main: TransactionObject,
+    venmo: TransactionObject,
+    aliases: "AliasIndex | None" = None,
+) -> bool:
+    """
+    Determines if the venmo mentions the main transaction, either by the venmo
+    note naming the main transaction payee, or by the venmo coming from one of
+    the people the main transaction is waiting on.
+    """
+    if merchant_score(main, venmo, aliases) >= NAME_THRESHOLD:
+        return True
+
+    return any(
+        name_score(name, venmo, aliases) >= NAME_THRESHOLD for name in expected_names(main.notes)
+    )
+
+
+def feasible_venmos(
+    main_transactions: list[TransactionObject],
+    venmos: list[TransactionObject],
+) -> dict[int, list[TransactionObject]]:
+    """
+    The venmos which could reimburse each main transaction, keyed by the main
+    transaction ID.
+    """
+    return {m.id: [v for v in venmos if can_match(m, v)] for m in main_transactions}
+
+
+def connected_components(
+    main_transactions: list[TransactionObject],
+    venmos: list[TransactionObject],
+    shortlists: dict[int, list[int]] | None = None,
+    aliases: "AliasIndex | None" = None,
+) -> list[list[TransactionObject]]:
+    """
+    Partitions the candidate transactions into independent sets, where no
+    venmo in one set could possibly match a main transaction in another set.
+
+    A venmo is linked to every main transaction it could feasibly reimburse,
+    or when `shortlists` are given only to the main transactions shortlisted
+    for it. When the venmo mentions some of those main transactions by name it
+    is only linked to those, which keeps unrelated transactions in separate
+    sets.
+
+    Components that do not contain both a main transaction and a venmo can
+    never produce a group and are not returned.
+    """
+    parent: dict[int, int] = {t.id: t.id for t in [*main_transactions, *venmos]}
+
+    def find(id: int) -> int:
+        while parent[id] != id:
+            parent[id] = parent[parent[id]]
+            id = parent[id]
+        return id
+
+    mains_by_id = {m.id: m for m in main_transactions}
+
+    for venmo in venmos:
+        if shortlists is not None:
+            ids = shortlists.get(venmo.id, [])
+            feasible = [mains_by_id[id] for id in ids if id in mains_by_id]
+        else:
+            feasible = [m for m in main_transactions if can_match(m, venmo)]
+        named = [m for m in feasible if names_overlap(m, venmo, aliases)]
+
+        for main in named or feasible:
+            parent[find(venmo.id)] = find(main.id)
+
+    components: dict[int, list[TransactionObject]] = {}
+    for transaction in [*main_transactions, *venmos]:
+        components.setdefault(find(transaction.id), []).append(transaction)
+
+    venmo_ids = set(v.id for v in venmos)
+
+    return [
+        component
+        for component in components.values()
+        if any(t.id in venmo_ids for t in component)
+        and any(t.id not in venmo_ids for t in component)
+    ]
+
+
+def split_to_budget(
+    cluster: list[TransactionObject],
+    venmo_ids: set[int],
+    base_tokens: int,
+    token_costs: dict[int, int],
+    max_tokens: int,
+) -> list[list[TransactionObject]]:
+    """
+    Splits a cluster that is too large to prompt at once into batches within
+    the token budget. Each batch holds whole main transactions along with
+    every venmo that could match them, so a venmo may appear in more than one
+    batch. When a single main transaction and its venmos don't fit, the least
+    likely venmos are trimmed.
+    """
+
+    def tokens(transactions: list[TransactionObject]) -> int:
+        return base_tokens + sum(token_costs[t.id] for t in transactions)
+
+    if tokens(cluster) <= max_tokens:
+        return [cluster]
+
+    venmos = [t for t in cluster if t.id in venmo_ids]
+    mains = sorted((t for t in cluster if t.id not in venmo_ids), key=lambda t: t.date)
+
+    def batch(batch_mains: list[TransactionObject]) -> list[TransactionObject]:
+        matching = [v for v in venmos if any(can_match(m, v) for m in batch_mains)]
+        return [*batch_mains, *matching]
+
+    def trimmed(main: TransactionObject) -> list[TransactionObject]:
+        # Venmos mentioning the transaction first, then the closest by date
+        ranked = sorted(
+            (v for v in venmos if can_match(main, v)),
+            key=lambda v: (not names_overlap(main, v), abs((v.date - main.date).days)),
+        )
+
+        result = [main]
+        for venmo in ranked:
+            if tokens([*result, venmo]) > max_tokens:
+                break
+            result.append(venmo)
+
+        return result
+
+    batches: list[list[TransactionObject]] = []
+    current: list[TransactionObject] = []
+
+    for main in mains:
+        if tokens(batch([*current, main])) <= max_tokens:
+            current.append(main)
+            continue
+
+        if current:
+            batches.append(batch(current))
+
+        if tokens(batch([main])) <= max_tokens:
+            current = [main]
+        else:
+            batches.append(trimmed(main))
+            current = []
+
+    if current:
+        batches.append(batch(current))
+
+    # Batches without any venmos can never produce a group
+    return [b for b in batches if any(t.id in venmo_ids for t in b)]
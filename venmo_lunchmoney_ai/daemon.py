@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import random
+import time
+from collections.abc import Awaitable, Callable
+from typing import Generic, TypeVar
+from urllib.parse import urlparse
+
+from venmo_lunchmoney_ai.sentry import capture_exception
+
+T = TypeVar("T")
+
+MAX_BACKOFF = 60 * 60
+"""
+The longest we'll wait between runs after repeated failures, in seconds.
+"""
+
+MAX_TRIGGER_DELAY = 5 * 60
+"""
+The longest a triggered run is delayed by a steady stream of triggers, in
+seconds.
+"""
+
+TRIGGER_READ_TIMEOUT = 10
+"""
+Seconds a trigger request may take to be sent before it is dropped
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class CachedLookup(Generic[T]):
+    """
+    Caches the result of a lookup (such as the list of Lunch Money categories)
+    for `ttl` seconds, so long running processes don't re-fetch it every run.
+    """
+
+    def __init__(self, fetch: Callable[[], T], ttl: float):
+        self.fetch = fetch
+        self.ttl = ttl
+        self._value: T | None = None
+        self._fetched_at = 0.0
+
+    def get(self) -> T:
+        if self._value is None or time.monotonic() - self._fetched_at > self.ttl:
+            self._value = self.fetch()
+            self._fetched_at = time.monotonic()
+
+        return self._value
+
+    def invalidate(self):
+        self._value = None
+
+
+class Trigger:
+    """
+    Requests a run sooner than the next interval, such as when a new venmo
+    lands in Lunch Money. A burst of requests (several venmos from one dinner)
+    waits until requests stop arriving for `debounce` seconds and becomes a
+    single run. Requests made while a run is in progress become one more run
+    after it.
+    """
+
+    def __init__(self, debounce: float, max_delay: float = MAX_TRIGGER_DELAY):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._event = asyncio.Event()
+        self._first_at = 0.0
+        self._last_at = 0.0
+
+    def request(self):
+        now = time.monotonic()
+
+        if not self._event.is_set():
+            self._first_at = now
+            self._event.set()
+
+        self._last_at = now
+
+    async def wait(self, timeout: float) -> bool:
+        """
+        Waits up to `timeout` seconds for a run to be requested, then until
+        the burst of requests is over. Returns False when nothing requested a
+        run.
+        """
+        try:
+            async with asyncio.timeout(timeout):
+                await self._event.wait()
+        except TimeoutError:
+            return False
+
+        while True:
+            run_at = min(self._last_at + self.debounce, self._first_at + self.max_delay)
+            if time.monotonic() >= run_at:
+                break
+            await asyncio.sleep(run_at - time.monotonic())
+
+        self._event.clear()
+        return True
+
+
+async def serve_triggers(trigger: Trigger, host: str, port: int) -> asyncio.Server:
+    """
+    Serves a minimal HTTP endpoint where `POST /trigger` requests a run, for
+    tools such as venmo-auto-cashout to call as soon as they create a
+    transaction. The endpoint is unauthenticated, bind it to a private
+    address.
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        status = "400 Bad Request"
+
+        try:
+            async with asyncio.timeout(TRIGGER_READ_TIMEOUT):
+                method, path, _ = (await reader.readline()).decode().split(" ", 2)
+
+                content_length = 0
+                while (line := await reader.readline()).strip():
+                    name, _, value = line.decode().partition(":")
+                    if name.strip().lower() == "content-length":
+                        content_length = int(value)
+
+                # The body is not used, but is read so the client isn't reset
+                await reader.readexactly(content_length)
+
+            if urlparse(path).path != "/trigger":
+                status = "404 Not Found"
+            elif method != "POST":
+                status = "405 Method Not Allowed"
+            else:
+                logger.info("Run requested by trigger")
+                trigger.request()
+                status = "202 Accepted"
+        except (ValueError, TimeoutError, asyncio.IncompleteReadError):
+            pass
+
+        try:
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode()
+            )
+            await writer.drain()
+            writer.close()
+        except ConnectionError:
+            pass
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"Listening for triggers on {host}:{port}")
+
+    return server
+
+
+async def run_daemon(
+    run: Callable[[], Awaitable[None]],
+    interval: float,
+    jitter: float,
+    trigger: Trigger | None = None,
+):
+    """
+    Calls `run` forever, waiting `interval` seconds (plus up to `jitter`
+    random seconds) between each run. When a run fails the wait is doubled
+    for each consecutive failure, up to MAX_BACKOFF.
+
+    When a `trigger` is given a run may be requested before the interval is
+    up, unless the last run failed.
+    """
+    failures = 0
+
+    while True:
+        try:
+            await run()
+            failures = 0
+        except Exception as e:
+            failures += 1
+            logger.error(f"Run failed ({failures} consecutive failures)", exc_info=True)
+            capture_exception(e)
+
+        delay = min(interval * 2**failures, max(interval, MAX_BACKOFF))
+        delay += random.uniform(0, jitter)
+        logger.info(f"Next run in {delay:.0f} seconds")
+
+        if trigger and not failures:
+            await trigger.wait(delay)
+        else:
+            await asyncio.sleep(delay)
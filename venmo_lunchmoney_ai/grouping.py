@@ -1,11 +1,16 @@
-from lunchable import LunchMoney
-from lunchable.models import CategoriesObject, TransactionSplitObject
+import logging
+from collections.abc import Callable
 
+from lunchable.models import CategoriesObject, TransactionObject, TransactionSplitObject
+
+from venmo_lunchmoney_ai.lunchmoney import LunchMoneySession
 from venmo_lunchmoney_ai.types import ReimbursementGroup
 
+logger = logging.getLogger(__name__)
+
 
 def split_transaction(
-    lunch: LunchMoney,
+    lunch: LunchMoneySession,
     reimbursed_category: CategoriesObject,
     group: ReimbursementGroup,
 ):
@@ -36,28 +41,68 @@ def split_transaction(
     )
 
     # Get the transaction objects we just split
-    transactions = [lunch.get_transaction(id) for id in resp["split"]]
+    transactions = lunch.get_split_transactions(group.transaction, resp["split"])
 
     # Get the transaction that we're going to group
     return next(t for t in transactions if t.category_id == reimbursed_category.id)
 
 
+def find_existing_split(
+    lunch: LunchMoneySession,
+    reimbursed_category: CategoriesObject,
+    group: ReimbursementGroup,
+) -> TransactionObject | None:
+    """
+    Finds the reimbursed portion of the main transaction if it was already
+    split by an earlier attempt whose result was never recorded (such as when
+    the request timed out after Lunch Money had processed it).
+    """
+    date = group.transaction.date
+    children = [
+        t
+        for t in lunch.get_transactions(start_date=date, end_date=date)
+        if t.parent_id == group.transaction.id
+    ]
+
+    return next((t for t in children if t.category_id == reimbursed_category.id), None)
+
+
 def create_lunchmoney_group(
-    lunch: LunchMoney,
+    lunch: LunchMoneySession,
     reimbursed_category: CategoriesObject,
     group: ReimbursementGroup,
-):
+    split_id: int | None = None,
+    on_split: Callable[[int], None] | None = None,
+    resume: bool = False,
+) -> int | None:
     """
-    Splits the main transaction and groups the reimbursement transactions
+    Splits the main transaction and groups the reimbursement transactions.
+    Returns the ID of the transaction group, or None when resuming a group
+    which was already created.
+
+    When the main transaction was already split the `split_id` of the
+    reimbursed portion skips splitting it again, otherwise `on_split` is
+    called with it once the split is made. When resuming an earlier attempt,
+    work that attempt may have done without recording it is checked for.
     """
+    if resume and all(lunch.get_transaction(m.id, refresh=True).group_id for m in group.matches):
+        logger.info(f"Group for {group.transaction.payee} was already created")
+        return None
+
     # If I do not owe anything, we can simply group the venmos directly with
     # the main transaction
     if group.you_pay == 0:
         target_transaction = group.transaction
+    elif split_id is not None:
+        target_transaction = lunch.get_transaction(split_id)
     else:
-        target_transaction = split_transaction(lunch, reimbursed_category, group)
+        existing = find_existing_split(lunch, reimbursed_category, group) if resume else None
+        target_transaction = existing or split_transaction(lunch, reimbursed_category, group)
+
+        if on_split:
+            on_split(target_transaction.id)
 
-    lunch.insert_transaction_group(
+    return lunch.insert_transaction_group(
         date=group.transaction.date,
         payee=group.transaction.payee or "Venmo Reimbursement",
         category_id=reimbursed_category.id,
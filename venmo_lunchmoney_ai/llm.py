@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import time
+
+from lunchable.models import CategoriesObject, TransactionObject
+
+from venmo_lunchmoney_ai.backends import Backend
+from venmo_lunchmoney_ai.cache import ResponseCache, prompt_key
+from venmo_lunchmoney_ai.metrics import Metrics
+from venmo_lunchmoney_ai.prompt import build_prompt_messages
+from venmo_lunchmoney_ai.response import SUBMIT_GROUPS_TOOL, ResponseError, parse_groups
+from venmo_lunchmoney_ai.types import ReimbursementGroup
+
+ESCALATE_CONFIDENCE = 0.8
+"""
+When a cheaper tier returns any group less confident than this, the prompt is
+escalated to the next tier
+"""
+
+logger = logging.getLogger(__name__)
+
+
+async def _request_content(
+    backend: Backend,
+    messages: list[dict[str, str]],
+    cache: ResponseCache | None,
+    metrics: Metrics,
+) -> tuple[str, bool]:
+    """
+    Requests the groups JSON from a single tier. When a cache is provided a
+    response for the exact same prompt and model is reused. Returns the
+    content along with whether it came from the cache.
+    """
+    key = prompt_key(backend.model, messages)
+
+    content = cache.get(key) if cache else None
+    metrics.incr(
+        "llm_requests_total",
+        tier=backend.tier,
+        cached=str(content is not None).lower(),
+    )
+
+    if content is not None:
+        return content, True
+
+    start = time.perf_counter()
+
+    with metrics.stage("llm_call") as span:
+        span.set_data("tier", backend.tier)
+        span.set_data("model", backend.model)
+
+        completion = await backend.complete(messages, SUBMIT_GROUPS_TOOL)
+        elapsed = time.perf_counter() - start
+        cost = backend.cost(completion)
+
+        span.set_data("prompt_tokens", completion.prompt_tokens)
+        span.set_data("completion_tokens", completion.completion_tokens)
+        span.set_data("cost", cost)
+
+    metrics.incr("llm_seconds_total", elapsed, tier=backend.tier)
+    metrics.incr("llm_cost_dollars_total", cost, tier=backend.tier)
+    metrics.incr("tokens_total", completion.prompt_tokens, kind="prompt", tier=backend.tier)
+    metrics.incr("tokens_total", completion.completion_tokens, kind="completion", tier=backend.tier)
+
+    logger.info(
+        f"{backend.model} ({backend.tier}) responded in {elapsed:.1f}s using "
+        f"{completion.prompt_tokens + completion.completion_tokens} tokens (${cost:.4f})"
+    )
+
+    return completion.content, False
+
+
+async def request_groups(
+    backends: list[Backend],
+    category: str,
+    categories: list[CategoriesObject],
+    transactions: list[TransactionObject],
+    cache: ResponseCache | None = None,
+    metrics: Metrics | None = None,
+    escalate_confidence: float = ESCALATE_CONFIDENCE,
+) -> list[ReimbursementGroup]:
+    """
+    Ask the model how to group the venmo transactions. The `backends` are
+    tried in order, the prompt is escalated to the next backend when a tier
+    fails, responds without any valid group (unless it explicitly found no
+    groups) or returns a group less confident than `escalate_confidence`. The
+    last tier's answer is always used, and ResponseError is raised when it
+    is invalid.
+    """
+    metrics = metrics or Metrics()
+
+    with metrics.stage("prompt_build"):
+        messages, aliases = build_prompt_messages(category, categories, transactions)
+
+    # Resolve the aliases used in the prompt back to their transactions
+    by_id = {t.id: t for t in transactions}
+    transactions_map = {alias: by_id[id] for alias, id in aliases.items()}
+
+    venmo_category_ids = set(c.id for c in categories if c.name == category)
+    venmo_aliases = set(
+        alias for alias, t in transactions_map.items() if t.category_id in venmo_category_ids
+    )
+
+    groups: list[ReimbursementGroup] = []
+
+    for index, backend in enumerate(backends):
+        is_last = index == len(backends) - 1
+
+        try:
+            content, cached = await _request_content(backend, messages, cache, metrics)
+        except Exception:
+            if is_last:
+                raise
+            logger.warn(f"{backend.tier} model failed, escalating", exc_info=True)
+            metrics.incr("llm_escalations_total", tier=backend.tier, reason="error")
+            continue
+
+        try:
+            with metrics.stage("parse"):
+                groups = parse_groups(content, transactions_map, venmo_aliases)
+        except ResponseError:
+            logger.info("No valid groups in model response", extra={"response": content})
+
+            # Don't keep serving a bad response
+            if cache and cached:
+                cache.delete(prompt_key(backend.model, messages))
+
+            if is_last:
+                raise
+            logger.info(f"{backend.tier} model response was invalid, escalating")
+            metrics.incr("llm_escalations_total", tier=backend.tier, reason="invalid")
+            continue
+
+        # Only responses which parsed are cached, so a bad or truncated
+        # response is asked for again rather than served on every run
+        if cache and not cached:
+            cache.set(prompt_key(backend.model, messages), content)
+
+        # An explicitly empty response is trusted, the model found no groups
+        if is_last or all(g.confidence >= escalate_confidence for g in groups):
+            break
+
+        logger.info(f"{backend.tier} model is not confident, escalating")
+        metrics.incr("llm_escalations_total", tier=backend.tier, reason="confidence")
+
+    return groups
+
+
+async def request_cluster_groups(
+    backends: list[Backend],
+    category: str,
+    categories: list[CategoriesObject],
+    clusters: list[list[TransactionObject]],
+    semaphore: asyncio.Semaphore,
+    cache: ResponseCache | None = None,
+    metrics: Metrics | None = None,
+    escalate_confidence: float = ESCALATE_CONFIDENCE,
+) -> tuple[list[ReimbursementGroup], list[list[TransactionObject]]]:
+    """
+    Prompts the model once per cluster of transactions, with the number of
+    requests in flight limited by the `semaphore`. The groups from every
+    cluster are merged. Returns the groups along with the clusters which
+    failed, which need to be prompted again.
+    """
+    failed: list[list[TransactionObject]] = []
+
+    async def request(cluster: list[TransactionObject]) -> list[ReimbursementGroup]:
+        async with semaphore:
+            logger.info(f"Sending prompt for {len(cluster)} transactions...")
+            try:
+                return await request_groups(
+                    backends,
+                    category,
+                    categories,
+                    cluster,
+                    cache,
+                    metrics,
+                    escalate_confidence,
+                )
+            except Exception:
+                logger.warn("Failed to get model response for cluster", exc_info=True)
+                failed.append(cluster)
+                return []
+
+    results = await asyncio.gather(*(request(cluster) for cluster in clusters))
+
+    return merge_groups([group for groups in results for group in groups]), failed
+
+
+def merge_groups(groups: list[ReimbursementGroup]) -> list[ReimbursementGroup]:
+    """
+    Merges groups produced by separate prompts. Once a transaction is part of
+    a group it cannot be part of any other group, so when groups overlap the
+    most confident one wins.
+    """
+    used_ids: set[int] = set()
+    merged: list[ReimbursementGroup] = []
+
+    for group in sorted(groups, key=lambda g: g.confidence, reverse=True):
+        ids = set(t.id for t in group.transactions)
+
+        if ids & used_ids:
+            logger.info(f"Dropping overlapping group for {group.transaction.payee}")
+            continue
+
+        used_ids |= ids
+        merged.append(group)
+
+    return merged
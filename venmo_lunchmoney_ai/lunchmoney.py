@@ -0,0 +1,151 @@
+import logging
+import random
+import time
+from collections.abc import Callable, Iterator
+from typing import Any, TypeVar
+
+import httpx
+from lunchable import LunchMoney
+from lunchable.exceptions import LunchMoneyHTTPError
+from lunchable.models import TransactionObject
+
+from venmo_lunchmoney_ai.metrics import Metrics
+
+T = TypeVar("T")
+
+PAGE_SIZE = 500
+"""
+How many transactions are requested per page when paging through results
+"""
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+"""
+Responses which indicate a transient failure (rate limiting or an outage)
+that is worth retrying
+"""
+
+MAX_RETRIES = 4
+"""
+How many times a failed request is retried before giving up
+"""
+
+RETRY_DELAY = 1.0
+"""
+Seconds waited before the first retry, doubling for each retry after that
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class LunchMoneySession:
+    """
+    Access layer over the Lunch Money API for a single run. Every transaction
+    fetched is cached for the rest of the run, so looking a transaction up
+    again does not require another round trip.
+    """
+
+    def __init__(self, lunch: LunchMoney, metrics: Metrics | None = None):
+        self.lunch = lunch
+        self.metrics = metrics or Metrics()
+        self.transactions: dict[int, TransactionObject] = {}
+
+    def _request(self, call: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Makes a request, retrying with an exponential backoff when Lunch Money
+        is rate limiting us or having a transient outage. The Retry-After
+        header is respected when present.
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                return call(*args, **kwargs)
+            except (LunchMoneyHTTPError, httpx.TransportError) as e:
+                response = getattr(e.__cause__, "response", None)
+
+                retryable = isinstance(e, httpx.TransportError) or (
+                    response is not None and response.status_code in RETRY_STATUSES
+                )
+                if not retryable or attempt == MAX_RETRIES:
+                    raise
+
+                delay = RETRY_DELAY * 2**attempt + random.uniform(0, RETRY_DELAY)
+                retry_after = response.headers.get("retry-after") if response else None
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+
+                logger.info(f"Lunchmoney request failed ({e!r:.100}), retrying in {delay:.1f}s")
+                self.metrics.incr("api_retries_total", service="lunchmoney")
+                time.sleep(delay)
+
+        raise AssertionError("unreachable")
+
+    def _remember(self, transactions: list[TransactionObject]):
+        self.transactions.update((t.id, t) for t in transactions)
+
+    def get_transactions(self, **kwargs: Any) -> list[TransactionObject]:
+        transactions = self._request(self.lunch.get_transactions, **kwargs)
+        self._remember(transactions)
+
+        return transactions
+
+    def iter_transactions(self, **kwargs: Any) -> Iterator[TransactionObject]:
+        """
+        Pages through the transactions matching the query, yielding them as
+        each page arrives. Only one page is held in memory at a time, so these
+        transactions are not cached.
+        """
+        offset = 0
+
+        while True:
+            page = self._request(
+                self.lunch.get_transactions, offset=offset, limit=PAGE_SIZE, **kwargs
+            )
+            yield from page
+
+            if len(page) < PAGE_SIZE:
+                break
+            offset += PAGE_SIZE
+
+    def get_transaction(self, transaction_id: int, refresh: bool = False) -> TransactionObject:
+        if refresh or transaction_id not in self.transactions:
+            self._remember([self._request(self.lunch.get_transaction, transaction_id)])
+
+        return self.transactions[transaction_id]
+
+    def get_transaction_group(self, group_id: int) -> TransactionObject:
+        return self._request(self.lunch.get_transaction_group, group_id)
+
+    def get_split_transactions(
+        self,
+        parent: TransactionObject,
+        split_ids: list[int],
+    ) -> list[TransactionObject]:
+        """
+        Retrieves the children of a transaction that was just split. Children
+        always share the date of their parent, so they can all be fetched with
+        a single query for that date instead of one request per child.
+        """
+        missing = set(split_ids) - set(self.transactions)
+
+        if missing:
+            self.get_transactions(start_date=parent.date, end_date=parent.date)
+
+        # Fall back to fetching any children the query didn't return
+        for transaction_id in set(split_ids) - set(self.transactions):
+            logger.info(f"Split transaction {transaction_id} not found by date, fetching")
+            self.get_transaction(transaction_id)
+
+        return [self.transactions[id] for id in split_ids]
+
+    def update_transaction(self, transaction_id: int, **kwargs: Any) -> dict[str, Any]:
+        # The transaction is about to change, don't keep serving the old copy
+        self.transactions.pop(transaction_id, None)
+
+        return self._request(self.lunch.update_transaction, transaction_id=transaction_id, **kwargs)
+
+    def insert_transaction_group(self, transactions: list[int], **kwargs: Any) -> int:
+        for transaction_id in transactions:
+            self.transactions.pop(transaction_id, None)
+
+        return self._request(
+            self.lunch.insert_transaction_group, transactions=transactions, **kwargs
+        )
@@ -0,0 +1,434 @@
+import itertools
+import re
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from math import prod
+from typing import TYPE_CHECKING
+
+from lunchable.models import TransactionObject
+
+from venmo_lunchmoney_ai.amounts import (
+    feasible_combinations,
+    is_even_split,
+    is_exact_cover,
+    subsets_summing_to,
+    to_cents,
+)
+from venmo_lunchmoney_ai.types import ReimbursementGroup
+
+if TYPE_CHECKING:
+    from venmo_lunchmoney_ai.aliases import AliasIndex
+
+WAITING_ON_MATCH = r"waiting\s+(?:on|for)\s+(?P<names>[^[\]]+)"
+"""
+Regex used to extract the list of people we're waiting on from the main
+transaction note. For a note like
+
+> Waiting on Ran and Eric [Dumpligs during Erics Trip]
+
+This will extract "Ran and Eric"
+"""
+
+WAITING_COUNT_MATCH = r"waiting\s+(?:on|for)\s+(?P<count>\d+)\s+(?:people|persons|friends|others)"
+"""
+Regex used to extract how many people we're waiting on from a note that only
+gives a count, such as
+
+> Waiting on 3 people [Tahoe house]
+"""
+
+NAME_SPLIT = r"\s*(?:,|&|\band\b|\+)\s*"
+"""
+Separators used between names in the "waiting on" portion of a note
+"""
+
+MIN_CONFIDENCE = 0.85
+"""
+Groups scored at or above this are committed locally without asking GPT-4.
+Everything below is left for the model to decide.
+"""
+
+MAX_DAYS_AFTER = 30
+"""
+Venmos arriving more than this many days after the main transaction are not
+considered by the local matcher.
+"""
+
+MAX_COMBINATIONS = 256
+"""
+Upper bound of venmo combinations we'll try for a single main transaction
+before giving up and leaving it to GPT-4.
+"""
+
+NAME_THRESHOLD = 0.8
+"""
+Minimum similarity between an expected name and a venmo sender (or note) for
+the venmo to be considered from that person.
+"""
+
+
+@dataclass
+class _Candidate:
+    venmo: TransactionObject
+    name_score: float
+    merchant_score: float
+    date_score: float
+
+
+def _tokens(value: str | None) -> list[str]:
+    return re.findall(r"[a-z0-9]+", (value or "").lower())
+
+
+def _token_similarity(a: str, b: str) -> float:
+    """
+    Similarity of two single tokens. Nicknames are commonly a prefix of the
+    full name ("Ran" for "Randolf") so those are treated as a strong match.
+    """
+    if a == b:
+        return 1.0
+    if len(a) >= 3 and len(b) >= 3 and (a.startswith(b) or b.startswith(a)):
+        return 0.9
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def similarity(needle: str | None, haystack: str | None) -> float:
+    """
+    Fuzzy score between 0 and 1 of how well `needle` appears somewhere within
+    `haystack`. Each token of the needle is matched against its best token in
+    the haystack.
+    """
+    needle_tokens = _tokens(needle)
+    haystack_tokens = _tokens(haystack)
+
+    if not needle_tokens or not haystack_tokens:
+        return 0.0
+
+    scores = [max(_token_similarity(n, h) for h in haystack_tokens) for n in needle_tokens]
+    return sum(scores) / len(scores)
+
+
+def expected_names(note: str | None) -> list[str]:
+    """
+    Extract the names of the people a main transaction is waiting on from its
+    note. Returns an empty list when no names could be found.
+    """
+    match = re.search(WAITING_ON_MATCH, note or "", re.IGNORECASE)
+    if not match:
+        return []
+
+    names = re.split(NAME_SPLIT, match.group("names").strip(), flags=re.IGNORECASE)
+
+    # Counts ("waiting on 2 people") are not names, leave those to GPT-4
+    return [n for n in names if n and not any(c.isdigit() for c in n)]
+
+
+def waiting_count(note: str | None) -> int | None:
+    """
+    How many people a main transaction is waiting on, either from a count in
+    the note or the number of names. Returns None when the note doesn't say.
+    """
+    match = re.search(WAITING_COUNT_MATCH, note or "", re.IGNORECASE)
+    if match:
+        return int(match.group("count"))
+
+    return len(expected_names(note)) or None
+
+
+def name_score(
+    name: str,
+    venmo: TransactionObject,
+    aliases: "AliasIndex | None" = None,
+) -> float:
+    """
+    How likely the venmo is from the person named. The sender may be the venmo
+    payee, or when the payee is generic (Venmo Received) may only be mentioned
+    in the note. A nickname confirmed by an earlier group is a certain match.
+    """
+    if aliases and aliases.is_nickname(name, venmo.payee):
+        return 1.0
+
+    return max(
+        similarity(name, (venmo.payee or "").split(" ")[0]),
+        similarity(name, venmo.notes),
+    )
+
+
+def merchant_score(
+    main: TransactionObject,
+    venmo: TransactionObject,
+    aliases: "AliasIndex | None" = None,
+) -> float:
+    """
+    How well the venmo note describes the main transaction payee. A word
+    confirmed by earlier groups to mean the payee is a certain match.
+    """
+    if aliases and aliases.mentions_merchant(main.payee, venmo.notes):
+        return 1.0
+
+    return similarity(main.payee, venmo.notes)
+
+
+def _date_score(main: TransactionObject, venmo: TransactionObject) -> float:
+    days = (venmo.date - main.date).days
+
+    # Venmos may land a day before the main transaction posts
+    if days < -1 or days > MAX_DAYS_AFTER:
+        return 0.0
+
+    return 1.0 - max(days, 0) / (MAX_DAYS_AFTER * 2)
+
+
+def _is_feasible(main: TransactionObject, venmos: list[TransactionObject]) -> bool:
+    """
+    Checks that the venmos either each pay an even share of the main
+    transaction, or together exactly cover it.
+    """
+    total = to_cents(main.amount)
+    amounts = [to_cents(abs(v.amount)) for v in venmos]
+
+    return is_even_split(total, amounts) or is_exact_cover(total, amounts)
+
+
+def _is_even_share(total: int, amount: int, people: int) -> bool:
+    """
+    Checks that the amount (in cents) is an even share of the total for the
+    number of people we're waiting on, whether or not I had a share too.
+    """
+    return is_even_split(total, [amount] * people)
+
+
+def _candidates(
+    main: TransactionObject,
+    name: str,
+    venmos: list[TransactionObject],
+    aliases: "AliasIndex | None",
+) -> list[_Candidate]:
+    candidates = []
+
+    for venmo in venmos:
+        date_score = _date_score(main, venmo)
+        if date_score == 0:
+            continue
+
+        score = name_score(name, venmo, aliases)
+        if score < NAME_THRESHOLD:
+            continue
+
+        candidates.append(
+            _Candidate(venmo, score, merchant_score(main, venmo, aliases), date_score)
+        )
+
+    return candidates
+
+
+def _match_main(
+    main: TransactionObject,
+    venmos: list[TransactionObject],
+    aliases: "AliasIndex | None",
+) -> ReimbursementGroup | None:
+    names = expected_names(main.notes)
+    if not names:
+        return _match_count(main, venmos, aliases)
+
+    candidates = [_candidates(main, name, venmos, aliases) for name in names]
+
+    # Not everyone has paid yet
+    if not all(candidates):
+        return None
+
+    if prod(len(c) for c in candidates) > MAX_COMBINATIONS:
+        return None
+
+    # Find every combination of one venmo per person that evenly splits (or
+    # exactly covers) the main transaction. Anything ambiguous is better left
+    # to GPT-4.
+    feasible = [
+        combination
+        for combination in itertools.product(*candidates)
+        if len(set(c.venmo.id for c in combination)) == len(combination)
+        and _is_feasible(main, [c.venmo for c in combination])
+    ]
+
+    if len(feasible) != 1:
+        return None
+
+    chosen = feasible[0]
+    matches = [c.venmo for c in chosen]
+
+    name = min(c.name_score for c in chosen)
+    merchant = min(c.merchant_score for c in chosen)
+    date_score = min(c.date_score for c in chosen)
+
+    # An even split from every expected person is already strong evidence, a
+    # note mentioning the merchant and a prompt payment only add to it.
+    confidence = 0.6 + 0.2 * name + 0.1 * merchant + 0.1 * date_score
+
+    return ReimbursementGroup(
+        transaction=main,
+        matches=matches,
+        missing_reimbursements=False,
+        confidence=round(confidence, 2),
+        confidence_reason=(
+            "Matched locally: amount evenly divides and a venmo was found from "
+            f"each of {', '.join(names)}"
+        ),
+    )
+
+
+def _match_count(
+    main: TransactionObject,
+    venmos: list[TransactionObject],
+    aliases: "AliasIndex | None",
+) -> ReimbursementGroup | None:
+    """
+    Matches a main transaction whose note only says how many people we're
+    waiting on. Without names the amounts have to do the work, so a group is
+    only produced when exactly one combination of that many venmos is
+    consistent with the amount.
+    """
+    people = waiting_count(main.notes)
+    if people is None:
+        return None
+
+    nearby = [v for v in venmos if _date_score(main, v) > 0]
+    feasible = feasible_combinations(main, nearby, people)
+
+    if len(feasible) != 1:
+        return None
+
+    matches = feasible[0]
+
+    merchant = min(merchant_score(main, v, aliases) for v in matches)
+    date_score = min(_date_score(main, v) for v in matches)
+
+    # Amounts alone can coincide, the venmos must also mention the merchant
+    confidence = 0.4 + 0.4 * merchant + 0.2 * date_score
+
+    return ReimbursementGroup(
+        transaction=main,
+        matches=matches,
+        missing_reimbursements=False,
+        confidence=round(confidence, 2),
+        confidence_reason=(
+            f"Matched locally: the only combination of {people} venmos consistent with the amount"
+        ),
+    )
+
+
+def _could_reimburse(
+    main: TransactionObject,
+    venmo: TransactionObject,
+    named_venmos: list[TransactionObject],
+    aliases: "AliasIndex | None",
+) -> bool:
+    """
+    Checks if the venmo is a plausible reimbursement of the main transaction,
+    going by the same name, amount and date evidence used to match it. The
+    venmo must be from one of the people named, and either an even share of
+    the amount or part of a combination of `named_venmos` (the venmos from
+    anyone named) which covers it. When
+    the note only gives a count of people, the venmo must be an even share.
+    Any number of venmos could coincidentally cover an amount, so without
+    names that alone is not enough.
+    """
+    if _date_score(main, venmo) == 0:
+        return False
+
+    total = to_cents(main.amount)
+    amount = to_cents(abs(venmo.amount))
+
+    names = expected_names(main.notes)
+    if not names:
+        people = waiting_count(main.notes)
+        return people is not None and _is_even_share(total, amount, people)
+
+    if all(name_score(name, venmo, aliases) < NAME_THRESHOLD for name in names):
+        return False
+
+    if _is_even_share(total, amount, len(names)):
+        return True
+
+    # Could the venmo be one of several uneven shares which exactly cover it
+    amounts = [to_cents(abs(v.amount)) for v in named_venmos if v.id != venmo.id]
+
+    return len(names) > 1 and bool(
+        subsets_summing_to(amounts, total - amount, 0, size=len(names) - 1)
+    )
+
+
+def match_locally(
+    main_transactions: list[TransactionObject],
+    venmos: list[TransactionObject],
+    shortlists: dict[int, list[int]] | None = None,
+    aliases: "AliasIndex | None" = None,
+) -> tuple[list[ReimbursementGroup], list[TransactionObject], list[TransactionObject]]:
+    """
+    Deterministically matches obvious reimbursement groups without asking
+    GPT-4. A group is only produced when the main transaction note names who
+    we're waiting on, exactly one venmo from each of those people is found,
+    and the venmos evenly split (or exactly cover) the main transaction. When
+    the note only gives a count of people, the group is produced when exactly
+    one combination of that many venmos fits the amount. A group is never
+    produced when one of its venmos could also reimburse another pending
+    transaction, since a wrong local match is written without any review.
+
+    When `shortlists` are given, a main transaction is only matched against
+    the venmos it was shortlisted for. Nicknames and merchant words confirmed
+    by earlier groups are looked up in `aliases`.
+
+    Returns the confidently matched groups, along with the main transactions
+    and venmos that still need to be matched.
+    """
+    groups: list[ReimbursementGroup] = []
+    remaining_venmos = list(venmos)
+
+    shortlisted: dict[int, set[int]] = {}
+    for venmo_id, main_ids in (shortlists or {}).items():
+        for main_id in main_ids:
+            shortlisted.setdefault(main_id, set()).add(venmo_id)
+
+    def candidates_of(main: TransactionObject) -> list[TransactionObject]:
+        if shortlists is None:
+            return remaining_venmos
+        return [v for v in remaining_venmos if v.id in shortlisted.get(main.id, ())]
+
+    matched_main_ids: set[int] = set()
+    named: dict[int, set[int]] = {}
+
+    def named_venmos(main: TransactionObject) -> list[TransactionObject]:
+        if main.id not in named:
+            named[main.id] = set(
+                c.venmo.id
+                for name in expected_names(main.notes)
+                for c in _candidates(main, name, candidates_of(main), aliases)
+            )
+        return [v for v in remaining_venmos if v.id in named[main.id]]
+
+    # Match the oldest transactions first since their venmos are the most
+    # likely to have already arrived.
+    for main in sorted(main_transactions, key=lambda t: t.date):
+        group = _match_main(main, candidates_of(main), aliases)
+
+        if group is None or group.confidence < MIN_CONFIDENCE:
+            continue
+
+        # A venmo that fits another pending transaction just as well is
+        # ambiguous, leave it to GPT-4 to weigh the notes
+        others = [t for t in main_transactions if t.id != main.id and t.id not in matched_main_ids]
+        contested = any(
+            _could_reimburse(other, venmo, named_venmos(other), aliases)
+            for other in others
+            for venmo in group.matches
+            if shortlists is None or venmo.id in shortlisted.get(other.id, ())
+        )
+        if contested:
+            continue
+
+        groups.append(group)
+        matched_main_ids.add(main.id)
+        matched_ids = set(m.id for m in group.matches)
+        remaining_venmos = [v for v in remaining_venmos if v.id not in matched_ids]
+
+    remaining_mains = [t for t in main_transactions if t.id not in matched_main_ids]
+
+    return groups, remaining_mains, remaining_venmos
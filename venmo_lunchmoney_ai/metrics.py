@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import Counter
+from collections.abc import Awaitable, Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING
+
+import httpx
+
+from venmo_lunchmoney_ai.sentry import NoSpan, start_span, start_transaction
+
+if TYPE_CHECKING:
+    from sentry_sdk.tracing import Span
+
+PREFIX = "venmo_lunchmoney_ai"
+"""
+Prefix of every metric name in the Prometheus output
+"""
+
+logger = logging.getLogger(__name__)
+
+_Key = tuple[str, tuple[tuple[str, str], ...]]
+
+_run_labels: ContextVar[dict[str, str]] = ContextVar("run_labels", default={})
+"""
+Labels of the run in progress (such as the account), added to every metric
+recorded while it runs. Concurrent runs each have their own context, which is
+inherited by their tasks and threads, so clients shared between accounts still
+record against the right account.
+"""
+
+
+def _key(name: str, labels: dict[str, str]) -> _Key:
+    return name, tuple(sorted({**_run_labels.get(), **labels}.items()))
+
+
+class Metrics:
+    """
+    Collects timings of each stage of a run, along with counters such as API
+    calls, retries, bytes transferred and GPT-4 token usage.
+
+    Values accumulate over the life of the process, so in daemon mode the
+    metrics file behaves like any other Prometheus counter. Each stage is also
+    reported as a Sentry span, and the counters of each run are attached to
+    the run's Sentry transaction. Everything recorded during a run carries the
+    run's labels.
+    """
+
+    def __init__(self):
+        self.counters: Counter[_Key] = Counter()
+        self.gauges: dict[_Key, float] = {}
+
+    def incr(self, name: str, value: float = 1, **labels: str):
+        self.counters[_key(name, labels)] += value
+
+    def set(self, name: str, value: float, **labels: str):
+        self.gauges[_key(name, labels)] = value
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator["Span | NoSpan"]:
+        """
+        Times a stage of the run. Stages may run concurrently (such as each
+        GPT-4 request), in which case their total time is recorded.
+        """
+        start = time.perf_counter()
+
+        with start_span(op=name) as span:
+            try:
+                yield span
+            finally:
+                self.incr("stage_seconds_sum", time.perf_counter() - start, stage=name)
+                self.incr("stage_seconds_count", stage=name)
+
+    @contextmanager
+    def run(self, name: str, **labels: str) -> Iterator[None]:
+        """
+        Wraps a complete run in a Sentry transaction. Everything recorded
+        during the run is labeled with `labels`, and the counters the run
+        incremented are attached to the transaction when it finishes. Runs of
+        other accounts happening at the same time are not included.
+        """
+        token = _run_labels.set({**_run_labels.get(), **labels})
+        run_labels = set(_run_labels.get().items())
+
+        before = self.counters.copy()
+        start = time.perf_counter()
+        success = False
+
+        try:
+            with start_transaction(op="run", name=name) as transaction:
+                try:
+                    yield
+                    success = True
+                finally:
+                    self.set("last_run_seconds", time.perf_counter() - start)
+                    self.set("last_run_timestamp_seconds", time.time())
+                    self.set("last_run_success", int(success))
+
+                    for (metric, metric_labels), value in (self.counters - before).items():
+                        if not run_labels <= set(metric_labels):
+                            continue
+
+                        suffix = "".join(
+                            f".{v}" for k, v in metric_labels if (k, v) not in run_labels
+                        )
+                        transaction.set_data(f"{metric}{suffix}", value)
+        finally:
+            _run_labels.reset(token)
+
+    def record_response(self, service: str, response: httpx.Response):
+        """
+        Records an API call. The OpenAI client retries failed requests itself
+        and marks each retry with a header, those are counted separately.
+        """
+        request = response.request
+
+        self.incr("api_calls_total", service=service)
+
+        if response.is_error:
+            self.incr("api_errors_total", service=service)
+
+        if int(request.headers.get("x-stainless-retry-count") or 0):
+            self.incr("api_retries_total", service=service)
+
+        try:
+            self.incr("bytes_sent_total", len(request.content), service=service)
+        except httpx.RequestNotRead:
+            pass
+
+        # The response body has not been read yet, rely on the reported size
+        received = int(response.headers.get("content-length") or 0)
+        self.incr("bytes_received_total", received, service=service)
+
+    def response_hook(self, service: str) -> Callable[[httpx.Response], None]:
+        """
+        httpx.Client event hook recording each API call to `service`
+        """
+        return lambda response: self.record_response(service, response)
+
+    def async_response_hook(self, service: str) -> Callable[[httpx.Response], Awaitable[None]]:
+        """
+        httpx.AsyncClient event hook recording each API call to `service`
+        """
+
+        async def hook(response: httpx.Response):
+            self.record_response(service, response)
+
+        return hook
+
+    def to_json(self) -> str:
+        def entries(values: dict[_Key, float]):
+            return [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(values.items())
+            ]
+
+        return json.dumps(
+            {"counters": entries(self.counters), "gauges": entries(self.gauges)},
+            indent=2,
+        )
+
+    def to_prometheus(self) -> str:
+        lines: list[str] = []
+        declared: set[str] = set()
+
+        for metric_type, values in (("counter", self.counters), ("gauge", self.gauges)):
+            for (name, labels), value in sorted(values.items()):
+                # The stage timings together form a summary
+                family = name.removesuffix("_sum").removesuffix("_count")
+
+                if family not in declared:
+                    family_type = "summary" if family == "stage_seconds" else metric_type
+                    lines.append(f"# TYPE {PREFIX}_{family} {family_type}")
+                    declared.add(family)
+
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                label_text = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{PREFIX}_{name}{label_text} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """
+        Atomically writes the metrics to `path`. Files ending in `.json` are
+        written as JSON, anything else in the Prometheus text format (for use
+        with the node_exporter textfile collector).
+        """
+        content = self.to_json() if path.endswith(".json") else self.to_prometheus()
+        directory = os.path.dirname(os.path.abspath(path))
+
+        # Write to a temporary file first so a collector never reads a
+        # partially written file
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+        logger.info(f"Wrote metrics to {path}")
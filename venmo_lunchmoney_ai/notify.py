@@ -1,26 +1,36 @@
-import asyncio
-
-from telegram import Bot
-from telegram.constants import ParseMode
-from telegram.helpers import escape_markdown
+from typing import TYPE_CHECKING
 
 from venmo_lunchmoney_ai.types import ReimbursementGroup
 
+if TYPE_CHECKING:
+    from telegram import Bot
 
-def notify_telegram(
-    group: ReimbursementGroup,
-    token: str,
-    channel_id: str,
-):
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(notify_telegram_async(group, token, channel_id))
 
+async def create_bot(token: str, base_url: str = "https://api.telegram.org/bot") -> "Bot":
+    """
+    Creates the bot notifications are sent with. telegram is slow to import
+    and most runs never send a notification, so it is only imported once a
+    bot is needed.
+
+    The bot is initialized, without that `shutdown` does nothing and the
+    bot's HTTP client is never closed.
+    """
+    from telegram import Bot
 
-async def notify_telegram_async(
+    bot = Bot(token, base_url=base_url)
+    await bot.initialize()
+
+    return bot
+
+
+async def notify_telegram(
+    bot: "Bot",
     group: ReimbursementGroup,
-    token: str,
     channel_id: str,
 ):
+    from telegram.constants import ParseMode
+    from telegram.helpers import escape_markdown
+
     def e(value: str):
         return escape_markdown(value, version=2)
 
@@ -41,7 +51,7 @@ async def notify_telegram_async(
 
     text = "\n".join(lines)
 
-    await Bot(token).send_message(
+    await bot.send_message(
         chat_id=channel_id,
         text=text,
         parse_mode=ParseMode.MARKDOWN_V2,
@@ -1,5 +1,9 @@
 import csv
+import functools
 import io
+import logging
+import math
+import re
 
 from lunchable.models import CategoriesObject, TransactionObject
 
@@ -17,9 +21,9 @@ something. Example:
 
 ```csv
 transaction_id,category,payee,amount,notes,original_name
-242330919,{category},Eric,6,"Thanks for Boba Guys",Venmo
-242330918,Snack,"Boba Guys",-12,"Waiting on Eric",BOBAGUYS
-242330917,Gas,"BP Gas",-24,"Waiting on Ryan",BP
+1,{category},Eric,6,"Thanks for Boba Guys",Venmo
+2,Snack,"Boba Guys",-12,"Waiting on Eric",BOBAGUYS
+3,Gas,"BP Gas",-24,"Waiting on Ryan",BP
 ```
 
 In the example, I paid for "Boba Guys". Eric then reimbursed me $6 for his
@@ -48,8 +52,8 @@ Your output for this example is as follows.
 ```json
 [
   {{
-    "transaction_id": 242330918,
-    "matches": [242330919],
+    "transaction_id": 2,
+    "matches": [1],
     "missing_reimbursements": false,
     "confidence": 0.9,
     "confidence_reason": "Amount evently divides and exact payee name is in the note"
@@ -85,6 +89,73 @@ output the valid JSON based on the data provided.
 """
 
 
+TOKEN_PATTERN = re.compile(
+    r"'s|'t|'re|'ve|'m|'ll|'d| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|\s+(?!\S)|\s+"
+)
+"""
+Approximation of the GPT-4 tokenizer pre-tokenization pattern. Every piece it
+splits the text into is at least one token.
+"""
+
+ESTIMATE_CHARS_PER_TOKEN = 3
+"""
+Characters per token assumed when estimating without tiktoken. GPT-4 averages
+closer to 4 on English, and 3 on the digit groups of amounts, so this
+overestimates rather than letting a prompt overflow the budget.
+"""
+
+ESTIMATE_HEADROOM = 1.1
+"""
+Extra margin applied to estimated token counts
+"""
+
+logger = logging.getLogger(__name__)
+
+
+@functools.cache
+def _get_encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        logger.info("tiktoken unavailable, estimating prompt token counts")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts the GPT-4 tokens in the text. Uses tiktoken when it is installed,
+    otherwise makes a deliberately high estimate, so the prompt token budget
+    is never exceeded.
+    """
+    encoding = _get_encoding()
+
+    if encoding is not None:
+        return len(encoding.encode(text))
+
+    estimate = max(
+        len(TOKEN_PATTERN.findall(text)),
+        math.ceil(len(text) / ESTIMATE_CHARS_PER_TOKEN),
+    )
+
+    return math.ceil(estimate * ESTIMATE_HEADROOM)
+
+
+def _original_name(transaction: TransactionObject) -> str:
+    """
+    The original name is only useful to GPT-4 when it tells us something the
+    payee does not.
+    """
+    original_name = transaction.original_name or ""
+    payee = transaction.payee or ""
+
+    if original_name.lower().replace(" ", "") in payee.lower().replace(" ", ""):
+        return ""
+
+    return original_name
+
+
 def table_to_csv_string(table):
     output = io.StringIO()
     fieldnames = table[0].keys() if table else []
@@ -102,28 +173,91 @@ def table_to_csv_string(table):
     return output.getvalue()
 
 
-def build_prompt_messages(
-    category: str,
+def build_prompt_table(
     categories: list[CategoriesObject],
     transaction_list: list[TransactionObject],
-):
+) -> list[dict]:
+    """
+    Builds the rows of the transaction CSV. Transaction IDs are replaced with
+    short aliases (the row number) to reduce the size of the prompt.
+    """
     category_map = {c.id: c.name for c in categories}
+
     table = [
         {
-            "transaction_id": t.id,
+            "transaction_id": alias,
             "category": category_map.get(t.category_id or 0, None),
             "payee": t.payee,
             "amount": t.amount,
             "notes": t.notes,
-            "original_name": t.original_name,
+            "original_name": _original_name(t),
         }
-        for t in transaction_list
+        for alias, t in enumerate(transaction_list, start=1)
     ]
 
+    # Drop the original names entirely if none of them are useful
+    if not any(row["original_name"] for row in table):
+        for row in table:
+            del row["original_name"]
+
+    return table
+
+
+def build_prompt_messages(
+    category: str,
+    categories: list[CategoriesObject],
+    transaction_list: list[TransactionObject],
+) -> tuple[list[dict[str, str]], dict[int, int]]:
+    """
+    Builds the prompt for GPT-4. Along with the messages, the mapping of
+    aliases used in the prompt to transaction IDs is returned, this is used to
+    resolve the aliases in the response.
+    """
+    aliases = {alias: t.id for alias, t in enumerate(transaction_list, start=1)}
+
     system_prompt = PROMPT.format(category=category)
-    csv_table = table_to_csv_string(table)
+    csv_table = table_to_csv_string(build_prompt_table(categories, transaction_list))
 
-    return [
+    messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": csv_table},
     ]
+
+    return messages, aliases
+
+
+def count_prompt_tokens(messages: list[dict[str, str]]) -> int:
+    """
+    Counts the tokens of a prompt, including the few tokens of overhead each
+    chat message carries.
+    """
+    return sum(count_tokens(m["content"]) + 4 for m in messages)
+
+
+def prompt_token_costs(
+    category: str,
+    categories: list[CategoriesObject],
+    transaction_list: list[TransactionObject],
+) -> tuple[int, dict[int, int]]:
+    """
+    Computes the tokens used by a prompt with no transactions (the system
+    prompt and CSV header), along with the tokens each transaction's row adds.
+    Used to estimate the size of a prompt for any subset of the transactions
+    without building it.
+    """
+    table = build_prompt_table(categories, transaction_list)
+
+    header = table_to_csv_string(table[:1]).splitlines(keepends=True)[0]
+    base = count_prompt_tokens(
+        [
+            {"role": "system", "content": PROMPT.format(category=category)},
+            {"role": "user", "content": header},
+        ]
+    )
+
+    costs = {
+        transaction.id: count_tokens(table_to_csv_string([row])) - count_tokens(header)
+        for transaction, row in zip(transaction_list, table)
+    }
+
+    return base, costs
@@ -0,0 +1,219 @@
+import json
+import logging
+import re
+from decimal import Decimal
+
+from lunchable.models import TransactionObject
+
+from venmo_lunchmoney_ai.types import ReimbursementGroup
+
+GROUP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "transaction_id": {"type": "integer"},
+        "matches": {"type": "array", "items": {"type": "integer"}},
+        "missing_reimbursements": {"type": "boolean"},
+        "confidence": {"type": "number"},
+        "confidence_reason": {"type": "string"},
+    },
+    "required": [
+        "transaction_id",
+        "matches",
+        "missing_reimbursements",
+        "confidence",
+        "confidence_reason",
+    ],
+}
+
+SUBMIT_GROUPS_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "submit_groups",
+        "description": "Submit the groups of matched transactions",
+        "parameters": {
+            "type": "object",
+            "properties": {"groups": {"type": "array", "items": GROUP_SCHEMA}},
+            "required": ["groups"],
+        },
+    },
+}
+"""
+Function GPT-4 is asked to call with its groups, so the response is always
+machine readable JSON instead of free form text.
+"""
+
+FENCE_MATCH = r"```(?:json)?\s*(?P<body>.*?)(?:```|$)"
+"""
+Regex used to extract the body of a markdown code fence, which GPT-4 sometimes
+wraps JSON in. The closing fence may be missing if the response was cut off.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseError(Exception):
+    """
+    The response holds no valid groups, and is not a response explicitly
+    stating there are no groups
+    """
+
+
+def iter_json_items(text: str):
+    """
+    Tolerantly extracts the group objects from a response. The response may
+    be wrapped in a markdown fence, surrounded by prose, be an object with a
+    `groups` key or a bare list, and may be truncated. Each complete object is
+    yielded as it is decoded, so a partial response still yields every group
+    that was fully written.
+    """
+    fence = re.search(FENCE_MATCH, text, re.DOTALL)
+    if fence:
+        text = fence.group("body")
+
+    decoder = json.JSONDecoder()
+
+    start = min((i for i in (text.find("["), text.find("{")) if i != -1), default=-1)
+    if start == -1:
+        return
+
+    # An object is either a single group, or wraps the list of groups
+    if text[start] == "{":
+        try:
+            value, _ = decoder.raw_decode(text, start)
+        except json.JSONDecodeError:
+            value = None
+
+        if isinstance(value, dict) and "groups" not in value:
+            yield value
+            return
+
+        start = text.find("[", start)
+        if start == -1:
+            return
+
+    index = start + 1
+
+    while True:
+        while index < len(text) and text[index] in " \t\r\n,":
+            index += 1
+
+        if index >= len(text) or text[index] == "]":
+            return
+
+        try:
+            value, index = decoder.raw_decode(text, index)
+        except json.JSONDecodeError:
+            logger.info("Response JSON was incomplete, keeping the complete groups")
+            return
+
+        if isinstance(value, dict):
+            yield value
+
+
+def is_empty_response(text: str) -> bool:
+    """
+    Checks if the response explicitly states there are no groups, either as an
+    empty `groups` list or an empty bare list.
+    """
+    fence = re.search(FENCE_MATCH, text, re.DOTALL)
+    if fence:
+        text = fence.group("body")
+
+    try:
+        value = json.loads(text)
+    except json.JSONDecodeError:
+        return False
+
+    if isinstance(value, dict):
+        value = value.get("groups")
+
+    return value == []
+
+
+def _validation_error(
+    data: dict,
+    transactions_map: dict[int, TransactionObject],
+    venmo_ids: set[int],
+    used_ids: set[int],
+) -> str | None:
+    for key, schema in GROUP_SCHEMA["properties"].items():
+        if key not in data:
+            return f"missing {key}"
+
+        value = data[key]
+        valid = {
+            "integer": isinstance(value, int) and not isinstance(value, bool),
+            "number": isinstance(value, (int, float)) and not isinstance(value, bool),
+            "boolean": isinstance(value, bool),
+            "string": isinstance(value, str),
+            "array": isinstance(value, list) and all(isinstance(v, int) for v in value),
+        }[schema["type"]]
+
+        if not valid:
+            return f"{key} is not a valid {schema['type']}"
+
+    main_id = data["transaction_id"]
+    match_ids = data["matches"]
+
+    if main_id not in transactions_map or main_id in venmo_ids:
+        return f"{main_id} is not a main transaction"
+    if not match_ids:
+        return "no matches"
+    if any(id not in transactions_map or id not in venmo_ids for id in match_ids):
+        return "matches include transactions that are not venmos"
+    if len(set(match_ids)) != len(match_ids):
+        return "matches include the same venmo twice"
+    if used_ids & set([main_id, *match_ids]):
+        return "transactions already used by another group"
+
+    main_amount = Decimal(str(transactions_map[main_id].amount))
+    they_pay = sum(Decimal(str(abs(transactions_map[id].amount))) for id in match_ids)
+
+    if they_pay > main_amount:
+        return "venmos reimburse more than the transaction amount"
+
+    return None
+
+
+def parse_groups(
+    content: str,
+    transactions_map: dict[int, TransactionObject],
+    venmo_ids: set[int],
+) -> list[ReimbursementGroup]:
+    """
+    Parses the groups out of a GPT-4 response, validating each one. Invalid
+    groups are dropped while the valid groups are kept. Raises ResponseError
+    when no valid group is left, unless the response explicitly has no groups.
+
+    The `transactions_map` maps the IDs used in the response to transactions,
+    `venmo_ids` are the IDs (as used in the response) of the venmos.
+    """
+    groups: list[ReimbursementGroup] = []
+    used_ids: set[int] = set()
+    items = 0
+
+    for data in iter_json_items(content):
+        items += 1
+        error = _validation_error(data, transactions_map, venmo_ids, used_ids)
+
+        if error is not None:
+            logger.warn(
+                f"Dropping invalid group from GPT-4 response: {error}", extra={"group": data}
+            )
+            continue
+
+        used_ids |= set([data["transaction_id"], *data["matches"]])
+        groups.append(
+            ReimbursementGroup(
+                transaction=transactions_map[data["transaction_id"]],
+                matches=[transactions_map[id] for id in data["matches"]],
+                missing_reimbursements=data["missing_reimbursements"],
+                confidence=data["confidence"],
+                confidence_reason=data["confidence_reason"],
+            )
+        )
+
+    if not groups and (items or not is_empty_response(content)):
+        raise ResponseError(f"No valid groups in response ({items} invalid)")
+
+    return groups
@@ -0,0 +1,129 @@
+import bisect
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+from lunchable.models import TransactionObject
+
+from venmo_lunchmoney_ai.amounts import is_even_share, to_cents
+from venmo_lunchmoney_ai.clusters import EARLY_VENMO_DAYS, can_match
+
+NGRAM_SIZE = 3
+"""
+Length of the character n-grams transactions are compared by. Short enough
+that nicknames ("Ran") and typos still share n-grams with the full word.
+"""
+
+TOP_K = 8
+"""
+How many main transactions are suggested to shortlist for each venmo
+"""
+
+Vector = dict[str, float]
+
+
+def ngrams(text: str) -> Counter[str]:
+    """
+    Counts the character n-grams of each word in the text. Words are padded
+    with spaces so n-grams at the start and end of a word are distinct.
+    """
+    grams: Counter[str] = Counter()
+
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        padded = f" {word} "
+        grams.update(padded[i : i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1))
+
+    return grams
+
+
+def _main_text(transaction: TransactionObject) -> str:
+    return " ".join(filter(None, [transaction.payee, transaction.notes, transaction.original_name]))
+
+
+def _venmo_text(transaction: TransactionObject) -> str:
+    # The payee of a venmo is the friend who sent it
+    return " ".join(filter(None, [transaction.payee, transaction.notes]))
+
+
+def vectorize(documents: list[Counter[str]]) -> list[Vector]:
+    """
+    Builds unit length TF-IDF vectors from the n-gram counts of each document
+    """
+    frequency = Counter(gram for document in documents for gram in document)
+    count = len(documents)
+    idf = {gram: math.log((1 + count) / (1 + df)) + 1 for gram, df in frequency.items()}
+
+    vectors = []
+    for document in documents:
+        vector = {gram: (1 + math.log(tf)) * idf[gram] for gram, tf in document.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        vectors.append({gram: w / norm for gram, w in vector.items()} if norm else {})
+
+    return vectors
+
+
+def shortlist(
+    main_transactions: list[TransactionObject],
+    venmos: list[TransactionObject],
+    k: int = TOP_K,
+) -> dict[int, list[int]]:
+    """
+    Retrieves the `k` main transactions each venmo most plausibly reimburses,
+    so a venmo only needs to be compared against (and prompted with) those
+    instead of every main transaction.
+
+    Main transactions are ranked by the similarity of their payee, notes and
+    original name to the venmo sender and note. When fewer than `k` feasible
+    main transactions share any text with the venmo, the shortlist is filled
+    with the feasible main transactions closest in date.
+
+    Returns the IDs of the shortlisted main transactions for each venmo ID.
+    """
+    vectors = vectorize(
+        [ngrams(_main_text(t)) for t in main_transactions]
+        + [ngrams(_venmo_text(t)) for t in venmos]
+    )
+    main_vectors = vectors[: len(main_transactions)]
+    venmo_vectors = vectors[len(main_transactions) :]
+
+    # Inverted index of each n-gram to the main transactions containing it
+    postings: dict[str, list[tuple[int, float]]] = defaultdict(list)
+    for index, vector in enumerate(main_vectors):
+        for gram, weight in vector.items():
+            postings[gram].append((index, weight))
+
+    by_date = sorted(range(len(main_transactions)), key=lambda i: main_transactions[i].date)
+    dates = [main_transactions[i].date.toordinal() for i in by_date]
+
+    shortlists: dict[int, list[int]] = {}
+
+    for venmo, vector in zip(venmos, venmo_vectors):
+        scores: dict[int, float] = defaultdict(float)
+        for gram, weight in vector.items():
+            for index, main_weight in postings.get(gram, []):
+                scores[index] += weight * main_weight
+
+        # An even share of the transaction is as strong a signal as the text
+        for index, score in scores.items():
+            main = main_transactions[index]
+            if is_even_share(to_cents(main.amount), to_cents(abs(venmo.amount))):
+                scores[index] = score + 1
+
+        chosen = heapq.nsmallest(
+            k,
+            (i for i in scores if can_match(main_transactions[i], venmo)),
+            key=lambda i: (-scores[i], abs((venmo.date - main_transactions[i].date).days)),
+        )
+
+        # Fill up with the closest feasible main transactions before the venmo
+        position = bisect.bisect_right(dates, venmo.date.toordinal() + EARLY_VENMO_DAYS)
+        for i in reversed(by_date[:position]):
+            if len(chosen) >= k:
+                break
+            if i not in scores and can_match(main_transactions[i], venmo):
+                chosen.append(i)
+
+        shortlists[venmo.id] = [main_transactions[i].id for i in chosen]
+
+    return shortlists
@@ -0,0 +1,74 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from sentry_sdk.tracing import Span
+
+_enabled = False
+"""
+sentry_sdk is only imported once Sentry is initialized with a DSN, until then
+reporting does nothing
+"""
+
+
+class NoSpan:
+    """
+    Stands in for a Sentry span when Sentry is not enabled
+    """
+
+    def set_data(self, key: str, value: Any):
+        pass
+
+
+def init_sentry(dsn: str):
+    """
+    Integrations are listed explicitly. Sentry otherwise tries to enable an
+    integration for every library it supports, importing each of them (openai
+    included) before the run even starts.
+    """
+    global _enabled
+
+    import sentry_sdk
+    from sentry_sdk.integrations.httpx import HttpxIntegration
+
+    sentry_sdk.init(
+        dsn,
+        traces_sample_rate=1.0,
+        auto_enabling_integrations=False,
+        integrations=[HttpxIntegration()],
+    )
+    _enabled = True
+
+
+def capture_exception(error: BaseException):
+    if not _enabled:
+        return
+
+    import sentry_sdk
+
+    sentry_sdk.capture_exception(error)
+
+
+@contextmanager
+def start_span(op: str) -> Iterator["Span | NoSpan"]:
+    if not _enabled:
+        yield NoSpan()
+        return
+
+    import sentry_sdk
+
+    with sentry_sdk.start_span(op=op) as span:
+        yield span
+
+
+@contextmanager
+def start_transaction(op: str, name: str) -> Iterator["Span | NoSpan"]:
+    if not _enabled:
+        yield NoSpan()
+        return
+
+    import sentry_sdk
+
+    with sentry_sdk.start_transaction(op=op, name=name) as transaction:
+        yield transaction
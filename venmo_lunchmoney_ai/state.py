@@ -1,14 +1,478 @@
+import hashlib
 import json
+import logging
+import os
+import sqlite3
+from collections.abc import Iterator
+from contextlib import closing, contextmanager
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, timedelta
 
+from lunchable.models import TransactionObject
 
-def get_prev_unprocessed_transactions(file: str) -> set[int]:
+from venmo_lunchmoney_ai.aliases import Alias, AliasIndex
+from venmo_lunchmoney_ai.types import ReimbursementGroup
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    verdict TEXT
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS journal (
+    main_id INTEGER PRIMARY KEY,
+    group_json TEXT NOT NULL,
+    split_id INTEGER,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created TEXT NOT NULL,
+    updated TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS aliases (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    alias TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    updated TEXT NOT NULL,
+    PRIMARY KEY (kind, key, alias)
+);
+
+CREATE TABLE IF NOT EXISTS learned_groups (
+    group_id INTEGER PRIMARY KEY
+);
+"""
+
+LEGACY_FINGERPRINT = ""
+"""
+Fingerprint given to transactions migrated from the legacy JSON state file.
+Since we never knew their content, the first time we see them again we adopt
+whatever their content is instead of treating them as changed.
+"""
+
+RETRY_FINGERPRINT = "retry"
+"""
+Fingerprint given to transactions whose prompt failed. It never matches the
+content of a transaction, so they are treated as changed and prompted again.
+"""
+
+MAX_PROMPT_ATTEMPTS = 3
+"""
+How many runs in a row may fail to prompt a transaction before it is treated
+as looked at, and only prompted again once it changes.
+"""
+
+PRUNE_DAYS = 120
+"""
+Transactions not seen for this many days are removed from the state store.
+"""
+
+MAX_WRITE_ATTEMPTS = 5
+"""
+How many runs may attempt to write a journaled group to Lunch Money before it
+is abandoned and left for a human to look at.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(transaction: TransactionObject) -> str:
+    """
+    Produces a hash of the parts of a transaction that affect matching. If any
+    of these change the transaction needs to be looked at again.
+    """
+    content = [
+        str(transaction.date),
+        transaction.payee,
+        transaction.amount,
+        transaction.notes,
+        transaction.category_id,
+        sorted(t.id for t in transaction.tags or []),
+        transaction.group_id,
+    ]
+    return hashlib.sha1(json.dumps(content).encode()).hexdigest()
+
+
+@dataclass
+class JournalEntry:
+    """
+    A group which is planned to be written to Lunch Money, but which has not
+    been completely written yet.
+    """
+
+    group: ReimbursementGroup
+    split_id: int | None
+    """
+    The ID of the reimbursed portion of the main transaction, once the main
+    transaction has been split
+    """
+    attempts: int
+
+
+@dataclass
+class Precheck:
+    """
+    What the last successful run looked up, so the next run can check whether
+    anything changed since then without looking anything up again.
+    """
+
+    checked_at: datetime
+    """
+    When the last successful run started
+    """
+    venmo_category: str
+    venmo_category_id: int
+    reimbursement_tag: str
+    reimbursement_tag_id: int
+
+
+def _dump_group(group: ReimbursementGroup) -> str:
+    return json.dumps(
+        {
+            "transaction": group.transaction.model_dump(mode="json"),
+            "matches": [t.model_dump(mode="json") for t in group.matches],
+            "missing_reimbursements": group.missing_reimbursements,
+            "confidence": group.confidence,
+            "confidence_reason": group.confidence_reason,
+        }
+    )
+
+
+def _load_group(value: str) -> ReimbursementGroup:
+    data = json.loads(value)
+
+    return ReimbursementGroup(
+        transaction=TransactionObject.model_validate(data["transaction"]),
+        matches=[TransactionObject.model_validate(t) for t in data["matches"]],
+        missing_reimbursements=data["missing_reimbursements"],
+        confidence=data["confidence"],
+        confidence_reason=data["confidence_reason"],
+    )
+
+
+class StateStore:
+    """
+    Persistent per-transaction state used to track previous runs. Each
+    candidate transaction is recorded with a fingerprint of its content, when
+    it was last seen, how many runs in a row failed to prompt GPT-4 with it,
+    and the verdict of the last run.
+    """
+
+    def __init__(self, file: str, dry_run: bool = False):
+        self.file = file
+
+        # A dry run works on an in memory copy of the state, leaving the state
+        # file (and any legacy state file) untouched
+        self._memory: sqlite3.Connection | None = None
+
+        if dry_run:
+            self._memory = sqlite3.connect(":memory:")
+            legacy_ids = _read_legacy_state(file, move=False)
+
+            if not legacy_ids and os.path.exists(file):
+                with closing(sqlite3.connect(f"file:{file}?mode=ro", uri=True)) as source:
+                    source.backup(self._memory)
+        else:
+            legacy_ids = _read_legacy_state(file)
+
+        with self.connect() as conn:
+            conn.executescript(SCHEMA)
+
+            if legacy_ids:
+                now = datetime.now().isoformat()
+                conn.executemany(
+                    "INSERT OR IGNORE INTO transactions (id, fingerprint, first_seen, last_seen) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(id, LEGACY_FINGERPRINT, now, now) for id in legacy_ids],
+                )
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Opens the state database. Everything executed within the context is
+        committed atomically, or rolled back if an exception occurs.
+        """
+        if self._memory is not None:
+            with self._memory:
+                yield self._memory
+            return
+
+        conn = sqlite3.connect(self.file)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def changed_transactions(
+        self,
+        transactions: list[TransactionObject],
+    ) -> list[TransactionObject]:
+        """
+        Returns the transactions which are new or whose content has changed
+        since they were last recorded.
+        """
+        with self.connect() as conn:
+            known = dict(conn.execute("SELECT id, fingerprint FROM transactions"))
+
+        return [
+            t for t in transactions if known.get(t.id) not in (fingerprint(t), LEGACY_FINGERPRINT)
+        ]
+
+    def retry_count(self) -> int:
+        """
+        How many transactions are waiting to be prompted again after their
+        prompt failed
+        """
+        with self.connect() as conn:
+            (count,) = conn.execute(
+                "SELECT COUNT(*) FROM transactions WHERE fingerprint = ?", (RETRY_FINGERPRINT,)
+            ).fetchone()
+
+        return count
+
+    def _get_meta(self, key: str) -> str | None:
+        with self.connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+
+        return row[0] if row else None
+
+    def get_window_start(self) -> date | None:
+        """
+        The date of the oldest transaction still pending reimbursement as of
+        the last run.
+        """
+        value = self._get_meta("window_start")
+        return date.fromisoformat(value) if value else None
+
+    def get_last_full_sweep(self) -> datetime | None:
+        """
+        When we last looked back over the entire look-back window.
+        """
+        value = self._get_meta("last_full_sweep")
+        return datetime.fromisoformat(value) if value else None
+
+    def record_run(
+        self,
+        transactions: list[TransactionObject],
+        prompted_ids: set[int],
+        grouped_ids: set[int],
+        failed_ids: set[int],
+        window_start: date | None,
+        full_sweep: bool,
+    ):
+        """
+        Records the outcome of a run. This happens in a single database
+        transaction so a crash can never leave partially written state.
+
+        Transactions in `failed_ids` could not be prompted. They are left
+        changed so the next run prompts them again, until that has failed
+        MAX_PROMPT_ATTEMPTS runs in a row.
+        """
+        now = datetime.now()
+
+        with self.connect() as conn:
+            attempts = dict(conn.execute("SELECT id, attempts FROM transactions"))
+            rows = []
+
+            for t in transactions:
+                content = fingerprint(t)
+                failures = 0 if t.id in prompted_ids else attempts.get(t.id, 0)
+
+                if t.id in failed_ids:
+                    failures += 1
+                    if failures < MAX_PROMPT_ATTEMPTS:
+                        content = RETRY_FINGERPRINT
+                    else:
+                        logger.warn(f"Prompting failed {failures} times for {t.id}, giving up")
+                        failures = 0
+
+                verdict = "grouped" if t.id in grouped_ids else "pending"
+                rows.append((t.id, content, now.isoformat(), now.isoformat(), failures, verdict))
+
+            conn.executemany(
+                """
+                INSERT INTO transactions (id, fingerprint, first_seen, last_seen, attempts, verdict)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    fingerprint = excluded.fingerprint,
+                    last_seen = excluded.last_seen,
+                    attempts = excluded.attempts,
+                    verdict = excluded.verdict
+                """,
+                rows,
+            )
+            conn.execute(
+                "DELETE FROM transactions WHERE last_seen < ?",
+                ((now - timedelta(days=PRUNE_DAYS)).isoformat(),),
+            )
+
+            meta = [("window_start", window_start.isoformat() if window_start else "")]
+            if full_sweep:
+                meta.append(("last_full_sweep", now.isoformat()))
+
+            conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta)
+
+    def get_precheck(self) -> Precheck | None:
+        value = self._get_meta("precheck")
+        if not value:
+            return None
+
+        data = json.loads(value)
+        data["checked_at"] = datetime.fromisoformat(data["checked_at"])
+
+        return Precheck(**data)
+
+    def record_precheck(self, precheck: Precheck):
+        value = json.dumps({**asdict(precheck), "checked_at": precheck.checked_at.isoformat()})
+
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('precheck', ?)", (value,)
+            )
+
+    def load_aliases(self) -> AliasIndex:
+        with self.connect() as conn:
+            return AliasIndex(conn.execute("SELECT kind, key, alias, count FROM aliases"))
+
+    def learned_group_ids(self) -> set[int]:
+        with self.connect() as conn:
+            return set(id for (id,) in conn.execute("SELECT group_id FROM learned_groups"))
+
+    def record_aliases(self, aliases: list[Alias], group_id: int | None):
+        """
+        Records the aliases confirmed by a group. Each group is only learned
+        from once.
+        """
+        now = datetime.now().isoformat()
+
+        with self.connect() as conn:
+            if group_id is not None:
+                learned = conn.execute(
+                    "INSERT OR IGNORE INTO learned_groups (group_id) VALUES (?)", (group_id,)
+                ).rowcount
+                if not learned:
+                    return
+
+            conn.executemany(
+                """
+                INSERT INTO aliases (kind, key, alias, count, updated) VALUES (?, ?, ?, 1, ?)
+                ON CONFLICT (kind, key, alias) DO UPDATE SET
+                    count = count + 1,
+                    updated = excluded.updated
+                """,
+                [(kind, key, alias, now) for kind, key, alias in set(aliases)],
+            )
+
+    def plan_groups(self, groups: list[ReimbursementGroup]):
+        """
+        Journals the groups before any of them are written to Lunch Money. If
+        a run fails part way through writing a group, the next run resumes it
+        from the journal instead of matching its transactions again.
+
+        A group already journaled for the transaction is kept, unless it was
+        abandoned, in which case it is replaced by the new group.
+        """
+        now = datetime.now().isoformat()
+
+        with self.connect() as conn:
+            conn.executemany(
+                """
+                INSERT INTO journal (main_id, group_json, status, created, updated)
+                VALUES (?, ?, 'planned', ?, ?)
+                ON CONFLICT (main_id) DO UPDATE SET
+                    group_json = excluded.group_json,
+                    split_id = NULL,
+                    status = 'planned',
+                    attempts = 0,
+                    created = excluded.created,
+                    updated = excluded.updated
+                WHERE status = 'abandoned'
+                """,
+                [(g.transaction.id, _dump_group(g), now, now) for g in groups],
+            )
+
+    def record_split(self, main_id: int, split_id: int):
+        """
+        Records that the main transaction of a journaled group has been split,
+        so it is never split a second time.
+        """
+        with self.connect() as conn:
+            conn.execute(
+                "UPDATE journal SET split_id = ?, status = 'split', updated = ? WHERE main_id = ?",
+                (split_id, datetime.now().isoformat(), main_id),
+            )
+
+    def complete_group(self, main_id: int):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM journal WHERE main_id = ?", (main_id,))
+
+    def fail_group(self, main_id: int):
+        """
+        Records a failed attempt at writing a journaled group. Once a group
+        has failed too many times it is abandoned.
+        """
+        with self.connect() as conn:
+            conn.execute(
+                "UPDATE journal SET attempts = attempts + 1, updated = ? WHERE main_id = ?",
+                (datetime.now().isoformat(), main_id),
+            )
+            abandoned = conn.execute(
+                "UPDATE journal SET status = 'abandoned' WHERE main_id = ? AND attempts >= ?",
+                (main_id, MAX_WRITE_ATTEMPTS),
+            ).rowcount
+
+        if abandoned:
+            logger.error(f"Abandoned group for {main_id} after {MAX_WRITE_ATTEMPTS} attempts")
+
+    def pending_groups(self) -> list[JournalEntry]:
+        """
+        The journaled groups which still need to be written
+        """
+        with self.connect() as conn:
+            rows = conn.execute(
+                "SELECT group_json, split_id, attempts FROM journal "
+                "WHERE status != 'abandoned' ORDER BY created"
+            ).fetchall()
+
+        return [
+            JournalEntry(_load_group(group), split_id, attempts)
+            for group, split_id, attempts in rows
+        ]
+
+
+def _read_legacy_state(file: str, move: bool = True) -> list[int]:
+    """
+    Older versions stored a JSON list of the previously unprocessed
+    transaction IDs. When we find one of these files it is moved aside (unless
+    `move` is false) so the state database can take its place, and its IDs are
+    returned for migration.
+    """
     try:
-        with open(file, "r") as f:
-            return set(json.load(f))
+        with open(file, "rb") as f:
+            header = f.read(16)
     except FileNotFoundError:
-        return set()
+        return []
+
+    if header.startswith(b"SQLite format 3") or not header:
+        return []
+
+    with open(file, "r") as f:
+        transaction_ids = json.load(f)
+
+    if not move:
+        return transaction_ids
 
+    os.replace(file, f"{file}.legacy")
+    logger.info(f"Migrated legacy state file to database, moved original to {file}.legacy")
 
-def set_prev_unprocessed_transactions(file: str, transaction_ids: list[int]):
-    with open(file, "w") as f:
-        json.dump(transaction_ids, f)
+    return transaction_ids
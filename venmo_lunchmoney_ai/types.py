@@ -1,6 +1,7 @@
 import re
 from dataclasses import dataclass
 from decimal import Decimal
+from functools import cached_property
 from typing import List
 
 from lunchable.models import TransactionObject
@@ -47,17 +48,17 @@ class ReimbursementGroup:
         still missing_reimbursements or the `you_pay` is calculated as negative
         (GPT failed to match) the transaction is not ready.
         """
-        print(not self.missing_reimbursements and self.you_pay >= 0)
         return not self.missing_reimbursements and self.you_pay >= 0
 
-    @property
+    @cached_property
     def you_pay(self):
         """
-        Computes how much was not reimbursed for the transaction
+        Computes how much was not reimbursed for the transaction. The amounts
+        of a group never change, so this is only computed once.
         """
         return Decimal(str(self.transaction.amount)) - self.they_pay
 
-    @property
+    @cached_property
     def they_pay(self):
         """
         Computes how much was reimbursed for the transaction